@@ -0,0 +1,66 @@
+"""
+bench_ingest.py
+====================================
+Measures the ingest throughput of the DataBase with one commit per record
+(as Record.get_record writes outside a batch) and with batched writes,
+for a few pragma settings.
+
+    $ python benchmarks/bench_ingest.py --n 2000 --storage pickle
+"""
+
+import os
+import sys
+import time
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)),
+ '..'))
+
+from tsprocess.database import DataBase
+from bench_storage import sample_record
+
+
+PRAGMAS = {
+    'default': {},
+    'wal': {'journal_mode': 'WAL', 'synchronous': 'NORMAL'},
+}
+
+
+def ingest(db, record, n, batched):
+    """ Returns the number of records written per second. """
+    t_0 = time.perf_counter()
+    if batched:
+        with db.batch():
+            for i in range(n):
+                db.set_value(f'record_{i}', record)
+    else:
+        for i in range(n):
+            db.set_value(f'record_{i}', record)
+    db.db.commit()
+    return n / (time.perf_counter() - t_0)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--n', type=int, default=2000,
+     help='number of records')
+    parser.add_argument('--storage', default='pickle',
+     choices=DataBase.valid_storages)
+    args = parser.parse_args()
+
+    record = sample_record()
+    print(f"{'pragmas':<10} {'mode':<10} {'records/s':>10}")
+    for pragma_name, pragmas in PRAGMAS.items():
+        for batched in [False, True]:
+            with tempfile.TemporaryDirectory() as tmp_dir:
+                db = DataBase(os.path.join(tmp_dir, 'bench_db'), 100,
+                 storage=args.storage, pragmas=pragmas)
+                rate = ingest(db, record, args.n, batched)
+                db.close_db()
+            mode = 'batch' if batched else 'per-record'
+            print(f"{pragma_name:<10} {mode:<10} {rate:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+"""
+bench_labels.py
+====================================
+Measures the time of applying timeseries processing labels on a record,
+one timeseries at a time and in one vectorized call over the channels,
+and checks that both give the same values.
+
+    $ python benchmarks/bench_labels.py --repeat 20
+"""
+
+import os
+import sys
+import time
+import argparse
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)),
+ '..'))
+
+from tsprocess.record import Record
+from tsprocess.timeseries import TimeSeries
+from bench_storage import sample_record
+
+
+LABELS = {
+    'lowpass': ['lowpass_filter', {'fc': 1, 'N': 4}],
+    'highpass': ['highpass_filter', {'fc': 0.1, 'N': 4}],
+    'bandpass': ['bandpass_filter', {'fcs': np.array([0.1, 2]), 'N': 4}],
+    'taper': ['taper', {'flag': 'all', 'm': 50}],
+    'scale': ['scale', {'factor': 2.5}],
+    'cut': ['cut', {'flag': 'front', 't_diff': 5, 'm': 50}],
+    'zero_pad': ['zero_pad', {'flag': 'end', 't_diff': 5, 'm': 50}],
+}
+
+
+def per_component(record, label_name):
+    """ Returns the processed timeseries, applied one by one. """
+    return [getattr(record, name)._apply(label_name) for names in
+     Record.channel_names for name in names]
+
+
+def timed(function, repeat):
+    """ Returns the result and the best time (s) of repeat calls. """
+    best = float('inf')
+    for _ in range(repeat):
+        t_0 = time.perf_counter()
+        result = function()
+        best = min(best, time.perf_counter() - t_0)
+    return result, best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--repeat', type=int, default=20,
+     help='number of repetitions (the best time is reported)')
+    args = parser.parse_args()
+
+    record = sample_record()
+    TimeSeries.processing_labels.update(LABELS)
+    print(f"{'label':<10} {'per-ts (ms)':>12} {'batched (ms)':>13}"
+     f" {'speedup':>8} {'equal':>6}")
+    for label_name in LABELS:
+        single, t_single = timed(lambda: per_component(record, label_name),
+         args.repeat)
+        batched, t_batched = timed(lambda: Record._apply_on_channels(record,
+         label_name), args.repeat)
+        equal = all(np.array_equal(ts.value, values) for ts, values in
+         zip(single, batched.reshape(9, batched.shape[-1])))
+        print(f"{label_name:<10} {1000*t_single:>12.2f}"
+         f" {1000*t_batched:>13.2f} {t_single/t_batched:>8.1f} {equal!s:>6}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+"""
+bench_storage.py
+====================================
+Compares saving and loading records with the pickle (SqliteDict) and the
+columnar storage backends.
+
+    $ python benchmarks/bench_storage.py --n 10000
+"""
+
+import os
+import sys
+import time
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)),
+ '..'))
+
+from sqlitedict import SqliteDict
+
+from tsprocess import ts_utils as tsu
+from tsprocess.record import Record
+from tsprocess.station import Station
+from tsprocess.storage import ColumnarStore
+
+
+def sample_record():
+    sample_file = os.path.join(os.path.dirname(os.path.realpath(__file__)),
+     '..', 'tests', 'sample_test_files', 'CE12102.V2')
+    signal, metadata = tsu.read_smc_v2(sample_file)
+    return Record._from_cesmdv2(signal, metadata, Station(33.9,-117.0,0),
+     (34.0,-117.5,10), 'CE12102.V2')
+
+
+def run(store, record, n):
+    """ Returns save and load time (s) of n records. """
+    t_0 = time.perf_counter()
+    for i in range(n):
+        store[f'record_{i}'] = record
+    store.commit()
+    t_1 = time.perf_counter()
+    for i in range(n):
+        store[f'record_{i}']
+    t_2 = time.perf_counter()
+    return t_1 - t_0, t_2 - t_1
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--n', type=int, default=10000,
+     help='number of records')
+    args = parser.parse_args()
+
+    record = sample_record()
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        backends = {
+            'pickle': SqliteDict(os.path.join(tmp_dir, 'pickle.sqlite')),
+            'columnar': ColumnarStore(os.path.join(tmp_dir,
+             'columnar.sqlite'), autocommit=False)
+        }
+        print(f"{'backend':<10} {'save (s)':>10} {'load (s)':>10}"
+         f" {'load/record (ms)':>18}")
+        for name, store in backends.items():
+            t_save, t_load = run(store, record, args.n)
+            store.close()
+            print(f"{name:<10} {t_save:>10.2f} {t_load:>10.2f}"
+             f" {1000*t_load/args.n:>18.3f}")
+
+
+if __name__ == "__main__":
+    main()
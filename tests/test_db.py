@@ -1,9 +1,32 @@
 import os
 import glob
+import shutil
 import unittest
+import sqlite3
 import doctest
+import threading
+import multiprocessing
+
+import numpy as np
 
 import tsprocess.database as database
+from tsprocess.storage import ArrayCodec
+
+
+def mp_worker(worker_id, n_workers, n_records, storage):
+    """ Writes n_records records, and reads the records of the other 
+    workers. Exits with a non-zero code if a record is not correct. """
+    db = database.DataBase('mytest_mp', 5, storage=storage, multiprocess=True)
+    for i in range(n_records):
+        with db.batch():
+            db.set_value(f'p{worker_id}_{i}', np.full(500, worker_id*1000+i))
+            db.update_nested_container('mp_tracker', f'w{worker_id}', [i])
+        for other in range(n_workers):
+            value = db.get_value(f'p{other}_{i}')
+            if value is not None and value[0] != other*1000+i:
+                os._exit(1)
+    db.close_db()
+    os._exit(0)
 
 class TestDataBase(unittest.TestCase):
     def setUp(self):
@@ -21,8 +44,217 @@ class TestDataBase(unittest.TestCase):
         db_3.set_value('x1',100)
         self.assertEqual(db_3.get_value('x1'),100)
 
+    def test_cache_is_lru(self):
+        db_4 = database.DataBase('mytest',2)
+        db_4.set_value('x1',1)
+        db_4.set_value('x2',2)
+        # hit on x1 makes x2 the least recently used item.
+        db_4.get_value('x1')
+        db_4.set_value('x3',3)
+        self.assertEqual(list(db_4.cache.keys()),['x1','x3'])
+        self.assertEqual(db_4.cache_info()['evictions'],1)
+
+    def test_cache_byte_budget(self):
+        db_5 = database.DataBase('mytest',100, cache_bytes=20000)
+        for i in range(5):
+            db_5.set_value(f'a{i}', np.zeros(1000))
+        self.assertTrue(db_5.cache_nbytes <= 20000)
+        self.assertEqual(list(db_5.cache.keys()),['a3','a4'])
+        self.assertEqual(db_5.cache_info()['evictions'],3)
+        # evicted values are still on the disk.
+        self.assertEqual(len(db_5.get_value('a0')),1000)
+
+    def test_set_value_refreshes_cache(self):
+        db_6 = database.DataBase('mytest',10)
+        db_6.set_value('x1',100)
+        db_6.get_value('x1')
+        db_6.set_value('x1',200)
+        self.assertEqual(db_6.cache['x1'][0],200)
+        self.assertEqual(db_6.get_value('x1'),200)
+
+    def test_batch_commits_once(self):
+        db_7 = database.DataBase('mytest',10)
+        conn = sqlite3.connect('mytest.sqlite')
+        with db_7.batch():
+            db_7.set_many({'b1': 1, 'b2': 2})
+            db_7.set_value('b3', 3)
+            self.assertEqual(conn.execute('SELECT COUNT(*) FROM unnamed'
+             ' WHERE key LIKE "b%"').fetchone()[0], 0)
+        self.assertEqual(conn.execute('SELECT COUNT(*) FROM unnamed'
+         ' WHERE key LIKE "b%"').fetchone()[0], 3)
+        conn.close()
+
+    def test_multiprocess_batch_is_written_in_parts(self):
+        db_14 = database.DataBase('mytest', 10, write_queue_size=3,
+         multiprocess=True)
+        conn = sqlite3.connect('mytest.sqlite')
+        with db_14.batch():
+            db_14.set_many({f'c{i}': i for i in range(7)})
+            self.assertEqual(len(db_14._batched), 1)
+            self.assertEqual(conn.execute('SELECT COUNT(*) FROM unnamed'
+             ' WHERE key LIKE "c%"').fetchone()[0], 6)
+        self.assertEqual(conn.execute('SELECT COUNT(*) FROM unnamed'
+         ' WHERE key LIKE "c%"').fetchone()[0], 7)
+        conn.close()
+        db_14.close_db()
+
+    def test_set_value_returns_stored_size(self):
+        db_15 = database.DataBase('mytest', 10)
+        nbytes = db_15.set_value('s1', np.arange(1000))
+        db_15.flush()
+        conn = sqlite3.connect('mytest.sqlite')
+        self.assertEqual(conn.execute('SELECT LENGTH(value) FROM unnamed'
+         ' WHERE key = "s1"').fetchone()[0], nbytes)
+        conn.close()
+        self.assertEqual(db_15.stored_sizes(), {'s1': nbytes})
+        self.assertEqual(db_15.stored_sizes(), {})
+        db_15.close_db()
+
+        # queued writes are sized when they are written.
+        db_15 = database.DataBase('mytest', 10, write_behind=True)
+        self.assertIsNone(db_15.set_value('s2', np.arange(1000)))
+        db_15.flush()
+        self.assertEqual(db_15.stored_sizes()['s2'], nbytes)
+        db_15.close_db()
+
+    def test_get_many(self):
+        for storage in ['pickle', 'columnar']:
+            db_8 = database.DataBase('mytest',1, storage=storage)
+            db_8.set_many([('g1', 1), ('g2', np.arange(3))])
+            values = db_8.get_many(['g1', 'g2', 'g3'])
+            self.assertEqual(values['g1'], 1)
+            self.assertEqual(values['g2'].tolist(), [0, 1, 2])
+            self.assertEqual(values['g3'], None)
+            db_8.close_db()
+
+    def test_pragmas(self):
+        db_9 = database.DataBase('mytest', 10, storage='columnar',
+         pragmas={'journal_mode': 'WAL', 'synchronous': 'NORMAL'})
+        self.assertEqual(db_9.db.conn.select_one('PRAGMA journal_mode')[0],
+         'wal')
+        self.assertEqual(db_9.db.conn.select_one('PRAGMA synchronous')[0], 1)
+        db_9.close_db()
+
+    def test_compressed_pickle_storage(self):
+        db_10 = database.DataBase('mytest_zlib', 10,
+         codec=ArrayCodec('zlib', 6, shuffle=True))
+        db_10.set_value('c1', {'a': np.zeros(10000)})
+        db_10.cache.clear()
+        self.assertEqual(db_10.get_value('c1')['a'].sum(), 0)
+        self.assertTrue(db_10.compression_info()['ratio'] > 10)
+        db_10.close_db()
+
+    def test_io_stats(self):
+        db_11 = database.DataBase('mytest11', 1)
+        db_11.set_value('a', np.arange(100))
+        db_11.set_value('b', np.arange(100))
+        db_11.get_value('b')
+        db_11.get_value('a')
+        db_11.get_many(['a', 'b', 'c'])
+        stats = db_11.io_stats(reset=True)
+        counters = stats['counters']
+        self.assertEqual(counters['cache_hits'], 2)
+        self.assertEqual(counters['cache_misses'], 3)
+        self.assertEqual(counters['disk_reads'], 3)
+        self.assertEqual(counters['disk_writes'], 2)
+        self.assertEqual(counters['evictions'], 3)
+        self.assertTrue(counters['bytes_written'] > 1600)
+        self.assertTrue(counters['bytes_read'] > 1600)
+        self.assertEqual(stats['latencies']['disk_read']['count'], 2)
+        self.assertEqual(sum(stats['latencies']['serialize']
+         ['buckets'].values()), 2)
+        stats = db_11.io_stats()
+        self.assertEqual(stats['counters'], {'cache_hits': 0,
+         'cache_misses': 0})
+        self.assertEqual(stats['latencies'], {})
+        db_11.close_db()
+
+    def test_write_behind(self):
+        db_11 = database.DataBase('mytest', 2, write_behind=True,
+         write_queue_size=4)
+        for i in range(20):
+            db_11.set_value(f'w{i}', np.arange(i))
+        # read-your-writes, also for values evicted from the cache.
+        self.assertEqual(db_11.get_value('w3').tolist(), [0, 1, 2])
+        db_11.delete_value('w4')
+        self.assertEqual(db_11.get_value('w4'), None)
+        db_11.update_nested_container('w_tracker', 'inc', [1])
+        db_11.flush()
+        self.assertEqual(db_11._pending, {})
+        conn = sqlite3.connect('mytest.sqlite')
+        self.assertEqual(conn.execute('SELECT COUNT(*) FROM unnamed'
+         ' WHERE key LIKE "w%"').fetchone()[0], 19)
+        conn.close()
+        db_11.close_db()
+        self.assertEqual(db_11._writer, None)
+
+    def test_delete_many_and_reclaim_space(self):
+        for storage, write_behind in [('pickle', False), ('columnar', False),
+         ('pickle', True)]:
+            db_13 = database.DataBase('mytest_del', 10, storage=storage,
+             write_behind=write_behind)
+            db_13.set_many({f'd{i}': np.random.rand(20000) for i in range(20)})
+            db_13.flush()
+            size = os.path.getsize('mytest_del.sqlite')
+            thread = db_13.delete_many([f'd{i}' for i in range(15)],
+             background=True)
+            if thread is not None:
+                thread.join()
+            db_13.flush()
+            self.assertEqual(db_13.get_value('d0'), None)
+            self.assertEqual(len(db_13.get_value('d19')), 20000)
+            # the chunks run between the writes of another thread.
+            with db_13.batch():
+                db_13.set_value('d20', 1)
+                released = []
+                reclaim = threading.Thread(target=lambda: released.append(
+                 db_13.reclaim_space(chunk_pages=16)))
+                reclaim.start()
+                reclaim.join(10)
+            self.assertTrue(released[0] > 0)
+            self.assertTrue(os.path.getsize('mytest_del.sqlite') < size/2)
+            db_13.close_db()
+            # failures are logged.
+            with self.assertLogs('tsprocess', 'WARNING'):
+                self.assertEqual(db_13.reclaim_space(), 0)
+            os.remove('mytest_del.sqlite')
+
+    @unittest.skipUnless('fork' in multiprocessing.get_all_start_methods(),
+     'requires fork')
+    def test_multiprocess_stress(self):
+        n_workers, n_records = 4, 100
+        ctx = multiprocessing.get_context('fork')
+        for storage in ['pickle', 'mmap']:
+            db_12 = database.DataBase('mytest_mp', 5, storage=storage,
+             multiprocess=True)
+            db_12.set_value('mp_tracker', {f'w{i}': [] for i in
+             range(n_workers)})
+            workers = [ctx.Process(target=mp_worker, args=(i, n_workers,
+             n_records, storage)) for i in range(n_workers)]
+            for worker in workers:
+                worker.start()
+            for worker in workers:
+                worker.join(120)
+                self.assertEqual(worker.exitcode, 0)
+
+            values = db_12.get_many([f'p{w}_{i}' for w in range(n_workers)
+             for i in range(n_records)])
+            self.assertTrue(all(value is not None and value[0] == int(
+             key[1:].split('_')[0])*1000 + int(key.split('_')[1])
+             for key, value in values.items()))
+            # read-modify-write of the tracker is not lost between processes.
+            tracker = db_12.get_nested_container('mp_tracker')
+            for i in range(n_workers):
+                self.assertEqual(tracker[f'w{i}'], list(range(n_records)))
+            db_12.close_db()
+            for f in glob.glob('mytest_mp*'):
+                if os.path.isdir(f):
+                    shutil.rmtree(f)
+                else:
+                    os.remove(f)
+
     def tearDown(self):
-        files = [glob.glob(e) for e in ['*.sqlite', '*.log']]
+        files = [glob.glob(e) for e in ['*.sqlite', '*.sqlite.lock', '*.log']]
         flat_list = [item for sublist in files for item in sublist]
         f_files = [os.path.join(os.path.dirname(os.path.realpath(__file__)),e)
          for e in flat_list]
@@ -0,0 +1,108 @@
+import os
+import glob
+import types
+import unittest
+
+import tsprocess.database as database
+from tsprocess.db_tracker import DataBaseTracker
+
+
+class TestDataBaseTracker(unittest.TestCase):
+
+    def setUp(self):
+        self.db = database.DataBase('test_tracker', 10)
+        self.project = types.SimpleNamespace(pr_db=self.db,
+         incidents={'inc1': None, 'inc2': None})
+
+    def count_rows(self, tracker):
+        return self.db.select(f'SELECT COUNT(*) FROM "{tracker.name}"')[0][0]
+
+    def test_track_and_list_hashes(self):
+        tracker = DataBaseTracker('t_dbtracker', self.project,
+         buffer_capacity=3)
+        tracker.track_incident_hash('inc1', 'h1', kind='original')
+        tracker.track_incident_hash('inc1', 'h2')
+        self.assertEqual(self.count_rows(tracker), 0)
+        # the third hash value fills the buffer.
+        tracker.track_incident_hash('inc2', 'h3')
+        self.assertEqual(self.count_rows(tracker), 3)
+        self.assertEqual(sorted(tracker.incident_hashes('inc1')),
+         ['h1', 'h2'])
+        self.assertEqual(tracker.incident_hashes('inc1', kind='original'),
+         ['h1'])
+        # unknown incidents are ignored.
+        tracker.track_incident_hash('inc3', 'h4')
+        self.assertEqual(tracker.incident_hashes('inc3'), [])
+
+    def test_remove_incident(self):
+        tracker = DataBaseTracker('t_dbtracker', self.project)
+        tracker.track_incident_hash('inc1', 'h1')
+        tracker.track_incident_hash('inc2', 'h2')
+        tracker.remove_incident('inc1')
+        self.assertEqual(tracker.incident_hashes('inc1'), [])
+        self.assertEqual(tracker.incident_hashes('inc2'), ['h2'])
+
+    def test_exclusive_hashes(self):
+        tracker = DataBaseTracker('t_dbtracker', self.project)
+        other = DataBaseTracker('o_dbtracker', self.project)
+        for hash_value in ['h1', 'h2', 'h3']:
+            tracker.track_incident_hash('inc1', hash_value)
+        tracker.track_incident_hash('inc2', 'h2')
+        other.track_incident_hash('inc1', 'h3')
+        other.add_to_database()
+        self.assertEqual(tracker.exclusive_hashes('inc1'), ['h1'])
+
+    def test_lineage(self):
+        tracker = DataBaseTracker('t_dbtracker', self.project)
+        tracker.track_lineage('h1', 'lp', 'h2')
+        tracker.track_lineage('h1', 'hp', 'h3')
+        tracker.track_lineage('h1', 'lp_copy', 'h2')
+        self.assertEqual(tracker.children('h1'), [('lp', 'h2'),
+         ('hp', 'h3')])
+        self.assertEqual(tracker.children('h2'), [])
+        tracker.remove_lineage(['h3'])
+        self.assertEqual(tracker.children('h1'), [('lp', 'h2')])
+
+    def test_catalog(self):
+        tracker = DataBaseTracker('t_dbtracker', self.project)
+        tracker.track_incident_hash('inc1', 'h1', kind='original',
+         nbytes=100)
+        tracker.track_incident_hash('inc1', 'h2', label='lp', nbytes=10)
+        tracker.track_incident_hash('inc1', 'h3', label='lp', nbytes=20)
+        tracker.track_incident_hash('inc2', 'h2', label='lp', nbytes=10)
+        # tracking the same record again is not counted.
+        tracker.track_incident_hash('inc1', 'h3', label='lp', nbytes=20)
+        catalog = [row[:4] for row in tracker.catalog()]
+        self.assertEqual(catalog, [('inc1', '', 1, 100), ('inc1', 'lp', 2, 30),
+         ('inc2', 'lp', 1, 10)])
+        tracker.remove_incident('inc1')
+        self.assertEqual([row[:4] for row in tracker.catalog()],
+         [('inc2', 'lp', 1, 10)])
+
+    def test_catalog_of_older_tracker(self):
+        self.db.execute('CREATE TABLE "t_dbtracker" (incident TEXT, hash TEXT,'
+         ' kind TEXT, created_at REAL, PRIMARY KEY (incident, hash))')
+        self.db.execute('INSERT INTO "t_dbtracker" VALUES'
+         ' (?,?,?,?)', [('inc1', 'h1', 'original', 1.0),
+         ('inc1', 'h2', 'processed', 2.0)], many=True)
+        tracker = DataBaseTracker('t_dbtracker', self.project)
+        self.assertEqual(tracker.catalog(), [('inc1', '', 2, 0, 1.0, 2.0)])
+        tracker.track_incident_hash('inc1', 'h3', label='lp', nbytes=5)
+        self.assertEqual(tracker.catalog()[1][:4], ('inc1', 'lp', 1, 5))
+
+    def test_import_container(self):
+        self.db.set_value('t_dbtracker', {'inc1': ['h1', 'h2'], 'inc2': []})
+        tracker = DataBaseTracker('t_dbtracker', self.project)
+        self.assertEqual(sorted(tracker.incident_hashes('inc1')),
+         ['h1', 'h2'])
+        self.assertEqual(self.db.get_value('t_dbtracker'), None)
+
+    def tearDown(self):
+        self.db.close_db()
+        files = [glob.glob(e) for e in ['*.sqlite', '*.log']]
+        flat_list = [item for sublist in files for item in sublist]
+        for f in flat_list:
+            try:
+                os.remove(f)
+            except Exception:
+                pass
@@ -3,6 +3,10 @@ import unittest
 
 import tsprocess.record as record
 import tsprocess.station as station
+import tsprocess.storage as storage
+import tsprocess.io_stats as io_stats
+import tsprocess.query_plan as query_plan
+import tsprocess.read_ahead as read_ahead
 import tsprocess.project as project
 import tsprocess.ts_utils as ts_utils
 import tsprocess.database as database
@@ -21,6 +25,10 @@ def test_doctest_suit():
     test_suit.addTest(doctest.DocTestSuite(project))
     test_suit.addTest(doctest.DocTestSuite(ts_utils))
     test_suit.addTest(doctest.DocTestSuite(database))
+    test_suit.addTest(doctest.DocTestSuite(storage))
+    test_suit.addTest(doctest.DocTestSuite(io_stats))
+    test_suit.addTest(doctest.DocTestSuite(query_plan))
+    test_suit.addTest(doctest.DocTestSuite(read_ahead))
     test_suit.addTest(doctest.DocTestSuite(incident))
     test_suit.addTest(doctest.DocTestSuite(timeseries))
     test_suit.addTest(doctest.DocTestSuite(ts_plot_utils))
@@ -1,8 +1,19 @@
+import io
 import os
 import glob
+import types
+import shutil
+import tempfile
 import unittest
+import contextlib
+
+import numpy as np
 
 from tsprocess.project import Project
+from tsprocess.record import Record
+from tsprocess.station import Station
+from tsprocess.timeseries import TimeSeries
+from tsprocess import ts_utils as tsu
 
 class TestProject(unittest.TestCase):
 
@@ -24,3 +35,384 @@ class TestProject(unittest.TestCase):
                 os.remove(f)
             except Exception:
                 pass
+
+
+class ProjectTestCase(unittest.TestCase):
+    """ Project with a temporary cesmdv2 incident (inc_a) of two stations.
+    """
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        os.makedirs(os.path.join(self.tmp_dir, 'seismic_records'))
+        Station.pr_source_loc = (34.0, -117.5, 10)
+        self.list_of_stations = Station.list_of_stations
+        Station.list_of_stations = []
+        for st_name, lat in [('CE12102.V2', 33.9), ('CE12502.V2', 33.8)]:
+            shutil.copy(os.path.join(os.path.dirname(os.path.realpath(
+             __file__)), 'sample_test_files', st_name), os.path.join(
+             self.tmp_dir, 'seismic_records'))
+            station = Station(lat, -117.0, 0)
+            station.inc_st_name['inc_a'] = st_name
+            Station.list_of_stations.append(station)
+
+        Project._instance = None
+        self.project = Project('prefetch_test',
+         {'cache_dir': self.tmp_dir})
+        self.project.incidents['inc_a'] = types.SimpleNamespace(metadata={
+         'incident_name': 'inc_a', 'incident_type': 'cesmdv2',
+         'incident_folder': self.tmp_dir})
+        TimeSeries.processing_labels['pf_lp'] = ['lowpass_filter',
+         {'fc': 1, 'N': 4}]
+        TimeSeries.processing_labels['pf_hp'] = ['highpass_filter',
+         {'fc': 0.1, 'N': 4}]
+
+    def reopen(self, **db_opt_params):
+        """ Opens the project again with the database options. """
+        self.project.close_database()
+        Project._instance = None
+        incidents = self.project.incidents
+        self.project = Project('prefetch_test', {'cache_dir': self.tmp_dir,
+         **db_opt_params})
+        self.project.incidents.update(incidents)
+
+    def tearDown(self):
+        TimeSeries.processing_labels.pop('pf_lp', None)
+        TimeSeries.processing_labels.pop('pf_hp', None)
+        Station.list_of_stations = self.list_of_stations
+        self.project.close_database()
+        Project._instance = None
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+
+
+class TestPrefetch(ProjectTestCase):
+
+    def test_prefetch_fills_the_cache(self):
+        thread = self.project.prefetch(['inc_a'], [['pf_lp']], [],
+         workers=2)
+        thread.join()
+        self.project.io_stats(reset=True)
+        records = self.project._extract_records(['inc_a'], [['pf_lp']], [])
+        self.assertEqual(len(records), 2)
+        self.assertTrue(all(record[0] is not None for record in records))
+        counters = self.project.io_stats()['counters']
+        self.assertEqual(counters.get('disk_reads', 0), 0)
+        self.assertEqual(counters['cache_hits'], 2)
+
+    def test_invalid_query_is_ignored(self):
+        self.assertIsNone(self.project.prefetch(['inc_b'], [['pf_lp']], []))
+
+
+class TestDiskQuota(ProjectTestCase):
+
+    def test_least_recently_used_processed_records_are_deleted(self):
+        lp_records = self.project._extract_records(['inc_a'], [['pf_lp']], [])
+        hp_records = self.project._extract_records(['inc_a'], [['pf_hp']], [])
+        db = self.project.pr_db
+        usage = db.disk_usage()
+        # half of the least recently used record is over the quota.
+        nbytes = self.project.pr_inc_tracker.lru_hashes()[0][1]
+        n_deleted = self.project.enforce_disk_quota(usage - nbytes//2)
+        self.assertEqual(n_deleted, 1)
+        self.assertTrue(db.disk_usage() <= usage - nbytes//2)
+        self.assertIsNone(db.get_value(lp_records[0][0].this_record_hash))
+        self.assertIsNotNone(db.get_value(hp_records[0][0].this_record_hash))
+
+        # originals are kept.
+        n_deleted = self.project.enforce_disk_quota(1)
+        self.assertEqual(n_deleted, 3)
+        kinds = {row[2] for row in self.project.pr_inc_tracker.records()}
+        self.assertEqual(kinds, {'original'})
+        self.assertEqual(len(db.db), 2)
+        # the tracked sizes are the stored sizes.
+        nbytes = db.db.conn.select_one('SELECT SUM(LENGTH(value)) FROM'
+         ' unnamed')[0]
+        self.assertEqual(sum(row[4] for row in
+         self.project.pr_inc_tracker.records()), nbytes)
+        # deleted records are processed again.
+        records = self.project._extract_records(['inc_a'], [['pf_lp']], [])
+        self.assertTrue(records[0][0].acc_h1.value.size > 0)
+
+    def test_mmap_records_are_kept(self):
+        self.reopen(storage='mmap')
+        records = self.project._extract_records(['inc_a'], [['pf_lp']], [])
+        with self.assertLogs('tsprocess', 'WARNING'):
+            self.assertEqual(self.project.enforce_disk_quota(1), 0)
+        self.assertIsNotNone(self.project.pr_db.get_value(
+         records[0][0].this_record_hash))
+
+
+class TestRemoveIncident(ProjectTestCase):
+
+    def test_shared_records_are_kept(self):
+        self.reopen(storage='mmap')
+        self.project.incidents['inc_b'] = types.SimpleNamespace(metadata={
+         'incident_name': 'inc_b', 'incident_type': 'cesmdv2',
+         'incident_folder': self.tmp_dir})
+        records = self.project._extract_records(['inc_a'], [['pf_lp']], [])
+        shared_hash = records[0][0].this_record_hash
+        self.project.pr_inc_tracker.track_incident_hash('inc_b', shared_hash)
+        self.project.remove_incident('inc_a')
+        self.project.pr_db.cache.clear()
+        self.assertIsNotNone(self.project.pr_db.get_value(shared_hash))
+        self.assertIsNone(self.project.pr_db.get_value(
+         records[1][0].this_record_hash))
+
+
+class TestDatabaseSummary(ProjectTestCase):
+
+    def test_items_are_counted_from_the_catalog(self):
+        self.project._extract_records(['inc_a'], [['pf_lp']], [])
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            self.project.database_summary()
+        self.assertIn('Number of items: 4', output.getvalue())
+
+
+class TestCheckpoint(ProjectTestCase):
+
+    def written_labels(self):
+        return sorted(row[3] for row in
+         self.project.pr_inc_tracker.records() if row[2] == 'processed')
+
+    def test_final_step_is_written(self):
+        self.project.set_checkpoint('final')
+        records = self.project._extract_records(['inc_a'],
+         [['pf_hp', 'pf_lp']], [])
+        self.assertEqual(self.written_labels(), ['pf_lp', 'pf_lp'])
+        # a warm query reads the final step.
+        self.project.pr_db.cache.clear()
+        again = self.project._extract_records(['inc_a'],
+         [['pf_hp', 'pf_lp']], [])
+        self.assertTrue(np.array_equal(again[0][0].channels,
+         records[0][0].channels))
+        # the result does not depend on the policy.
+        self.project.set_checkpoint('all')
+        Record.pr_db.delete_value(records[0][0].this_record_hash)
+        self.project.pr_db.cache.clear()
+        again = self.project._extract_records(['inc_a'],
+         [['pf_hp', 'pf_lp']], [])
+        self.assertTrue(np.array_equal(again[0][0].channels,
+         records[0][0].channels))
+
+    def test_label_policy(self):
+        self.project.set_checkpoint('none', label_name='pf_hp')
+        self.project.set_checkpoint('everything')
+        self.assertEqual(Record.checkpoint, 'all')
+        self.project._extract_records(['inc_a'], [['pf_hp', 'pf_lp']], [])
+        self.assertEqual(self.written_labels(), ['pf_lp', 'pf_lp'])
+        self.project.set_checkpoint(None, label_name='pf_hp')
+        self.assertEqual(Record.label_checkpoints, {})
+
+    def tearDown(self):
+        Record.label_checkpoints.clear()
+        super().tearDown()
+
+
+class TestQueryPlan(ProjectTestCase):
+
+    def test_shared_prefixes_are_processed_once(self):
+        TimeSeries.processing_labels['pf_sc'] = ['scale', {'factor': 3}]
+        self.project.set_checkpoint('none')
+        list_inc = ['inc_a', 'inc_a', 'inc_a']
+        list_process = [['pf_lp', 'pf_hp'], ['pf_lp', 'pf_hp', 'pf_sc'],
+         ['pf_lp']]
+        plan = self.project.explain(list_inc, list_process, [])
+        self.assertEqual((plan.n_steps, plan.n_planned_steps), (6, 3))
+        self.assertIn('3 processing step(s) per station', plan.explain())
+
+        records = [plan.execute(station, self.project.incidents) for station
+         in Station.list_of_stations]
+        self.assertEqual(plan.counts, {'original': 2, 'cached': 0,
+         'processed': 6})
+        for st_records in records:
+            self.assertTrue(np.allclose(st_records[1].channels,
+             3*st_records[0].channels))
+        # the same records as the chains processed on their own.
+        single = Record.get_record(Station.list_of_stations[0],
+         self.project.incidents['inc_a'].metadata, ['pf_lp', 'pf_hp'])
+        self.assertTrue(np.array_equal(single.channels,
+         records[0][0].channels))
+        self.assertEqual(self.project._extract_records(['inc_a', 'inc_b'],
+         [['pf_lp'], []], [])[0][1], None)
+
+    def tearDown(self):
+        TimeSeries.processing_labels.pop('pf_sc', None)
+        super().tearDown()
+
+
+class TestWriteBehind(ProjectTestCase):
+
+    def test_chain_lookups_do_not_wait_for_the_writes(self):
+        self.reopen(write_behind=True)
+        db = self.project.pr_db
+        joins = []
+        join = db._write_queue.join
+        db._write_queue.join = lambda: joins.append(1) or join()
+        self.project.pr_inc_tracker.buffer_capacity = 1
+        records = self.project._extract_records(['inc_a'], [['pf_lp']], [])
+        db.cache.clear()
+        self.project.io_stats(reset=True)
+        again = self.project._extract_records(['inc_a'], [['pf_lp']], [])
+        self.assertEqual(joins, [])
+        # the processed records are found by their chains.
+        self.assertEqual(self.project.io_stats()['counters']['disk_reads'], 2)
+        self.assertTrue(np.array_equal(again[1][0].channels,
+         records[1][0].channels))
+
+
+class TestExtractionPool(ProjectTestCase):
+
+    def test_workers_need_multiprocess_database(self):
+        with self.assertLogs('tsprocess', 'WARNING') as logs:
+            records = self.project._extract_records(['inc_a'], [['pf_lp']],
+             [], workers=2)
+        self.assertIn('multiprocess', logs.output[0])
+        self.assertTrue(all(record[0] is not None for record in records))
+
+    def test_workers_match_serial_path(self):
+        self.reopen(multiprocess=True)
+        chains = [['pf_lp', 'pf_hp'], []]
+        records = self.project._extract_records(['inc_a', 'inc_a'], chains,
+         [], workers=2)
+        self.assertIs(Record.pr_db, self.project.pr_db)
+        self.assertEqual([st_records[1].station.lat for st_records in
+         records], [station.lat for station in Station.list_of_stations])
+        rows = self.project.pr_inc_tracker.records()
+        self.assertEqual(sorted((row[2], row[3]) for row in rows),
+         [('original', None), ('original', None), ('processed', 'pf_hp'),
+         ('processed', 'pf_hp'), ('processed', 'pf_lp'),
+         ('processed', 'pf_lp')])
+        self.assertTrue(all(row[4] > 0 for row in rows))
+
+        # the written records are the ones of the serial path.
+        self.project.pr_db.cache.clear()
+        self.project.io_stats(reset=True)
+        serial = self.project._extract_records(['inc_a', 'inc_a'], chains, [],
+         workers=1)
+        counters = self.project.io_stats()['counters']
+        self.assertEqual(counters['disk_reads'], 4)
+        self.assertEqual(counters.get('disk_writes', 0), 0)
+        for st_records, st_serial in zip(records, serial):
+            for record, serial_record in zip(st_records, st_serial):
+                self.assertEqual(record.this_record_hash,
+                 serial_record.this_record_hash)
+                self.assertTrue(np.array_equal(record.channels,
+                 serial_record.channels))
+        lp = Record._apply(serial[0][1], 'pf_lp')
+        self.assertTrue(np.array_equal(Record._apply(lp, 'pf_hp').channels,
+         records[0][0].channels))
+
+
+class TestReadAhead(ProjectTestCase):
+
+    def test_station_files_are_read_ahead(self):
+        # the read-ahead threads also parse the files.
+        self.assertIsInstance(Project._read_source((Station.list_of_stations[0],
+         self.project.incidents['inc_a'].metadata)), Record)
+        self.project.db_opt_params['read_ahead'] = 2
+        self.project.io_stats(reset=True)
+        records = self.project._extract_records(['inc_a'], [[]], [])
+        self.assertIsNone(Record.read_ahead)
+        counters = self.project.io_stats()['counters']
+        self.assertEqual(counters.get('read_ahead_hits', 0) +
+         counters.get('read_ahead_stalls', 0), 2)
+        self.assertEqual(counters.get('read_ahead_misses', 0), 0)
+
+        # the records are the ones that are read from the files.
+        metadata = self.project.incidents['inc_a'].metadata
+        for station, st_records in zip(Station.list_of_stations, records):
+            st_name = station.inc_st_name['inc_a']
+            signal, file_metadata = tsu.read_smc_v2(os.path.join(
+             self.tmp_dir, 'seismic_records', st_name))
+            record = Record._from_cesmdv2(signal, file_metadata, station,
+             Station.pr_source_loc, st_name)
+            self.assertTrue(np.array_equal(st_records[0].channels,
+             record.channels))
+            self.assertEqual(st_records[0].unique_id_1,
+             Record._content_id(metadata, st_name, station))
+
+        # loaded records are not read again.
+        self.project.io_stats(reset=True)
+        self.project._extract_records(['inc_a'], [['pf_lp']], [])
+        counters = self.project.io_stats()['counters']
+        self.assertEqual(counters.get('read_ahead_hits', 0) +
+         counters.get('read_ahead_stalls', 0), 0)
+
+
+    def test_loaded_files_are_not_read_again_for_their_digest(self):
+        import tsprocess.record as record_module
+        memoized = []
+
+        def digest(filename):
+            stat = os.stat(filename)
+            memoized.append((os.path.realpath(filename), stat.st_size,
+             stat.st_mtime_ns) in tsu._file_digests)
+            return tsu.file_digest(filename)
+
+        tsu._file_digests.clear()
+        record_module.file_digest = digest
+        try:
+            self.project._extract_records(['inc_a'], [[]], [])
+        finally:
+            record_module.file_digest = tsu.file_digest
+        self.assertEqual(memoized, [True, True])
+
+
+class TestCacheSnapshot(ProjectTestCase):
+
+    def test_export_and_import(self):
+        records = self.project._extract_records(['inc_a'], [['pf_lp']], [])
+        archive = os.path.join(self.tmp_dir, 'cache.tar')
+        self.assertEqual(self.project.export_cache(archive, chunk_size=1,
+         workers=2), 4)
+        self.project.close_database()
+
+        # a new project (e.g., on another node) starts with the archive.
+        TimeSeries.processing_labels.pop('pf_lp')
+        Project._instance = None
+        self.project = Project('snapshot_test',
+         {'cache_dir': os.path.join(self.tmp_dir, 'other')})
+        self.project.incidents['inc_a'] = types.SimpleNamespace(metadata={
+         'incident_name': 'inc_a', 'incident_type': 'cesmdv2',
+         'incident_folder': self.tmp_dir})
+        self.assertEqual(self.project.import_cache(archive), 4)
+        self.assertEqual(TimeSeries.processing_labels['pf_lp'],
+         ['lowpass_filter', {'fc': 1, 'N': 4}])
+        # records that are already in the database are skipped.
+        self.assertEqual(self.project.import_cache(archive), 0)
+
+        self.project.pr_db.cache.clear()
+        self.project.io_stats(reset=True)
+        imported = self.project._extract_records(['inc_a'], [['pf_lp']], [])
+        self.assertEqual(self.project.io_stats()['counters']['disk_reads'],
+         2)
+        self.assertTrue(all(imported[i][0].acc_h1.value.tolist() ==
+         records[i][0].acc_h1.value.tolist() for i in range(2)))
+
+    def test_import_into_another_incident_folder(self):
+        records = self.project._extract_records(['inc_a'], [['pf_lp']], [])
+        archive = os.path.join(self.tmp_dir, 'cache.tar')
+        self.project.export_cache(archive)
+        self.project.close_database()
+
+        # the other node keeps a copy of the incident files.
+        copy_dir = os.path.join(self.tmp_dir, 'copy')
+        shutil.copytree(os.path.join(self.tmp_dir, 'seismic_records'),
+         os.path.join(copy_dir, 'seismic_records'))
+        Project._instance = None
+        self.project = Project('snapshot_test',
+         {'cache_dir': os.path.join(self.tmp_dir, 'other')})
+        self.project.incidents['inc_a'] = types.SimpleNamespace(metadata={
+         'incident_name': 'inc_a', 'incident_type': 'cesmdv2',
+         'incident_folder': copy_dir})
+        self.assertEqual(self.project.import_cache(archive), 4)
+
+        self.project.pr_db.cache.clear()
+        self.project.io_stats(reset=True)
+        imported = self.project._extract_records(['inc_a'], [['pf_lp']], [])
+        # the originals are not loaded from the files again.
+        self.assertEqual(self.project.io_stats()['counters'].get(
+         'disk_writes', 0), 0)
+        self.assertEqual(len(self.project.pr_db.db), 4)
+        self.assertTrue(all(imported[i][0].acc_h1.value.tolist() ==
+         records[i][0].acc_h1.value.tolist() for i in range(2)))
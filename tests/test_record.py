@@ -0,0 +1,226 @@
+import os
+import copy
+import types
+import pickle
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from tsprocess.record import Record
+from tsprocess.database import DataBase
+from tsprocess.db_tracker import DataBaseTracker
+from tsprocess.station import Station
+from tsprocess.timeseries import TimeSeries
+from tsprocess import ts_utils as tsu
+
+
+class TestRecordHash(unittest.TestCase):
+
+    def setUp(self):
+        Station.pr_source_loc = (34.0, -117.5, 10)
+        self.station = Station(33.9, -117.0, 0)
+        self.tmp_dir = tempfile.mkdtemp()
+        sample_file = os.path.join(os.path.dirname(os.path.realpath(
+            __file__)), 'sample_test_files', 'CE12102.V2')
+        self.metadata = []
+        for inc in ['inc_a', 'inc_b']:
+            os.makedirs(os.path.join(self.tmp_dir, inc, 'seismic_records'))
+            shutil.copy(sample_file, os.path.join(self.tmp_dir, inc,
+             'seismic_records', 'CE12102.V2'))
+            self.metadata.append({'incident_type': 'cesmdv2',
+             'incident_folder': os.path.join(self.tmp_dir, inc)})
+
+    def test_processing_hash_ignores_label_name(self):
+        TimeSeries.processing_labels['lp_a'] = ['lowpass_filter',
+         {'fc': 1, 'N': 4}]
+        TimeSeries.processing_labels['lp_b'] = ['lowpass_filter',
+         {'N': 4.0, 'fc': 1.0}]
+        TimeSeries.processing_labels['lp_c'] = ['lowpass_filter',
+         {'fc': 2, 'N': 4}]
+        self.assertEqual(Record.processing_hash('parent', 'lp_a'),
+         Record.processing_hash('parent', 'lp_b'))
+        self.assertNotEqual(Record.processing_hash('parent', 'lp_a'),
+         Record.processing_hash('parent', 'lp_c'))
+        self.assertNotEqual(Record.processing_hash('parent', 'lp_a'),
+         Record.processing_hash('other_parent', 'lp_a'))
+
+    def test_source_hashes_are_deterministic(self):
+        key_a = Record._original_hash('inc_a', 'CE12102.V2', self.station,
+         self.metadata[0])
+        self.assertEqual(key_a, Record._original_hash('inc_a', 'CE12102.V2',
+         self.station, self.metadata[0]))
+        # copies of the same file have the same content id.
+        self.assertEqual(
+            Record._content_id(self.metadata[0], 'CE12102.V2', self.station),
+            Record._content_id(self.metadata[1], 'CE12102.V2', self.station))
+        self.assertNotEqual(
+            Record._content_id(self.metadata[0], 'CE12102.V2', self.station),
+            Record._content_id(self.metadata[0], 'CE12102.V2',
+             Station(33.0, -117.0, 0)))
+
+    def tearDown(self):
+        for label in ['lp_a', 'lp_b', 'lp_c']:
+            TimeSeries.processing_labels.pop(label, None)
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+
+
+class TestProcessingChain(unittest.TestCase):
+
+    def setUp(self):
+        Station.pr_source_loc = (34.0, -117.5, 10)
+        self.station = Station(33.9, -117.0, 0)
+        self.station.inc_st_name['inc_a'] = 'CE12102.V2'
+        self.tmp_dir = tempfile.mkdtemp()
+        os.makedirs(os.path.join(self.tmp_dir, 'seismic_records'))
+        shutil.copy(os.path.join(os.path.dirname(os.path.realpath(__file__)),
+         'sample_test_files', 'CE12102.V2'), os.path.join(self.tmp_dir,
+         'seismic_records'))
+        self.metadata = {'incident_name': 'inc_a',
+         'incident_type': 'cesmdv2', 'incident_folder': self.tmp_dir}
+
+        self.db = DataBase(os.path.join(self.tmp_dir, 'test_chain'), 100)
+        project = types.SimpleNamespace(pr_db=self.db,
+         incidents={'inc_a': None})
+        Record.pr_db = self.db
+        Record.pr_inc_tracker = DataBaseTracker('t_dbtracker', project)
+        TimeSeries.processing_labels['ch_lp'] = ['lowpass_filter',
+         {'fc': 1, 'N': 4}]
+        TimeSeries.processing_labels['ch_sc'] = ['scale', {'factor': 2}]
+        TimeSeries.processing_labels['ch_sc3'] = ['scale', {'factor': 3}]
+
+        self.loaded = []
+        get_value = self.db.get_value
+        def counting_get_value(key):
+            self.loaded.append(key)
+            return get_value(key)
+        self.db.get_value = counting_get_value
+
+    def test_warm_chain_is_one_lookup(self):
+        record = Record.get_record(self.station, self.metadata,
+         ['ch_lp', 'ch_sc'])
+        self.db.cache.clear()
+        self.loaded.clear()
+        warm = Record.get_record(self.station, self.metadata,
+         ['ch_lp', 'ch_sc'])
+        self.assertEqual(self.loaded, [record.this_record_hash])
+        self.assertTrue(np.array_equal(warm.acc_h1.value,
+         record.acc_h1.value))
+
+    def test_cold_chain_resumes_from_prefix(self):
+        record = Record.get_record(self.station, self.metadata,
+         ['ch_lp', 'ch_sc'])
+        self.loaded.clear()
+        longer = Record.get_record(self.station, self.metadata,
+         ['ch_lp', 'ch_sc', 'ch_sc3'])
+        # the last processed part of the chain is loaded, not the original.
+        self.assertEqual(self.loaded[0], record.this_record_hash)
+        self.assertTrue(np.allclose(longer.acc_h1.value,
+         3*record.acc_h1.value))
+
+    def test_unchanged_record_keeps_parent_ids(self):
+        original = Record.get_record(self.station, self.metadata, [])
+        ids = (original.this_record_hash, original.unique_id_1)
+        Record.processing_labels['ch_vo'] = ['set_vertical_or',
+         {'ver_or': original.ver_or}]
+        try:
+            same = Record.get_record(self.station, self.metadata, ['ch_vo'])
+            lp = Record.get_record(self.station, self.metadata, ['ch_lp'])
+            same_lp = Record.get_record(self.station, self.metadata,
+             ['ch_vo', 'ch_lp'])
+        finally:
+            Record.processing_labels.pop('ch_vo')
+        self.assertEqual((original.this_record_hash, original.unique_id_1),
+         ids)
+        stored = self.db.get_value(ids[0])
+        self.assertEqual((stored.this_record_hash, stored.unique_id_1), ids)
+        self.assertNotEqual(same.this_record_hash, ids[0])
+        self.assertNotEqual(lp.this_record_hash, same_lp.this_record_hash)
+        self.assertTrue(np.array_equal(lp.channels, same_lp.channels))
+
+    def tearDown(self):
+        for label in ['ch_lp', 'ch_sc', 'ch_sc3']:
+            TimeSeries.processing_labels.pop(label, None)
+        self.db.close_db()
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+
+
+class TestRecordChannels(unittest.TestCase):
+
+    def setUp(self):
+        signal, metadata = tsu.read_smc_v2(os.path.join(os.path.dirname(
+         os.path.realpath(__file__)), 'sample_test_files', 'CE12102.V2'))
+        self.record = Record._from_cesmdv2(signal, metadata,
+         Station(33.9, -117.0, 0), (34.0, -117.5, 10), 'CE12102.V2')
+
+    def test_timeseries_are_views(self):
+        record = self.record
+        self.assertEqual(record.channels.shape[:2], (3, 3))
+        self.assertTrue(record.channels.flags.c_contiguous)
+        self.assertTrue(np.shares_memory(record.vel_h2.value,
+         record.channels))
+        self.assertTrue(np.array_equal(record.channels[2, 2],
+         record.acc_ver.value))
+        self.assertEqual(len(record.time_vec), record.channels.shape[-1])
+        self.assertEqual(len(record.freq_vec), len(record.acc_h1.fft_value))
+
+    def test_pickle_stores_one_buffer(self):
+        data = pickle.dumps(self.record)
+        self.assertTrue(len(data) < 1.1*self.record.channels.nbytes)
+        loaded = pickle.loads(data)
+        self.assertTrue(np.shares_memory(loaded.disp_h1.value,
+         loaded.channels))
+        self.assertTrue(np.array_equal(loaded.channels, self.record.channels))
+
+    def test_older_records_are_packed(self):
+        # records of older databases have separate arrays.
+        state = dict(self.record.__dict__)
+        del state['channels']
+        for names in Record.channel_names:
+            for name in names:
+                state[name] = copy.copy(state[name])
+                state[name].value = state[name].value.copy()
+        state['time_vec'] = self.record.time_vec
+        older = Record.__new__(Record)
+        older.__setstate__(state)
+        self.assertTrue(np.array_equal(older.channels, self.record.channels))
+        self.assertTrue(np.shares_memory(older.acc_h2.value, older.channels))
+
+    def test_rotation(self):
+        Record.processing_labels['rot_90'] = ['rotate', {'angle': 90}]
+        rotated = Record._apply(self.record, 'rot_90')
+        Record.processing_labels.pop('rot_90')
+        self.assertTrue(np.allclose(rotated.vel_h1.value,
+         -self.record.vel_h2.value))
+        self.assertTrue(np.allclose(rotated.vel_h2.value,
+         self.record.vel_h1.value))
+        self.assertTrue(np.array_equal(rotated.acc_ver.value,
+         self.record.acc_ver.value))
+        self.assertTrue(np.shares_memory(rotated.disp_h2.value,
+         rotated.channels))
+
+    def test_batched_labels_match_per_component(self):
+        labels = {
+            'bt_lp': ['lowpass_filter', {'fc': 1, 'N': 4}],
+            'bt_bp': ['bandpass_filter', {'fcs': np.array([0.1, 2]),
+             'N': 4}],
+            'bt_tp': ['taper', {'flag': 'all', 'm': 20}],
+            'bt_sc': ['scale', {'factor': 2.5}],
+            'bt_cut': ['cut', {'flag': 'end', 't_diff': 2, 'm': 10}],
+            'bt_zp': ['zero_pad', {'flag': 'front', 't_diff': 2, 'm': 10}],
+        }
+        TimeSeries.processing_labels.update(labels)
+        try:
+            for label_name in labels:
+                processed = Record._apply(self.record, label_name)
+                self.assertTrue(np.shares_memory(processed.vel_ver.value,
+                 processed.channels))
+                for names in Record.channel_names:
+                    for name in names:
+                        single = getattr(self.record, name)._apply(label_name)
+                        self.assertTrue(np.array_equal(
+                         getattr(processed, name).value, single.value))
+        finally:
+            for label_name in labels:
+                TimeSeries.processing_labels.pop(label_name)
@@ -0,0 +1,136 @@
+import os
+import mmap
+import pickle
+import shutil
+import unittest
+
+import numpy as np
+
+from tsprocess import ts_utils as tsu
+from tsprocess.record import Record
+from tsprocess.station import Station
+from tsprocess.storage import ColumnarStore, MemmapStore, ArrayCodec
+
+
+def load_sample_record(filename='CE12102.V2'):
+    signal, metadata = tsu.read_smc_v2(
+        os.path.join(os.path.dirname(os.path.realpath(__file__)),
+         'sample_test_files', filename))
+    return Record._from_cesmdv2(signal, metadata, Station(33.9,-117.0,0),
+     (34.0,-117.5,10), filename)
+
+
+class TestColumnarStore(unittest.TestCase):
+
+    def setUp(self):
+        self.store = ColumnarStore('test_columnar.sqlite')
+        self.record = load_sample_record()
+
+    def test_record_round_trip(self):
+        self.store['r1'] = self.record
+        loaded = self.store['r1']
+        self.assertTrue(isinstance(loaded, Record))
+        self.assertTrue(np.array_equal(loaded.acc_h1.value,
+         self.record.acc_h1.value))
+        self.assertTrue(np.array_equal(loaded.acc_ver.response_spectra[1],
+         self.record.acc_ver.response_spectra[1]))
+        self.assertEqual(loaded.station.lat, self.record.station.lat)
+        # arrays are zero-copy views on the stored blobs.
+        self.assertFalse(loaded.vel_h2.value.flags.writeable)
+
+    def test_override_and_delete(self):
+        self.store['r1'] = {'a': np.arange(5)}
+        self.store['r1'] = {'a': np.arange(3)}
+        self.assertEqual(self.store['r1']['a'].tolist(), [0, 1, 2])
+        self.assertEqual(len(self.store), 1)
+        del self.store['r1']
+        self.assertFalse('r1' in self.store)
+        with self.assertRaises(KeyError):
+            self.store['r1']
+
+    def tearDown(self):
+        self.store.close()
+        try:
+            os.remove('test_columnar.sqlite')
+        except Exception:
+            pass
+
+
+class TestMemmapStore(unittest.TestCase):
+
+    def setUp(self):
+        self.store = MemmapStore('test_memmap.sqlite')
+        self.record = load_sample_record()
+
+    def test_record_round_trip(self):
+        self.store.set('r1', self.record, 'incident_1')
+        loaded = self.store['r1']
+        self.assertTrue(np.array_equal(loaded.disp_ver.value,
+         self.record.disp_ver.value))
+        base = loaded.acc_h1.value
+        while isinstance(base, np.ndarray):
+            base = base.base
+        self.assertTrue(isinstance(base.obj, mmap.mmap))
+        self.assertEqual(self.store.segment_keys('incident_1'), ['r1'])
+
+    def test_unchanged_arrays_are_not_appended(self):
+        self.store.set('r1', self.record, 'incident_1')
+        seg_file = self.store._segment_path('incident_1')
+        size = os.path.getsize(seg_file)
+        self.record.processed.append('child_hash')
+        self.store['r1'] = self.record
+        self.assertEqual(os.path.getsize(seg_file), size)
+        self.assertEqual(self.store['r1'].processed, ['child_hash'])
+
+    def test_drop_segment(self):
+        self.store.set('r1', self.record, 'incident_1')
+        self.store.set('r2', {'a': np.arange(4)}, 'incident_2')
+        self.store.drop_segment('incident_1')
+        self.assertFalse('r1' in self.store)
+        self.assertFalse(os.path.exists(
+            self.store._segment_path('incident_1')))
+        self.assertEqual(self.store['r2']['a'].tolist(), [0, 1, 2, 3])
+
+    def tearDown(self):
+        self.store.close()
+        shutil.rmtree(self.store.segments_dir, ignore_errors=True)
+        try:
+            os.remove('test_memmap.sqlite')
+        except Exception:
+            pass
+
+
+class TestArrayCodec(unittest.TestCase):
+
+    def setUp(self):
+        self.record = load_sample_record()
+
+    def test_array_round_trip(self):
+        array = self.record.acc_h1.value
+        for name in ['none', 'zlib', 'lzma', 'bz2']:
+            for shuffle in [False, True]:
+                codec = ArrayCodec(name, shuffle=shuffle)
+                tag, data = codec.encode(array)
+                decoded = codec.decode(tag, data, array.dtype.str,
+                 array.shape)
+                self.assertTrue(np.array_equal(decoded, array))
+
+    def test_compressed_columnar_store(self):
+        store = ColumnarStore('test_codec.sqlite',
+         codec=ArrayCodec('zlib', 6, shuffle=True))
+        store['r1'] = self.record
+        self.assertTrue(np.array_equal(store['r1'].vel_ver.value,
+         self.record.vel_ver.value))
+        raw, stored = store.compression_stats()
+        self.assertTrue(raw > stored)
+        store.close()
+        os.remove('test_codec.sqlite')
+
+    def test_value_round_trip(self):
+        codec = ArrayCodec('lzma', 1, shuffle=True)
+        loaded = codec.decode_value(codec.encode_value(self.record))
+        self.assertTrue(np.array_equal(loaded.disp_h2.value,
+         self.record.disp_h2.value))
+        # plain pickles are also accepted.
+        self.assertEqual(codec.decode_value(pickle.dumps({'a': 1})),
+         {'a': 1})
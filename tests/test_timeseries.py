@@ -0,0 +1,86 @@
+import pickle
+import unittest
+
+import numpy as np
+from scipy.signal import butter, zpk2sos, sosfiltfilt
+
+from tsprocess.timeseries import TimeSeries, Disp, Acc
+from tsprocess.ts_utils import FAS, get_period, cal_acc_response
+
+
+class TestLazyValues(unittest.TestCase):
+
+    def setUp(self):
+        t = np.arange(0, 20, 0.01)
+        self.value = np.sin(2*np.pi*t) * np.exp(-0.2*t)
+
+    def test_values_are_computed_on_first_access(self):
+        acc = Acc(self.value, 0.01, 0)
+        self.assertIsNone(acc._fft_value)
+        self.assertIsNone(acc._response_spectra)
+        self.assertIsNone(acc._peak_vv)
+
+        freq, afs = FAS(self.value, 0.01, len(self.value), 0.1, 100, 3)
+        self.assertTrue(np.array_equal(acc.fft_value, afs))
+        self.assertEqual(acc.delta_f, freq[1] - freq[0])
+        self.assertEqual(acc.peak_vv, np.max(abs(self.value)))
+        self.assertEqual(acc.peak_vt, np.argmax(abs(self.value)))
+        period = get_period(0.1, 10)
+        self.assertTrue(np.array_equal(acc.response_spectra[1],
+         cal_acc_response(period, self.value, 0.01)))
+        # computed values are kept.
+        self.assertIs(acc.fft_value, acc.fft_value)
+
+    def test_older_pickles(self):
+        disp = Disp(self.value, 0.01, 0)
+        state = dict(disp.__dict__)
+        for name in ['fft_value', 'delta_f', 'peak_vv']:
+            state[name] = state.pop('_' + name)
+        state['fft_value'] = np.ones(3)
+        older = Disp.__new__(Disp)
+        older.__setstate__(state)
+        self.assertEqual(older.fft_value.tolist(), [1, 1, 1])
+        loaded = pickle.loads(pickle.dumps(older))
+        self.assertEqual(loaded.fft_value.tolist(), [1, 1, 1])
+        self.assertEqual(loaded.peak_vv, np.max(abs(self.value)))
+
+
+class TestFilterDesignCache(unittest.TestCase):
+
+    def setUp(self):
+        TimeSeries.clear_sos_cache()
+        t = np.arange(0, 20, 0.01)
+        self.acc = Acc(np.sin(2*np.pi*t) + np.sin(2*np.pi*8*t), 0.01, 0)
+
+    def test_cached_filters_are_identical(self):
+        z, p, k = butter(N=4, Wn=1/(100/2), btype='lowpass', output='zpk')
+        uncached = sosfiltfilt(zpk2sos(z, p, k), self.acc.value)
+        first = self.acc._lowpass_filter(1)
+        second = self.acc._lowpass_filter(1)
+        self.assertTrue(np.array_equal(first, uncached))
+        self.assertTrue(np.array_equal(second, uncached))
+        bandpass = self.acc._bandpass_filter(np.array([0.5, 2]))
+        self.assertTrue(np.array_equal(bandpass,
+         self.acc._bandpass_filter(np.array([0.5, 2]))))
+        info = TimeSeries.sos_cache_info(reset=True)
+        self.assertEqual((info["hits"], info["misses"], info["size"]),
+         (2, 2, 2))
+        self.assertEqual(TimeSeries.sos_cache_info()["hits"], 0)
+        # the shared sections can not be modified.
+        with self.assertRaises(ValueError):
+            TimeSeries._butter_sos('lowpass', 4, 1, 0.01)[0, 0] = 0
+
+    def test_cache_is_bounded(self):
+        capacity = TimeSeries.sos_cache_capacity
+        TimeSeries.sos_cache_capacity = 2
+        try:
+            for fc in [1, 2, 3, 1]:
+                self.acc._highpass_filter(fc)
+            info = TimeSeries.sos_cache_info()
+            self.assertEqual((info["hits"], info["misses"], info["size"]),
+             (0, 4, 2))
+        finally:
+            TimeSeries.sos_cache_capacity = capacity
+
+    def tearDown(self):
+        TimeSeries.clear_sos_cache()
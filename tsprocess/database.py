@@ -4,57 +4,742 @@ database.py
 The core module for communicating with the database.
 """
 
-from sqlitedict import SqliteDict
+import os
+import sys
+import time
+import queue
+import pickle
+import sqlite3
+import threading
+from contextlib import contextmanager
 from collections import OrderedDict
 
+import numpy as np
+from sqlitedict import SqliteDict
+
 from .log import LOGGER
+from .io_stats import IOStats
+from .storage import (ColumnarStore, MemmapStore, ArrayCodec, ProcessLock,
+                      ConnectionPool, pragma_statements, create_database)
+
+
+def sizeof_value(value, seen=None):
+    """ Returns an estimate of the in-memory size (in bytes) of a value. 
+    Numpy arrays are counted by their data buffer, containers and objects
+    (e.g., Record, TimeSeries) are followed recursively. Objects that are 
+    shared between several attributes are counted once.
+
+    Inputs:
+        | value: any python object
+        | seen: set of already counted object ids (internal use)
+
+    Outputs:
+        | estimated size in bytes
+
+    Example:
+
+    >>> sizeof_value(np.zeros(1000)) >= 8000
+    True
+    """
+    if seen is None:
+        seen = set()
+
+    if id(value) in seen:
+        return 0
+    seen.add(id(value))
+
+    if isinstance(value, np.ndarray):
+        # ndarray.__sizeof__ includes the data buffer only if it owns it.
+        if value.flags.owndata:
+            return sys.getsizeof(value)
+        if isinstance(value.base, np.ndarray):
+            # views (e.g., the timeseries of a Record) share the buffer of 
+            # their base array, which is counted once.
+            return sys.getsizeof(value) + sizeof_value(value.base, seen)
+        return sys.getsizeof(value) + value.nbytes
+
+    size = sys.getsizeof(value)
+
+    if isinstance(value, dict):
+        size += sum(sizeof_value(k, seen) + sizeof_value(v, seen)
+         for k, v in value.items())
+    elif isinstance(value, (list, tuple, set, frozenset)):
+        size += sum(sizeof_value(item, seen) for item in value)
+    elif hasattr(value, '__dict__'):
+        size += sizeof_value(vars(value), seen)
+
+    return size
+
 
 class DataBase:
-    """ DataBase class (singleton pattern) """
+    """ DataBase class (singleton pattern) 
+
+    Storage backends:
+        | pickle: each value is pickled into a SqliteDict (default).
+        | columnar: numpy arrays are stored as raw typed blobs next to a
+          small metadata row (see storage.ColumnarStore).
+        | mmap: numpy arrays are appended to one memory-mapped file per 
+          segment (incident), indexed in SQLite (see storage.MemmapStore).
+
+    Each write is committed on its own, unless it is issued inside a
+    batch() context, where all writes are committed in one transaction.
+    SQLite pragmas (e.g., journal_mode, synchronous, page_size) can be set
+    with the pragmas dictionary. page_size and auto_vacuum only apply to new
+    databases. New databases use incremental auto_vacuum, so the space of 
+    deleted values can be released in chunks (see reclaim_space).
+
+    Numpy arrays of the stored values are compressed one by one with the
+    codec (see storage.ArrayCodec), if it is provided.
+
+    With write_behind, writes are put in a bounded queue (write_queue_size)
+    and a background thread writes and commits them in batches. Values that
+    are waiting in the queue are served from memory, so reads always return
+    the latest written value. flush() waits until the queue is written; 
+    close_db() flushes the queue before closing.
+
+    With multiprocess, several processes (e.g., a multiprocessing pool or 
+    two notebooks) can use the same database file. The database runs in WAL
+    journal mode, so readers do not block the writer. Reads of the pickle
+    storage go through a pool of pool_size connections. Writes of all 
+    processes are serialized by an exclusive lock on the '<name>.lock' file;
+    writes inside a batch() are kept in memory and written together when the
+    batch exits, so the lock is not held while records are processed. Long
+    batches are written in parts of at most write_queue_size values (or a
+    quarter of cache_bytes), so they stay within the memory budget. A 
+    forked process opens its own connections on its first access.
+
+    Cache hits, misses, and evictions, disk reads and writes, bytes read and
+    written, and serialization time are counted in stats (see
+    io_stats.IOStats), with latency histograms. See io_stats().
+
+    The last access time of each value that is read or written in this 
+    session is kept in memory (see access_times), e.g., to evict the least
+    recently used values, and so is the stored (encoded) size of each 
+    written value (see stored_sizes).
+    """
 
     _instance = None
+    _deleted = object()
+    valid_storages = ["pickle", "columnar", "mmap"]
 
-    def __new__(cls, dbname, cache_size):
+    def __new__(cls, *args, **kwargs):
         if not cls._instance:
             cls._instance = super(DataBase, cls).__new__(cls)
         return cls._instance
 
-    def __init__(self, dbname, cache_size = 10000):
-        
+    def __init__(self, dbname, cache_size = 10000, cache_bytes = 2*1024**3,
+     storage = "pickle", pragmas = None, codec = None, write_behind = False,
+     write_queue_size = 256, multiprocess = False, pool_size = 4):
+
+        if getattr(self, "_writer", None) is not None:
+            # the singleton is re-initialized; writes the pending values first.
+            self._stop_writer()
+
+        if storage not in self.valid_storages:
+            LOGGER.warning(f"Storage '{storage}' is not supported. Valid"
+             f" storages: {self.valid_storages}. Uses 'pickle'.")
+            storage = "pickle"
+
         self.name = f'{dbname}.sqlite'
-        self.db = SqliteDict(self.name, autocommit=True)
+        self.storage = storage
+        self.multiprocess = multiprocess
+        self.pool_size = pool_size
+        self.pragmas = {"auto_vacuum": "INCREMENTAL", **(pragmas or {})}
+        if self.multiprocess:
+            self.pragmas = {"journal_mode": "WAL", "synchronous": "NORMAL",
+             "busy_timeout": 60000, **self.pragmas}
+        self.codec = codec or ArrayCodec()
+        self.batch_depth = 0
+        self._batched = []
+        self._batched_nbytes = 0
+        self.pid = os.getpid()
+        self._inherited = []
+        self.stats = IOStats()
+        self._connect()
         self.connected = True
         self.cache_size = cache_size
+        self.cache_bytes = cache_bytes
         self.cache = OrderedDict()
+        self._cache_lock = threading.RLock()
+        self.accessed = {}
+        self.stored = {}
+        self._encoded = threading.local()
+        self.cache_nbytes = 0
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.cache_evictions = 0
+        self.write_behind = write_behind
+        self.write_queue_size = write_queue_size
+        self._pending = {}
+        self._pending_lock = threading.Lock()
+        self._io_lock = threading.RLock()
+        self._write_queue = None
+        self._writer = None
+        if self.write_behind:
+            self._start_writer()
 
     def __str__(self):
-        return f"SQLitedict Database: {self.name}"
+        return f"SQLite Database ({self.storage}): {self.name}"
 
     def __repr__(self):
-        return f"Database({self.name},{self.cache_size})"
+        return (f"Database({self.name},{self.cache_size},{self.cache_bytes},"
+         f"{self.storage},{self.codec!r})")
+
+    def _connect(self):
+        """ Opens the storage backend. Commits are controlled by the 
+        DataBase (see _commit and batch)."""
+        create_database(self.name, self.pragmas)
+        if self.storage == "columnar":
+            self.db = ColumnarStore(self.name, autocommit=False,
+             pragmas=self.pragmas, codec=self.codec, stats=self.stats)
+        elif self.storage == "mmap":
+            self.db = MemmapStore(self.name, autocommit=False,
+             pragmas=self.pragmas, codec=self.codec, stats=self.stats)
+        else:
+            pragmas = dict(self.pragmas)
+            journal_mode = pragmas.pop("journal_mode", "DELETE")
+            self.db = SqliteDict(self.name, autocommit=False,
+             journal_mode=journal_mode, encode=self._encode,
+             decode=self._decode)
+            for statement in pragma_statements(pragmas):
+                self.db.conn.execute(statement)
+
+        self.process_lock = ProcessLock(self.name + ".lock" if
+         self.multiprocess else None)
+        self.pool = None
+        if self.multiprocess and self.storage == "pickle":
+            self.pool = ConnectionPool(self.name, self.pool_size,
+             {"busy_timeout": self.pragmas["busy_timeout"]})
+
+    def _encode(self, value):
+        """ Serializes a value of the pickle storage. Without compression, 
+        values are plain pickles (as before); _decode reads both forms. """
+        t_0 = time.perf_counter()
+        if self.codec.name != "none":
+            data = self.codec.encode_value(value)
+        else:
+            data = sqlite3.Binary(pickle.dumps(value,
+             protocol=pickle.HIGHEST_PROTOCOL))
+        self.stats.observe("serialize", time.perf_counter() - t_0)
+        self.stats.count("bytes_written", len(data))
+        self._encoded.nbytes = len(data)
+        return data
+
+    def _decode(self, data):
+        """ Deserializes a value of the pickle storage. """
+        self.stats.count("bytes_read", len(data))
+        with self.stats.timer("deserialize"):
+            return self.codec.decode_value(data)
+
+    def _check_process(self):
+        """ Opens new connections if the database is used in a forked 
+        process (e.g., a multiprocess pool, or the worker processes of an
+        extraction pool). SQLite connections must not be used (or closed) 
+        in a child process, so the inherited ones are kept untouched. 
+        Without multiprocess, the child process should only read. """
+        if self.pid == os.getpid():
+            return
+
+        self.pid = os.getpid()
+        self._inherited.append((self.db, self.pool))
+        self._pending = {}
+        self._pending_lock = threading.Lock()
+        self._io_lock = threading.RLock()
+        self._batched = []
+        self._batched_nbytes = 0
+        self.batch_depth = 0
+        self._connect()
+        if self.write_behind:
+            self._start_writer()
+        LOGGER.debug(f"Process {self.pid} is connected to {self.name}.")
+
+    def _commit(self):
+        """ Commits the changes, and waits until they are committed, unless a
+        batch is in progress or the writer thread commits them. """
+        if self.batch_depth == 0 and not (self.write_behind or
+         self.multiprocess):
+            self.db.commit()
+
+    def _start_writer(self):
+        """ Starts the background writer thread (see write_behind). """
+        self._write_queue = queue.Queue(maxsize=self.write_queue_size)
+        self._writer = threading.Thread(target=self._writer_loop,
+         name=f"{self.name}-writer", daemon=True)
+        self._writer.start()
+
+    def _stop_writer(self):
+        """ Writes the queued operations and stops the writer thread. """
+        self._write_queue.put(None)
+        self._writer.join()
+        self._writer = None
+        self._write_queue = None
+
+    def _writer_loop(self):
+        """ Takes the queued operations, as many as are available (up to the
+        queue size), applies them in order, and commits them together. A None
+        operation stops the loop. """
+        stop = False
+        while not stop:
+            operations = [self._write_queue.get()]
+            while len(operations) < self.write_queue_size:
+                try:
+                    operations.append(self._write_queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            stop = None in operations
+            self._write_operations([operation for operation in operations
+             if operation is not None])
+
+            for _ in operations:
+                self._write_queue.task_done()
+
+    def _write_operations(self, operations):
+        """ Applies the write operations in order, and commits them in one
+        transaction, while holding the process lock. """
+        with self._io_lock, self.process_lock, self.stats.timer("disk_write"):
+            for operation in operations:
+                self._apply(*operation)
+            try:
+                self.db.commit()
+            except Exception:
+                LOGGER.warning(f"Could not commit the queued writes on"
+                 f" {self.name}.")
+        self.stats.count("disk_writes", len(operations))
+
+        with self._pending_lock:
+            for kind, key, value, _ in operations:
+                if kind != "call" and self._pending.get(key) is value:
+                    del self._pending[key]
+
+    def _store(self, key, value, segment=None):
+        """ Writes the value on the storage backend, and returns its stored
+        (encoded) size in bytes. """
+        if self.storage == "pickle":
+            self.db[key] = value
+            nbytes = self._encoded.nbytes
+        else:
+            nbytes = self.db.set(key, value, segment)
+        self.stored[key] = nbytes
+        return nbytes
 
-    def set_value(self, key, value):
+    def _apply(self, kind, key, value, segment=None):
+        """ Applies one write operation on the storage backend. """
+        try:
+            if kind == "set":
+                self._store(key, value, segment)
+            elif kind == "delete":
+                del self.db[key]
+                LOGGER.debug(f"Value {key} is removed from database.")
+            else:
+                value()
+        except KeyError:
+            LOGGER.warning(f"Tried to delete {key} on the database."
+             "Something went wrong.")
+        except Exception:
+            LOGGER.warning(f"Tried to set {key} on the database."
+             "Something went wrong.")
+
+    def _submit(self, kind, key, value, segment=None, nbytes=0):
+        """ Hands a write operation to the writer thread (write_behind). In 
+        multiprocess mode, without write_behind, it is kept until the batch 
+        exits (or until the kept writes are over write_queue_size values, or
+        a quarter of cache_bytes), or written right away outside a batch. 
+        Blocks while the queue is full. """
+        operation = (kind, key, value, segment)
+        if kind != "call":
+            with self._pending_lock:
+                self._pending[key] = value
+
+        if self.write_behind:
+            self._write_queue.put(operation)
+        elif self.batch_depth > 0:
+            self._batched.append(operation)
+            self._batched_nbytes += nbytes
+            if (len(self._batched) >= self.write_queue_size or
+             self._batched_nbytes >= self.cache_bytes//4):
+                self._write_batched()
+        else:
+            self._write_operations([operation])
+
+    def _write_batched(self):
+        """ Writes the writes that are kept by a batch (multiprocess). """
+        operations, self._batched = self._batched, []
+        self._batched_nbytes = 0
+        if operations:
+            self._write_operations(operations)
+
+    def flush(self):
+        """ Blocks until all queued writes are written and committed. Outside
+        a batch, the open transaction (if any) is committed before it 
+        returns. """
+        self._check_process()
+        if self._write_queue is not None:
+            self._write_queue.join()
+        elif self.batch_depth == 0 and not self.multiprocess:
+            self.db.commit()
+
+    @contextmanager
+    def batch(self):
+        """ Groups all writes inside the context into one transaction. The 
+        transaction is committed when the outermost batch exits (also if an
+        exception is raised, since written values are already in the cache).
+
+        Example:
+            | with project.pr_db.batch():
+            |     project.pr_db.set_value(key_1, value_1)
+            |     project.pr_db.set_value(key_2, value_2)
+        """
+        self._check_process()
+        self.batch_depth += 1
+        try:
+            yield self
+        finally:
+            self.batch_depth -= 1
+            if self.batch_depth == 0 and self.multiprocess and (not
+             self.write_behind):
+                self._write_batched()
+            elif self.batch_depth == 0 and not self.write_behind:
+                self.db.commit()
+
+    def _cache_put(self, key, value):
+        """ Puts the value in the in-memory cache as the most recently used
+        item. Least recently used items are evicted until the cache is within
+        both the number of items (cache_size) and the memory (cache_bytes)
+        budgets. Values that are larger than the memory budget are not cached.
+        Returns the estimated size of the value in bytes.
+        """
+        nbytes = sizeof_value(value)
+        with self._cache_lock:
+            self._cache_discard(key)
+            if nbytes > self.cache_bytes:
+                LOGGER.debug(f"Key: {key}. Value ({nbytes} bytes) is larger"
+                 f" than the cache budget ({self.cache_bytes} bytes)."
+                 " Not cached.")
+                return nbytes
+
+            self.cache[key] = (value, nbytes)
+            self.cache_nbytes += nbytes
+
+            while (len(self.cache) > self.cache_size or
+             self.cache_nbytes > self.cache_bytes):
+                old_key, (_, old_nbytes) = self.cache.popitem(last=False)
+                self.cache_nbytes -= old_nbytes
+                self.cache_evictions += 1
+                self.stats.count("evictions")
+                LOGGER.debug(f"Key: {old_key} is evicted from the cache"
+                 f" ({len(self.cache)} items, {self.cache_nbytes} bytes).")
+        return nbytes
+
+    def _cache_discard(self, key):
+        """ Removes the key from the in-memory cache, if it is there. """
+        with self._cache_lock:
+            try:
+                _, nbytes = self.cache.pop(key)
+                self.cache_nbytes -= nbytes
+            except KeyError:
+                pass
+
+    def cache_info(self):
+        """ Returns a dictionary of the in-memory cache statistics. """
+        return {
+            "hits": self.cache_hits,
+            "misses": self.cache_misses,
+            "evictions": self.cache_evictions,
+            "items": len(self.cache),
+            "nbytes": self.cache_nbytes,
+            "cache_size": self.cache_size,
+            "cache_bytes": self.cache_bytes
+        }
+
+    def disk_usage(self):
+        """ Returns the size of the database files (including the WAL file,
+        and the array files of the mmap storage) in bytes. """
+        files = [self.name, self.name + "-wal"]
+        if self.storage == "mmap":
+            files += [os.path.join(self.db.segments_dir, filename) for 
+             filename in os.listdir(self.db.segments_dir)]
+        return sum(os.path.getsize(filename) for filename in files
+         if os.path.exists(filename))
+
+    def access_times(self, clear=True):
+        """ Returns a dictionary of the keys that are read or written in 
+        this session, and their last access time.
+
+        Inputs:
+            | clear: forgets the returned access times.
+        """
+        accessed = self.accessed
+        if clear:
+            self.accessed = {}
+        return dict(accessed)
+
+    def stored_sizes(self, clear=True):
+        """ Returns a dictionary of the keys that are written in this 
+        session, and their stored (encoded) size in bytes.
+
+        Inputs:
+            | clear: forgets the returned sizes.
+        """
+        stored = self.stored
+        if clear:
+            self.stored = {}
+        return dict(stored)
+
+    def io_stats(self, reset=False):
+        """ Returns a dictionary of the I/O counters (cache hits, misses,
+        and evictions, disk reads and writes, bytes read and written) and
+        the latency histograms (disk_read, disk_write, serialize, 
+        deserialize, tracker_flush) since the last reset. See 
+        io_stats.IOStats.
+
+        Inputs:
+            | reset: sets the counters to zero, after they are returned.
+        """
+        stats = self.stats.as_dict()
+        stats["counters"].update({"cache_hits": self.cache_hits,
+         "cache_misses": self.cache_misses})
+        if reset:
+            self.reset_io_stats()
+        return stats
+
+    def reset_io_stats(self):
+        """ Sets the I/O counters and histograms to zero. """
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.cache_evictions = 0
+        self.stats.reset()
+
+    def compression_info(self):
+        """ Returns a dictionary of compression settings, compression ratio
+        (raw/stored bytes of arrays), and decode throughput (bytes/s). The
+        ratio of the pickle storage is based on the values written in this
+        session; the other storages report the ratio of all stored arrays.
+        The throughput is based on the values decoded in this session.
+        """
+        info = self.codec.info()
+        if self.storage == "pickle":
+            raw = info["raw_bytes_encoded"]
+            stored = info["stored_bytes_encoded"]
+        else:
+            raw, stored = self.db.compression_stats()
+
+        info["ratio"] = raw/stored if stored else None
+        info["decode_throughput"] = (info["raw_bytes_decoded"] /
+         info["decode_time"] if info["decode_time"] else None)
+        return info
+
+    def set_value(self, key, value, segment=None):
         """ 
         Sets the key and given value in the database. If the key exists,
-        it will override the value. In that case, it will remove the key from
-        the in-memory dictionary. It will be loaded again with the get_value
-        command if needed.
+        it will override the value. The in-memory cache is refreshed with the
+        new value, which becomes the most recently used item.
 
         Inputs:
             | key: hash value (generated by the package)
             | value: Seismic Record object
+            | segment: group of the value (e.g., incident name). Only used by
+              the mmap storage.
 
+        Outputs:
+            | stored (encoded) size of the value in bytes, or None if the 
+              value is written later (write_behind, multiprocess; see 
+              stored_sizes), or could not be set.
         """
+        self._check_process()
+        self.accessed[key] = time.time()
+        if self.write_behind or self.multiprocess:
+            nbytes = self._cache_put(key, value)
+            self._submit("set", key, value, segment, nbytes)
+            return None
+
         try:
-            self.db[key] = value
-            del self.cache[key]
-        except KeyError:
-            LOGGER.debug(f"Tried to delete non-existing {key} on the cache.")
+            with self.stats.timer("disk_write"):
+                nbytes = self._store(key, value, segment)
+                self._commit()
+            self.stats.count("disk_writes")
+            self._cache_put(key, value)
+            return nbytes
         except Exception:
             LOGGER.warning(f"Tried to set {key} on the database."
              "Something went wrong.")
-        finally:
-            pass 
+
+    def set_many(self, items, segment=None):
+        """ Sets several keys and values in one transaction.
+
+        Inputs:
+            | items: dictionary or iterable of (key, value) pairs
+            | segment: group of the values (see set_value)
+        """
+        if isinstance(items, dict):
+            items = items.items()
+
+        with self.batch():
+            for key, value in items:
+                self.set_value(key, value, segment)
+
+    def get_many(self, keys):
+        """ Returns a dictionary of the requested keys and their values. 
+        Values are looked up in the cache first; the rest are loaded from
+        the disk together. Keys that are not found have None value.
+
+        Inputs:
+            | keys: list of hash values
+        """
+        self._check_process()
+        values = {}
+        missing = []
+        for key in keys:
+            if key in self.cache:
+                values[key] = self.get_value(key)
+            else:
+                missing.append(key)
+
+        with self._pending_lock:
+            pending = {key: self._pending[key] for key in missing
+             if key in self._pending}
+        missing = [key for key in missing if key not in pending]
+        for key, value in pending.items():
+            values[key] = None if value is self._deleted else value
+
+        self.cache_misses += len(missing)
+        loaded = self.load_many(missing)
+
+        for key in missing:
+            value = loaded.get(key)
+            if value is not None:
+                self._cache_put(key, value)
+                self.accessed[key] = time.time()
+            values[key] = value
+
+        return values
+
+    def load_many(self, keys):
+        """ Returns a dictionary of the found keys and their values, loaded
+        from the disk. The values are not put in the cache (e.g., to copy 
+        many values). """
+        if not keys:
+            return {}
+        self.stats.count("disk_reads", len(keys))
+        with self.stats.timer("disk_read"):
+            return self._read_many(keys)
+
+    def _read_many(self, keys):
+        if self.storage != "pickle":
+            with self._io_lock:
+                return self.db.get_many(keys)
+
+        loaded = {}
+        for i in range(0, len(keys), 500):
+            chunk = keys[i:i+500]
+            rows = self._select(f'SELECT key, value FROM'
+             f' "{self.db.tablename}" WHERE key IN'
+             f' ({",".join("?"*len(chunk))})', tuple(chunk))
+            loaded.update({key: self.db.decode(value) for
+             key, value in rows})
+        return loaded
+
+    def existing_keys(self, keys):
+        """ Returns the set of the keys that are in the database, without 
+        loading their values.
+
+        Inputs:
+            | keys: list of hash values
+        """
+        keys = list(keys)
+        with self._pending_lock:
+            pending = {key: self._pending[key] for key in keys
+             if key in self._pending}
+        existing = {key for key, value in pending.items()
+         if value is not self._deleted}
+        keys = [key for key in keys if key not in pending]
+
+        table = (self.db.tablename if self.storage == "pickle" else
+         self.db.RECORDS_TABLE)
+        for i in range(0, len(keys), 500):
+            chunk = tuple(keys[i:i+500])
+            existing.update(row[0] for row in self._select(f'SELECT key FROM'
+             f' "{table}" WHERE key IN ({",".join("?"*len(chunk))})', chunk))
+        return existing
+
+    def _select(self, req, arg=None):
+        """ Runs a select statement, with a pooled connection in 
+        multiprocess mode (pickle storage). """
+        if self.pool is None:
+            with self._io_lock:
+                return list(self.db.conn.select(req, arg))
+        with self.pool.connection() as conn:
+            return conn.execute(req, arg or ()).fetchall()
+
+    def execute(self, req, items=None, many=False):
+        """ Runs an SQL statement (e.g., on the tracker table) in the 
+        database file. The statement is ordered with the other writes (see 
+        write_behind and multiprocess), and committed like them.
+
+        Inputs:
+            | req: SQL statement
+            | items: statement arguments, or a list of them if many is True
+            | many: runs the statement once for each item
+        """
+        self._check_process()
+
+        def run():
+            if many:
+                self.db.conn.executemany(req, items)
+            else:
+                self.db.conn.execute(req, items)
+
+        if self.write_behind or self.multiprocess:
+            self._submit("call", req, run)
+            return
+
+        with self._io_lock:
+            run()
+        self._commit()
+
+    def after_writes(self, func):
+        """ Calls func after the writes that are queued before it (see 
+        write_behind and multiprocess), or right away.
+
+        Inputs:
+            | func: function without arguments
+        """
+        self._check_process()
+        if self.write_behind or self.multiprocess:
+            self._submit("call", None, func)
+        else:
+            func()
+
+    def select(self, req, arg=None):
+        """ Returns the rows of an SQL select statement (e.g., on the 
+        tracker table). Queued writes are written first. 
+
+        Inputs:
+            | req: SQL select statement
+            | arg: statement arguments
+
+        Outputs:
+            | list of rows
+        """
+        self.flush()
+        return self._select(req, arg)
+
+    def _load(self, key):
+        """ Loads the value of the key from the disk. """
+        self.stats.count("disk_reads")
+        with self.stats.timer("disk_read"):
+            return self._read(key)
+
+    def _read(self, key):
+        if self.pool is None:
+            with self._io_lock:
+                return self.db[key]
+
+        rows = self._select(f'SELECT value FROM "{self.db.tablename}"'
+         ' WHERE key = ?', (key,))
+        if not rows:
+            raise KeyError(key)
+        return self.db.decode(rows[0][0])
 
     def delete_value(self,key):
         """ Deletes the key, and its value from both in-memory dictionary and
@@ -63,17 +748,122 @@ class DataBase:
         Inputs:
             | key: hash value (generated by the package)
         """
+        self._check_process()
+        if self.write_behind or self.multiprocess:
+            self._cache_discard(key)
+            self._submit("delete", key, self._deleted)
+            return
+
         try:
             del self.db[key]   
-            try: 
-                del self.cache[key]
-            except:
-                pass         
+            self._cache_discard(key)
+            self._commit()
             LOGGER.debug(f"Value {key} is removed from database.")
         except KeyError:
             LOGGER.warning(f"Tried to delete {key} on the database."
              "Something went wrong.")
      
+    def delete_many(self, keys, background=False):
+        """ Deletes the keys, and their values, with one statement per chunk
+        of keys (instead of one delete and commit per key). Keys that are not
+        found are ignored. The keys are removed from the cache right away; 
+        with background, the values are deleted from the disk on another 
+        thread. The freed space is kept by SQLite (see reclaim_space).
+
+        Inputs:
+            | keys: list of hash values
+            | background: deletes the values on a background thread
+
+        Outputs:
+            | the background thread, if background is True, else None.
+        """
+        self._check_process()
+        keys = list(keys)
+        for key in keys:
+            self._cache_discard(key)
+
+        if self.write_behind or self.multiprocess:
+            # deleted in order with the other writes.
+            self._submit("call", None, lambda: self._delete_keys(keys))
+            return None
+
+        def run():
+            with self._io_lock:
+                self._delete_keys(keys)
+                self._commit()
+            LOGGER.debug(f"{len(keys)} values are removed from database.")
+
+        if not background:
+            run()
+            return None
+
+        thread = threading.Thread(target=run, name=f"{self.name}-delete",
+         daemon=True)
+        thread.start()
+        return thread
+
+    def _delete_keys(self, keys):
+        """ Deletes the keys from the storage backend. """
+        if self.storage != "pickle":
+            self.db.delete_many(keys)
+            return
+
+        for i in range(0, len(keys), 500):
+            chunk = tuple(keys[i:i+500])
+            self.db.conn.execute(f'DELETE FROM "{self.db.tablename}" WHERE'
+             f' key IN ({",".join("?"*len(chunk))})', chunk)
+
+    def reclaim_space(self, chunk_pages=1024):
+        """ Releases the free pages of the database file (e.g., after 
+        deleting an incident) to the file system, chunk_pages at a time. 
+        Each chunk is a short transaction, so other reads and writes can run
+        between the chunks, unlike a full VACUUM that rewrites the whole file.
+        It requires incremental auto_vacuum (the default for new databases).
+
+        The chunks run on the connection of the database, between its 
+        writes (also the queued ones, see write_behind), so it does not wait
+        for its own transactions. It can be called from another thread (see
+        Project.remove_incident); failures are logged.
+
+        Inputs:
+            | chunk_pages: number of pages released in each chunk
+
+        Outputs:
+            | number of released pages
+        """
+        conn = self.db.conn
+        released = 0
+        try:
+            self.flush()
+            with self._io_lock, self.process_lock:
+                self.db.commit()
+                auto_vacuum = conn.select_one("PRAGMA auto_vacuum")[0]
+                free_pages = conn.select_one("PRAGMA freelist_count")[0]
+            if auto_vacuum != 2:
+                LOGGER.warning(f"Incremental auto_vacuum is not enabled on"
+                 f" {self.name}. Space is not released. Running VACUUM once"
+                 " after 'PRAGMA auto_vacuum = INCREMENTAL' enables it.")
+                return 0
+
+            while free_pages > 0:
+                with self._io_lock, self.process_lock:
+                    # select steps the pragma until it is done.
+                    list(conn.select(
+                     f"PRAGMA incremental_vacuum({int(chunk_pages)})"))
+                    self.db.commit()
+                    left = conn.select_one("PRAGMA freelist_count")[0]
+                if left >= free_pages:
+                    break
+                released += free_pages - left
+                free_pages = left
+        except Exception as e:
+            LOGGER.warning(f"Could not release the free pages of {self.name}"
+             f" ({released} pages are released). {str(e)}")
+            return released
+
+        LOGGER.debug(f"{released} free pages are released from {self.name}.")
+        return released
+
     def get_value(self, key):
         """ Returns the value in the following order:
         
@@ -81,35 +871,68 @@ class DataBase:
         | 2) will look for the value in the disk and return it, if not found
         | 3) will return None.
 
+        A cache hit marks the key as the most recently used item.
+
         Inputs:
             | key: hash value (generated by the package)
 
         Outputs:
             | If found, value, else returns None.         
         """
-        value = None
+        self._check_process()
         try:
-            value = self.cache[key]
+            with self._cache_lock:
+                value, _ = self.cache[key]
+                self.cache.move_to_end(key)
+                self.cache_hits += 1
+            self.accessed[key] = time.time()
             LOGGER.debug(f"Key: {key}. Value is loaded from the cache.")
-        except:
+            return value
+        except KeyError:
+            self.cache_misses += 1
             LOGGER.debug(f"Key: {key}. Value is not found in the cache.")
 
-        if not value:
-            try:
-                tmp = self.db[key]
-                if len(self.cache) >  self.cache_size:
-                    self.cache.popitem(last=False)
-                    LOGGER.debug(f"cache size is more than limit"
-                     f"{self.cache_size}. An item removed, and new item added.")
-                self.cache[key] = tmp
-                return tmp
-            except Exception:
-                LOGGER.debug(f"The requested key ({key}) is not in the"
-                 " database. Returns None.")
-                return None
-        else:
+        with self._pending_lock:
+            value = self._pending.get(key)
+        if value is self._deleted:
+            return None
+        if value is not None:
+            LOGGER.debug(f"Key: {key}. Value is loaded from the write queue.")
+            self._cache_put(key, value)
+            self.accessed[key] = time.time()
             return value
 
+        try:
+            value = self._load(key)
+        except Exception:
+            LOGGER.debug(f"The requested key ({key}) is not in the"
+             " database. Returns None.")
+            return None
+
+        self._cache_put(key, value)
+        self.accessed[key] = time.time()
+        return value
+
+    def drop_segment(self, segment):
+        """ Removes all values of the segment from the database. Only the 
+        mmap storage keeps values in segments; otherwise, it is ignored.
+
+        Inputs:
+            | segment: segment name (e.g., incident name)
+        """
+        if self.storage != "mmap":
+            return
+
+        self.flush()
+        segment_keys = set(self.db.segment_keys(segment))
+        with self._cache_lock:
+            cached_keys = [key for key in self.cache if key in segment_keys]
+        for key in cached_keys:
+            self._cache_discard(key)
+
+        with self._io_lock, self.process_lock:
+            self.db.drop_segment(segment)
+
     def update_nested_container(self, key1, key2, value, append=True):
         """ Updates nested container 
         
@@ -118,7 +941,21 @@ class DataBase:
             | key2 is the key inside the container.
             | value is the value of key2
         """
+        self._check_process()
+        if self.write_behind or self.multiprocess:
+            # the container is read and written by the writer, in order.
+            self._cache_discard(key1)
+            self._submit("call", key1, lambda: self._update_nested_container(
+             key1, key2, value, append))
+            return
+
+        self._update_nested_container(key1, key2, value, append)
+
+    def _update_nested_container(self, key1, key2, value, append=True):
+        """ Updates nested container on the disk (see 
+        update_nested_container). """
         try:
+            self._cache_discard(key1)
             tracker_container = self.db[key1]
             if key2 in list(tracker_container.keys()):
                 if append:
@@ -131,6 +968,7 @@ class DataBase:
                 tracker_container[key2] = value
                 self.db[key1] = tracker_container
                 LOGGER.debug(f"Tracker for {key2} is set. '{value}' added.")
+            self._commit()
 
         except Exception:
             pass
@@ -144,9 +982,10 @@ class DataBase:
         Outputs:
             | If found, value, else returns None.         
         """
+        self.flush()
         value = None
         try:
-            value = self.db[key]
+            value = self._load(key)
             LOGGER.debug(f"Key: {key}. Container is loaded from the database.")
         except:
             LOGGER.debug(f"Key: {key}. Value is not found in the cache.")
@@ -160,12 +999,19 @@ class DataBase:
         pass
         
     def close_db(self):
-        """ Commits changes to the database, closes the database, clears the 
-        cache.
+        """ Writes the queued values (see write_behind), commits changes to
+        the database, closes the database, clears the cache.
         """
+        self._check_process()
+        if self._writer is not None:
+            self._stop_writer()
 
+        self._write_batched()
         self.db.commit()
         self.db.close()
+        if self.pool is not None:
+            self.pool.close()
         self.cache = None
+        self.cache_nbytes = 0
         self.connected = False
         LOGGER.info(f"Database ({self.name}) is closed.")
\ No newline at end of file
@@ -4,90 +4,428 @@ db_tracker.py
 The core module for the DatabaseTracker class.
 """
 
+import time
+import threading
+
 from .log import LOGGER
 
 class DataBaseTracker:
-    """ DatabaseTracker Class """
+    """ DatabaseTracker Class
+
+    Keeps track of the hash values of the records of each incident in a
+    table (incident, hash, kind, label, nbytes, created_at) of the project
+    database. kind is either "original" or "processed"; label is the last 
+    processing label of processed records, and nbytes is the stored 
+    (encoded) size of the record. The last access times and the stored 
+    sizes of the records (see DataBase.access_times and 
+    DataBase.stored_sizes) are written into the accessed_at and nbytes 
+    columns when the buffer is inserted, so the least recently used records
+    can be listed (see lru_hashes).
+
+    Triggers on the tracker table keep a catalog ('<name>_catalog') of the
+    number of records, their total size, and their first and last creation
+    times per incident and label, so database summaries do not scan or load
+    the records (see catalog).
+
+    The lineage of the processed records (parent hash, processing label, 
+    child hash) is kept in another table ('<name>_lineage'), so adding a 
+    processed record does not rewrite its parent record. The processed 
+    records are also indexed by the hash value of their processing chain
+    (original record and list of labels) in the '<name>_chains' table.
+
+    New hash values, lineage, and chain rows are kept in a buffer and are 
+    inserted together, when the buffer is full, or when add_to_database is
+    called. The flushes are counted in the database I/O statistics 
+    (tracker_flush, tracker_rows). The buffers can be filled from several
+    threads (see Project.prefetch). Chain rows are also kept in memory until
+    they are written (write_behind, see DataBase), so chain lookups do not 
+    wait for the write queue.
+    """
 
-    def __init__(self, name, project,  buffer_capacity = 3):
+    def __init__(self, name, project,  buffer_capacity = 500):
         self.name = name
         self.project = project
         self.buffer_capacity = buffer_capacity
         self.dt_db = self.project.pr_db
+        self.lineage_name = name + "_lineage"
+        self.chains_name = name + "_chains"
+        self.catalog_name = name + "_catalog"
         self.buffer = dict()
+        self.lineage_buffer = []
+        self.chain_buffer = dict()
+        # chain rows that are inserted, but can still be in the write queue.
+        self.chain_pending = dict()
+        self.lock = threading.RLock()
         self._initiate_tracker()
 
     def __str__(self):
-        return (f"Database hash values tracker: {self.name}, {self.projcet},"
+        return (f"Database hash values tracker: {self.name}, {self.project},"
         f" {self.buffer_capacity}")
 
     def __repr__(self):
-        return (f"DataBaseTracker({self.name},{self.projcet},"
+        return (f"DataBaseTracker({self.name},{self.project},"
         f"{self.buffer_capacity})")
 
     def _initiate_tracker(self):
         try:
-            tracker = self.dt_db.get_nested_container(self.name)
-            if not tracker:            
-                self.dt_db.set_value(self.name, dict())
+            self.dt_db.execute(f'CREATE TABLE IF NOT EXISTS "{self.name}"'
+             ' (incident TEXT, hash TEXT, kind TEXT, created_at REAL,'
+             ' label TEXT, nbytes INTEGER, accessed_at REAL,'
+             ' PRIMARY KEY (incident, hash))')
+            columns = [row[1] for row in self.dt_db.select(
+             f'PRAGMA table_info("{self.name}")')]
+            for column in ["label TEXT", "nbytes INTEGER",
+             "accessed_at REAL"]:
+                if column.split()[0] not in columns:
+                    # tracker table of an older database.
+                    self.dt_db.execute(f'ALTER TABLE "{self.name}" ADD COLUMN'
+                     f' {column}')
+            self.dt_db.execute(f'CREATE INDEX IF NOT EXISTS "{self.name}_hash"'
+             f' ON "{self.name}" (hash)')
+            self.dt_db.execute(f'CREATE TABLE IF NOT EXISTS'
+             f' "{self.lineage_name}" (parent TEXT, label TEXT, child TEXT,'
+             ' created_at REAL, PRIMARY KEY (parent, child))')
+            self.dt_db.execute(f'CREATE TABLE IF NOT EXISTS'
+             f' "{self.chains_name}" (chain TEXT PRIMARY KEY, record TEXT)')
+            self._initiate_catalog()
+            self._import_container()
         except Exception as e:
             LOGGER.error(str(e))
 
-    def start_tracking_incident(self, incident_name):
-        """ creates an empty list for a new incident. """
+    def _initiate_catalog(self):
+        """ Creates the catalog table and the triggers that keep it up to 
+        date. The catalog of an existing tracker is built from its rows. """
+        is_new = not self.dt_db.select("SELECT 1 FROM sqlite_master WHERE"
+         " type = 'table' AND name = ?", (self.catalog_name,))
+        self.dt_db.execute(f'CREATE TABLE IF NOT EXISTS "{self.catalog_name}"'
+         ' (incident TEXT, label TEXT, n_items INTEGER, nbytes INTEGER,'
+         ' first_created REAL, last_created REAL,'
+         ' PRIMARY KEY (incident, label))')
+        if is_new:
+            self.dt_db.execute(f'INSERT INTO "{self.catalog_name}" SELECT'
+             " incident, COALESCE(label, ''), COUNT(*),"
+             ' SUM(COALESCE(nbytes, 0)), MIN(created_at), MAX(created_at)'
+             f' FROM "{self.name}" GROUP BY 1, 2')
 
-        current_tracker = self.dt_db.get_nested_container(self.name)
+        # records without a label (originals) have an empty label.
+        self.dt_db.execute(f'CREATE TRIGGER IF NOT EXISTS'
+         f' "{self.catalog_name}_insert" AFTER INSERT ON "{self.name}" BEGIN'
+         f' INSERT OR IGNORE INTO "{self.catalog_name}" VALUES (NEW.incident,'
+         " COALESCE(NEW.label, ''), 0, 0, NEW.created_at, NEW.created_at);"
+         f' UPDATE "{self.catalog_name}" SET n_items = n_items + 1,'
+         ' nbytes = nbytes + COALESCE(NEW.nbytes, 0),'
+         ' first_created = MIN(first_created, NEW.created_at),'
+         ' last_created = MAX(last_created, NEW.created_at)'
+         " WHERE incident = NEW.incident AND label = COALESCE(NEW.label, '');"
+         ' END')
+        self.dt_db.execute(f'CREATE TRIGGER IF NOT EXISTS'
+         f' "{self.catalog_name}_delete" AFTER DELETE ON "{self.name}" BEGIN'
+         f' UPDATE "{self.catalog_name}" SET n_items = n_items - 1,'
+         ' nbytes = nbytes - COALESCE(OLD.nbytes, 0)'
+         " WHERE incident = OLD.incident AND label = COALESCE(OLD.label, '');"
+         f' DELETE FROM "{self.catalog_name}" WHERE n_items <= 0; END')
+        self.dt_db.execute(f'CREATE TRIGGER IF NOT EXISTS'
+         f' "{self.catalog_name}_update" AFTER UPDATE OF nbytes ON'
+         f' "{self.name}" BEGIN UPDATE "{self.catalog_name}" SET nbytes ='
+         ' nbytes - COALESCE(OLD.nbytes, 0) + COALESCE(NEW.nbytes, 0)'
+         " WHERE incident = NEW.incident AND label = COALESCE(NEW.label, '');"
+         ' END')
 
-        if incident_name in list(current_tracker.keys()):
-            LOGGER.debug(f"Tracker is found for Incident: '{incident_name}'.")
-        else:
-            self.dt_db.update_nested_container(self.name, incident_name,[])
-            LOGGER.debug(f"Tracker is set up for Incident: '{incident_name}'.")
+    def _import_container(self):
+        """ Moves the hash values of the older trackers (one dictionary of
+        incidents and their list of hash values, stored under the tracker
+        name) into the tracker table. """
+        container = self.dt_db.get_nested_container(self.name)
+        if not isinstance(container, dict):
+            return
 
-        self.buffer[incident_name] = list()
+        created_at = time.time()
+        self.dt_db.execute(f'INSERT OR IGNORE INTO "{self.name}"'
+         ' (incident, hash, kind, created_at) VALUES (?,?,?,?)',
+         [(incident_name, hash_value, None, created_at) for
+          incident_name, hash_values in container.items()
+          for hash_value in hash_values], many=True)
+        self.dt_db.delete_value(self.name)
+        LOGGER.info(f"Tracker '{self.name}' is moved into a table.")
+
+    def start_tracking_incident(self, incident_name):
+        """ creates an empty buffer for a new incident. """
+        self.buffer.setdefault(incident_name, list())
+        LOGGER.debug(f"Tracker is set up for Incident: '{incident_name}'.")
 
-    def track_incident_hash(self, incident_name, hash_value):
-        
-        if incident_name not in list(self.project.incidents.keys()):
+    def track_incident_hash(self, incident_name, hash_value, kind="processed",
+     label=None, nbytes=None):
+        """ Adds the hash value of a record of the incident to the buffer.
+
+        Inputs:
+            | incident_name: incident name
+            | hash_value: hash value of the record
+            | kind: "original" or "processed"
+            | label: processing label of the record (processed records)
+            | nbytes: size of the record in bytes
+        """
+
+        if incident_name not in self.project.incidents:
             LOGGER.warning('Incident is not added to the projcet. Ignored.')
             return
-        
-        if incident_name in list(self.buffer.keys()):
-            self.buffer[incident_name].append(hash_value)
-            LOGGER.debug(f"Value {hash_value} is added to the buffer.")
-        else:
-            self.buffer[incident_name] = [hash_value]
-            LOGGER.debug(f"Buffer initiated and value {hash_value} is added to the buffer.")
 
-        buffer_size = sum([val for val in  {key: len(value) for key, value in self.buffer.items()}.values()])
+        with self.lock:
+            self.buffer.setdefault(incident_name, list()).append(
+                (hash_value, kind, label, nbytes, time.time()))
+        LOGGER.debug(f"Value {hash_value} is added to the buffer.")
+
+        self._flush_if_full()
+
+    def track_lineage(self, parent_hash, label_name, child_hash):
+        """ Adds a lineage row (the child record is the parent record 
+        processed with the label) to the buffer.
+
+        Inputs:
+            | parent_hash: hash value of the parent record
+            | label_name: processing label name
+            | child_hash: hash value of the processed record
+        """
+        with self.lock:
+            self.lineage_buffer.append((parent_hash, label_name, child_hash,
+             time.time()))
+        self._flush_if_full()
+
+    def track_chain(self, chain_hash, record_hash):
+        """ Adds a chain row (the record is the result of the processing 
+        chain) to the buffer.
+
+        Inputs:
+            | chain_hash: hash value of the processing chain
+            | record_hash: hash value of the processed record
+        """
+        with self.lock:
+            self.chain_buffer[chain_hash] = record_hash
+        self._flush_if_full()
+
+    def chain_records(self, chain_hashes):
+        """ Returns a dictionary of the found chain hash values and the hash
+        values of their processed records. 
 
-        if buffer_size > self.buffer_capacity:
-            try:
-                self.add_to_database()
-                self.buffer = {key: []  for
-                 key, _ in self.buffer.items()}
-            except Exception:
-                pass
+        Inputs:
+            | chain_hashes: list of chain hash values
+        """
+        with self.lock:
+            found = {key: self.chain_buffer.get(key,
+             self.chain_pending.get(key)) for key in chain_hashes}
+        found = {key: value for key, value in found.items() if value}
+        missing = tuple(key for key in chain_hashes if key not in found)
+        if missing:
+            # the queued writes are not waited for (see chain_pending).
+            found.update(self.dt_db._select(f'SELECT chain, record FROM'
+             f' "{self.chains_name}" WHERE chain IN'
+             f' ({",".join("?"*len(missing))})', missing))
+        return found
+
+    def _chains_written(self, chain_rows):
+        """ Forgets the pending chain rows that are written. """
+        with self.lock:
+            for chain_hash, record_hash in chain_rows:
+                if self.chain_pending.get(chain_hash) == record_hash:
+                    del self.chain_pending[chain_hash]
+
+    def _flush_if_full(self):
+        with self.lock:
+            full = (sum(len(item) for item in self.buffer.values()) +
+             len(self.lineage_buffer) + len(self.chain_buffer) >=
+             self.buffer_capacity)
+        if full:
+            self.add_to_database()
 
     def add_to_database(self):
-        # here update nested container should be called. 
+        """ Inserts the buffered hash values and lineage rows into the 
+        tracker tables, and updates the access times and the stored sizes
+        of the records. """
 
+        with self.lock:
+            rows = [(incident_name,) + item for incident_name, items in
+             self.buffer.items() for item in items]
+            lineage_rows = self.lineage_buffer
+            chain_rows = list(self.chain_buffer.items())
+            self.chain_pending.update(chain_rows)
+            self.buffer = {key: [] for key in self.buffer}
+            self.lineage_buffer = []
+            self.chain_buffer = dict()
+        accessed = [(accessed_at, hash_value) for hash_value, accessed_at in
+         self.dt_db.access_times().items()]
+        stored = [(nbytes, hash_value) for hash_value, nbytes in
+         self.dt_db.stored_sizes().items()]
+        n_rows = len(rows) + len(lineage_rows) + len(chain_rows)
+        if not n_rows and not accessed and not stored:
+            return
+
+        t_0 = time.perf_counter()
         try:
-            
-            for key, item in self.buffer.items():
-                try:
-                    self.dt_db.update_nested_container(self.name, key, item)
-                    LOGGER.debug(f"incident '{key}' hash values are updated.")
-                except:
-                    raise Exception
-                    # current_hash_values[key] = item
+            if rows:
+                self.dt_db.execute(f'INSERT OR IGNORE INTO "{self.name}"'
+                 ' (incident, hash, kind, label, nbytes, created_at) VALUES'
+                 ' (?,?,?,?,?,?)', rows, many=True)
+            if lineage_rows:
+                self.dt_db.execute(f'INSERT OR IGNORE INTO'
+                 f' "{self.lineage_name}" (parent, label, child, created_at)'
+                 ' VALUES (?,?,?,?)', lineage_rows, many=True)
+            if chain_rows:
+                self.dt_db.execute(f'INSERT OR REPLACE INTO'
+                 f' "{self.chains_name}" (chain, record) VALUES (?,?)',
+                 chain_rows, many=True)
+                self.dt_db.after_writes(lambda: self._chains_written(
+                 chain_rows))
+            if accessed:
+                self.dt_db.execute(f'UPDATE "{self.name}" SET accessed_at = ?'
+                 ' WHERE hash = ?', accessed, many=True)
+            if stored:
+                self.dt_db.execute(f'UPDATE "{self.name}" SET nbytes = ?'
+                 ' WHERE hash = ?', stored, many=True)
+            LOGGER.debug(f"{len(rows)} hash values and {len(lineage_rows)}"
+             " lineage rows are added to the tracker.")
         except Exception as e:
-            print(e)
-            LOGGER.debug(f"Something went wrong in adding tracking data.")
-            
-    def remove_incident(self, incident_name):
-        self.dt_db.update_nested_container(self.name, incident_name, [], append=False)              
+            LOGGER.warning(f"Something went wrong in adding tracking data. "
+             + str(e))
+        self.dt_db.stats.observe("tracker_flush", time.perf_counter() - t_0)
+        self.dt_db.stats.count("tracker_rows", n_rows)
+
+    def incident_hashes(self, incident_name, kind=None):
+        """ Returns the list of the hash values of the incident records.
+
+        Inputs:
+            | incident_name: incident name
+            | kind: "original" or "processed"; None returns both.
+        """
+        self.add_to_database()
+        if kind is None:
+            rows = self.dt_db.select(f'SELECT hash FROM "{self.name}"'
+             ' WHERE incident = ?', (incident_name,))
+        else:
+            rows = self.dt_db.select(f'SELECT hash FROM "{self.name}"'
+             ' WHERE incident = ? AND kind = ?', (incident_name, kind))
+        return [row[0] for row in rows]
+
+    def catalog(self):
+        """ Returns a list of (incident, label, number of records, total
+        size in bytes, first creation time, last creation time) rows of the
+        catalog. Original records (and the records of older databases) have
+        an empty label. """
+        self.add_to_database()
+        return [tuple(row) for row in self.dt_db.select(f'SELECT incident,'
+         ' label, n_items, nbytes, first_created, last_created FROM'
+         f' "{self.catalog_name}" ORDER BY incident, label')]
+
+    def records(self):
+        """ Returns a list of (incident, hash, kind, label, size in bytes, 
+        creation time) rows of the tracked records. """
+        self.add_to_database()
+        return [tuple(row) for row in self.dt_db.select(f'SELECT incident,'
+         f' hash, kind, label, nbytes, created_at FROM "{self.name}"'
+         ' ORDER BY created_at')]
 
+    def export_rows(self):
+        """ Returns a dictionary of the rows of the tracker ("records"; see
+        records), lineage ("lineage"), and chain ("chains") tables. """
+        self.add_to_database()
+        return {
+            "records": self.records(),
+            "lineage": [tuple(row) for row in self.dt_db.select(f'SELECT'
+             f' parent, label, child, created_at FROM "{self.lineage_name}"')],
+            "chains": [tuple(row) for row in self.dt_db.select(f'SELECT'
+             f' chain, record FROM "{self.chains_name}"')]
+        }
 
-    
+    def import_rows(self, rows):
+        """ Inserts the rows of export_rows into the tracker tables. Rows 
+        that are already tracked are kept as they are. """
+        self.add_to_database()
+        self.dt_db.execute(f'INSERT OR IGNORE INTO "{self.name}"'
+         ' (incident, hash, kind, label, nbytes, created_at) VALUES'
+         ' (?,?,?,?,?,?)', rows["records"], many=True)
+        self.dt_db.execute(f'INSERT OR IGNORE INTO "{self.lineage_name}"'
+         ' (parent, label, child, created_at) VALUES (?,?,?,?)',
+         rows["lineage"], many=True)
+        self.dt_db.execute(f'INSERT OR IGNORE INTO "{self.chains_name}"'
+         ' (chain, record) VALUES (?,?)', rows["chains"], many=True)
 
+    def lru_hashes(self, kind="processed"):
+        """ Returns a list of (hash value, size in bytes) of the records, 
+        from the least recently used (accessed, or else created) one. Hash 
+        values that are tracked by several incidents are listed once.
+
+        Inputs:
+            | kind: "original" or "processed"
+        """
+        self.add_to_database()
+        return [tuple(row) for row in self.dt_db.select(f'SELECT hash,'
+         ' MAX(COALESCE(nbytes, 0)) FROM'
+         f' "{self.name}" WHERE kind = ? GROUP BY hash ORDER BY'
+         ' MAX(COALESCE(accessed_at, created_at))', (kind,))]
+
+    def remove_hashes(self, hash_values):
+        """ Removes the hash values (of all incidents) from the tracker, 
+        and their lineage and chain rows. """
+        self.add_to_database()
+        hash_values = list(hash_values)
+        for i in range(0, len(hash_values), 500):
+            chunk = tuple(hash_values[i:i+500])
+            self.dt_db.execute(f'DELETE FROM "{self.name}" WHERE hash IN'
+             f' ({",".join("?"*len(chunk))})', chunk)
+        self.remove_lineage(hash_values)
+
+    def children(self, parent_hash):
+        """ Returns a list of (label name, child hash) of the records that
+        are processed from the parent record.
+
+        Inputs:
+            | parent_hash: hash value of the parent record
+        """
+        self.add_to_database()
+        return [tuple(row) for row in self.dt_db.select(f'SELECT label, child'
+         f' FROM "{self.lineage_name}" WHERE parent = ? ORDER BY created_at',
+         (parent_hash,))]
+
+    def exclusive_hashes(self, incident_name):
+        """ Returns the hash values of the incident records that are not 
+        tracked by the other incidents, or by the trackers of the other
+        projects that share the database. Hash values are content based, so
+        incidents with the same records share them.
+
+        Inputs:
+            | incident_name: incident name
+        """
+        self.add_to_database()
+        trackers = [row[0] for row in self.dt_db.select("SELECT name FROM"
+         " sqlite_master WHERE type = 'table' AND name LIKE '%_dbtracker'")
+         if row[0] != self.name]
+        query = (f'SELECT hash FROM "{self.name}" AS t WHERE incident = ?'
+         f' AND NOT EXISTS (SELECT 1 FROM "{self.name}" WHERE hash = t.hash'
+         ' AND incident != ?)')
+        for tracker in trackers:
+            query += (f' AND NOT EXISTS (SELECT 1 FROM "{tracker}" WHERE'
+             ' hash = t.hash)')
+        rows = self.dt_db.select(query, (incident_name, incident_name))
+        return [row[0] for row in rows]
+
+    def remove_lineage(self, hash_values):
+        """ Removes the lineage rows of the records (as parent or child), 
+        and their chain rows. """
+        self.add_to_database()
+        hash_values = list(hash_values)
+        removed = set(hash_values)
+        with self.lock:
+            self.chain_pending = {key: value for key, value in
+             self.chain_pending.items() if value not in removed}
+        for i in range(0, len(hash_values), 500):
+            chunk = tuple(hash_values[i:i+500])
+            marks = ",".join("?"*len(chunk))
+            self.dt_db.execute(f'DELETE FROM "{self.lineage_name}" WHERE'
+             f' parent IN ({marks}) OR child IN ({marks})', chunk + chunk)
+            self.dt_db.execute(f'DELETE FROM "{self.chains_name}" WHERE'
+             f' record IN ({marks})', chunk)
+
+    def remove_incident(self, incident_name):
+        """ Removes the hash values of the incident from the tracker. """
+        with self.lock:
+            self.buffer.pop(incident_name, None)
+        self.dt_db.execute(f'DELETE FROM "{self.name}" WHERE incident = ?',
+         (incident_name,))
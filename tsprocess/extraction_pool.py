@@ -0,0 +1,172 @@
+"""
+extraction_pool.py
+====================================
+The core module for the ExtractionPool class.
+"""
+
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+from .log import LOGGER
+from .record import Record
+
+
+# state of a worker process (see ExtractionPool._init_worker).
+_worker = {}
+
+
+class _StagedDataBase:
+    """ Database of a worker process: values are read from the database,
+    and written values are staged (kept in memory, and listed in ops). """
+
+    def __init__(self, db, ops):
+        self.db = db
+        self.ops = ops
+        self.staged = {}
+
+    def __getattr__(self, name):
+        return getattr(self.db, name)
+
+    def get_value(self, key):
+        if key in self.staged:
+            return self.staged[key]
+        return self.db.get_value(key)
+
+    def set_value(self, key, value, segment=None):
+        self.staged[key] = value
+        self.ops.append(("set_value", (key, value), {"segment": segment}))
+
+
+class _StagedTracker:
+    """ Tracker of a worker process: tracked rows are staged in ops. """
+
+    def __init__(self, tracker, ops):
+        self.tracker = tracker
+        self.ops = ops
+        self.chains = {}
+
+    def __getattr__(self, name):
+        return getattr(self.tracker, name)
+
+    def track_incident_hash(self, *args, **kwargs):
+        self.ops.append(("track_incident_hash", args, kwargs))
+
+    def track_lineage(self, *args, **kwargs):
+        self.ops.append(("track_lineage", args, kwargs))
+
+    def track_chain(self, chain_hash, hash_val):
+        self.chains[chain_hash] = hash_val
+        self.ops.append(("track_chain", (chain_hash, hash_val), {}))
+
+    def chain_records(self, chain_hashes):
+        found = self.tracker.chain_records([key for key in chain_hashes
+         if key not in self.chains])
+        found.update({key: self.chains[key] for key in chain_hashes
+         if key in self.chains})
+        return found
+
+
+class ExtractionPool:
+    """ Pool of worker processes that load and process the records of a
+    query plan (see QueryPlan), one station per task.
+
+    The worker processes are forked, so they start with the project
+    (processing labels, stations, incidents, database cache) of the main
+    process. They read the database through their own connections, and do
+    not write: the records and tracker rows that they would write are sent
+    back with the results, and written by the main process, in the order of
+    the stations. The database and the records are the same as processing
+    the stations one by one.
+
+    The database should be in multiprocess mode (WAL journal mode), so the
+    workers can read while the main process writes.
+
+    Inputs:
+        | workers: number of worker processes
+    """
+
+    def __init__(self, workers):
+        self.workers = workers
+
+    def __str__(self):
+        return f"ExtractionPool with {self.workers} workers"
+
+    def __repr__(self):
+        return f"ExtractionPool({self.workers})"
+
+    @staticmethod
+    def is_supported():
+        """ Returns True if worker processes can be forked (e.g., not on
+        Windows). """
+        return "fork" in multiprocessing.get_all_start_methods()
+
+    @staticmethod
+    def _init_worker(plan, stations, incidents):
+        """ Stages the writes of the worker process. """
+        ops = []
+        _worker.update(plan=plan, stations=stations, incidents=incidents,
+         ops=ops, db=_StagedDataBase(Record.pr_db, ops),
+         tracker=_StagedTracker(Record.pr_inc_tracker, ops))
+        Record.pr_db = _worker["db"]
+        Record.pr_inc_tracker = _worker["tracker"]
+
+    @staticmethod
+    def _extract_station(index):
+        """ Returns the records of a station, and the staged writes. """
+        ops = _worker["ops"]
+        ops.clear()
+        _worker["db"].staged.clear()
+        _worker["tracker"].chains.clear()
+        records = _worker["plan"].execute(_worker["stations"][index],
+         _worker["incidents"])
+        return records, list(ops)
+
+    @staticmethod
+    def _write(ops):
+        """ Writes the staged writes of a worker (main process). """
+        nbytes = {}
+        for name, args, kwargs in ops:
+            if name == "set_value":
+                nbytes[args[0]] = Record.pr_db.set_value(*args, **kwargs)
+            elif name == "track_incident_hash":
+                kwargs = dict(kwargs)
+                kwargs["nbytes"] = nbytes.get(args[1], kwargs.get("nbytes"))
+                Record.pr_inc_tracker.track_incident_hash(*args, **kwargs)
+            else:
+                getattr(Record.pr_inc_tracker, name)(*args, **kwargs)
+
+    def map(self, plan, stations, incidents):
+        """ Returns the records of the stations (one list per station, see
+        QueryPlan.execute), in the order of the stations. The staged
+        writes are written as the results arrive.
+
+        Inputs:
+            | plan: a QueryPlan object
+            | stations: list of station objects
+            | incidents: dictionary of the incidents (name: incident object)
+        """
+        if not stations:
+            return []
+        # queued (or not yet committed) writes are not seen by the workers.
+        Record.pr_db.flush()
+        Record.pr_inc_tracker.add_to_database()
+        workers = min(self.workers, len(stations))
+        chunksize = max(1, len(stations)//(4*workers))
+
+        records = []
+        with ProcessPoolExecutor(max_workers=workers,
+         mp_context=multiprocessing.get_context("fork"),
+         initializer=self._init_worker,
+         initargs=(plan, stations, incidents)) as executor:
+            # the workers are forked when the tasks are submitted, before
+            # the main process starts writing.
+            results = executor.map(self._extract_station,
+             range(len(stations)), chunksize=chunksize)
+            with Record.pr_db.batch():
+                for st_records, ops in results:
+                    self._write(ops)
+                    records.append(st_records)
+
+        LOGGER.debug(f"Records of {len(stations)} stations are extracted by"
+         f" {workers} worker processes.")
+        return records
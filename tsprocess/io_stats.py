@@ -0,0 +1,88 @@
+"""
+io_stats.py
+====================================
+The core module for the IOStats class.
+"""
+
+import time
+import threading
+from contextlib import contextmanager
+
+
+class IOStats:
+    """ Counters and latency histograms of the database operations (e.g.,
+    disk reads, serialization, tracker flushes). Latencies are counted in
+    logarithmic buckets, with upper bounds in seconds (latency_bounds). It
+    is safe to use from several threads.
+
+    Example:
+
+    >>> stats = IOStats()
+    >>> stats.count("bytes_read", 100)
+    >>> stats.observe("disk_read", 0.002)
+    >>> stats.counters["bytes_read"], stats.latencies["disk_read"]["count"]
+    (100, 1)
+    >>> stats.latencies["disk_read"]["buckets"][3]
+    1
+    """
+
+    latency_bounds = [1e-5, 1e-4, 1e-3, 1e-2, 1e-1, 1, 10, float("inf")]
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def __str__(self):
+        return f"IOStats: {self.counters}"
+
+    def __repr__(self):
+        return "IOStats()"
+
+    def reset(self):
+        """ Sets all counters and histograms to zero. """
+        with self.lock:
+            self.counters = {}
+            self.latencies = {}
+            self.since = time.time()
+
+    def count(self, name, value=1):
+        """ Adds the value to the counter. """
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def observe(self, name, seconds):
+        """ Adds one observation to the latency histogram. """
+        with self.lock:
+            latency = self.latencies.get(name)
+            if latency is None:
+                latency = self.latencies[name] = {"count": 0, "total": 0.0,
+                 "max": 0.0, "buckets": [0]*len(self.latency_bounds)}
+            latency["count"] += 1
+            latency["total"] += seconds
+            latency["max"] = max(latency["max"], seconds)
+            for i, bound in enumerate(self.latency_bounds):
+                if seconds <= bound:
+                    latency["buckets"][i] += 1
+                    break
+
+    @contextmanager
+    def timer(self, name):
+        """ Observes the time spent in the context. """
+        t_0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - t_0)
+
+    def as_dict(self):
+        """ Returns a copy of the counters and the latency histograms. Each
+        histogram has count, total, mean, and max (seconds), and the number
+        of observations in each bucket. """
+        with self.lock:
+            latencies = {}
+            for name, latency in self.latencies.items():
+                latencies[name] = dict(latency,
+                 buckets=dict(zip(self.latency_bounds, latency["buckets"])),
+                 mean=latency["total"]/latency["count"])
+            return {"since": self.since, "counters": dict(self.counters),
+             "latencies": latencies}
@@ -4,12 +4,20 @@ project.py
 The core module for the project class.
 """
 
+import io
 import os
+import json
+import time
+import pickle
 import hashlib
+import tarfile
+import threading
+from collections import deque
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
 from typing import Any, List, Set, Dict, Tuple, Optional
 
 import pandas as pd
-import sqlite3
 from ipywidgets import HTML
 from datetime import datetime
 import matplotlib.pyplot as plt
@@ -22,7 +30,11 @@ from .log import LOGGER
 from .record import Record
 from .station import Station
 from .incident import Incident
+from .query_plan import QueryPlan
+from .extraction_pool import ExtractionPool
+from .read_ahead import ReadAhead
 from .database import DataBase
+from .storage import ArrayCodec
 from .timeseries import TimeSeries
 from .db_tracker import DataBaseTracker
 from .ts_utils import (check_opt_param_minmax, query_opt_params, write_into_file,
@@ -38,6 +50,47 @@ from .ts_plot_utils import (color_code,plot_displacement_helper,
 class Project:
     """ Project Class    
     p1 = Project('myproject')
+
+    Optional database parameters (db_opt_params):
+        | cache_size: maximum number of records in the in-memory cache
+          (default: 2000)
+        | cache_bytes: memory budget of the in-memory cache in bytes
+          (default: 2 GB)
+        | storage: database storage backend, "pickle", "columnar", or "mmap"
+          (default: "pickle")
+        | pragmas: dictionary of SQLite pragmas, e.g., {"journal_mode": "WAL",
+          "synchronous": "NORMAL", "page_size": 65536}
+        | compression: codec of the stored arrays, "none", "zlib", "lzma", or
+          "bz2" (default: "none")
+        | compression_level: codec level (default: codec's default)
+        | shuffle: byte-shuffle arrays before compression (default: False)
+        | write_behind: write records on a background thread, so processing
+          does not wait for the disk (default: False)
+        | write_queue_size: maximum number of queued writes, before processing
+          waits for the writer thread, or that a batch keeps in multiprocess
+          mode (default: 256)
+        | multiprocess: share the database between processes (e.g., a 
+          multiprocessing pool, or several notebooks), with WAL journal mode
+          and one writer at a time (default: False)
+        | pool_size: number of reader connections in multiprocess mode 
+          (default: 4)
+        | cache_dir: directory of the database file (default: current 
+          directory)
+        | shared_cache: use one database in cache_dir for all projects, so 
+          identical processing is shared between projects (default: False)
+        | disk_quota: maximum size of the database files in bytes. The least
+          recently used processed records are deleted after each query to 
+          stay under it; original records are kept (default: None, no 
+          quota). See enforce_disk_quota.
+        | checkpoint: which processed records of a processing chain are
+          written to the database: "all" (every step), "final" (the last
+          step), or "none" (default: "all"). See set_checkpoint.
+        | workers: number of worker processes that load and process the 
+          records of a query (default: 1); it needs multiprocess. See 
+          ExtractionPool.
+        | read_ahead: number of station files that are read and parsed by
+          background threads ahead of the processing, if their records are 
+          not in the database (default: 0, no read-ahead). See ReadAhead.
     """
 
     # color_code = color_code
@@ -47,10 +100,11 @@ class Project:
 
     _instance = None
 
-    def __new__(cls,name):
+    def __new__(cls,name, db_opt_params=None):
         if cls._instance is None:
             cls._instance = super(Project,cls).__new__(cls)
             cls._instance.name = name
+            cls._instance.db_opt_params = db_opt_params or {}
             cls._instance.tracker_name = name + "_dbtracker"
             cls._instance.pr_db = None
             cls._instance.path_to_output_dir = None
@@ -79,11 +133,29 @@ class Project:
     @classmethod
     def _connect_to_database(cls):
         """ Creates and connects to a database."""
-        cls._instance.pr_db = DataBase(cls._instance.name+"_db", cache_size=2000)
+        db_opt_params = cls._instance.db_opt_params
+        cache_dir = db_opt_params.get("cache_dir", "")
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+        db_name = ("tsprocess_shared_db" if db_opt_params.get("shared_cache")
+         else cls._instance.name+"_db")
+        cls._instance.pr_db = DataBase(os.path.join(cache_dir, db_name),
+         cache_size=db_opt_params.get("cache_size", 2000),
+         cache_bytes=db_opt_params.get("cache_bytes", 2*1024**3),
+         storage=db_opt_params.get("storage", "pickle"),
+         pragmas=db_opt_params.get("pragmas"),
+         codec=ArrayCodec(db_opt_params.get("compression", "none"),
+          db_opt_params.get("compression_level"),
+          db_opt_params.get("shuffle", False)),
+         write_behind=db_opt_params.get("write_behind", False),
+         write_queue_size=db_opt_params.get("write_queue_size", 256),
+         multiprocess=db_opt_params.get("multiprocess", False),
+         pool_size=db_opt_params.get("pool_size", 4))
         Record.pr_db = cls._instance.pr_db
+        Record.checkpoint = db_opt_params.get("checkpoint", "all")
         
         cls._instance.pr_inc_tracker = DataBaseTracker(cls._instance.tracker_name,
-         cls._instance, buffer_capacity=3)
+         cls._instance)
         Record.pr_inc_tracker = cls._instance.pr_inc_tracker        
 
     def close_database(self):
@@ -91,10 +163,8 @@ class Project:
 
         # writing data tracker in the buffer into the database
         self.pr_inc_tracker.add_to_database()
-        self.pr_inc_tracker.buffer = {key: [] for 
-         key, _ in self.pr_inc_tracker.buffer.items()}
 
-        # closing database
+        # closing database (queued writes are written first)
         self.pr_db.close_db()
 
     @classmethod
@@ -265,13 +335,21 @@ class Project:
 
         return incident_description
 
-    def _extract_records(self, list_inc, list_process, list_filters):
+    def _extract_records(self, list_inc, list_process, list_filters,
+     workers=None):
         """ Extracts the requested records. Loop through all available
          stations and choose them based on list_filters. For a list of
          incidents with N incidents, each station will return a list of 
          N records, corresponding to the list of incidents. If for some 
          stations there is no record for that incident, it should return 
          None. 
+
+         The chains of all incidents are processed by one query plan (see
+         QueryPlan), so their shared first labels are processed once. With
+         more than one worker (default: the workers option of the project),
+         the stations are processed by a pool of worker processes (see
+         ExtractionPool), if the database is in multiprocess mode; the 
+         records are the same, in the same order.
         """
 
         if len(list_inc) != len(list_process):
@@ -279,40 +357,225 @@ class Project:
              " processing labels should be the same.")
             return
 
-        records = []
+        workers = workers or self.db_opt_params.get("workers", 1)
+        plan = QueryPlan(list_inc, list_process)
+        stations = self._filter_stations(list_filters)
+
+        if workers > 1 and not ExtractionPool.is_supported():
+            LOGGER.warning("Worker processes are not supported on this"
+             " platform. Stations are processed one by one.")
+            workers = 1
+
+        if workers > 1 and not self.pr_db.multiprocess:
+            LOGGER.warning("Worker processes need the multiprocess option"
+             " (WAL journal mode) of the database. Stations are processed"
+             " one by one.")
+            workers = 1
+
+        if workers > 1 and len(stations) > 1:
+            records = ExtractionPool(workers).map(plan, stations,
+             self.incidents)
+        else:
+            # new records are committed to the database in one transaction.
+            with self.pr_db.batch(), self._read_ahead(plan, stations):
+                records = [plan.execute(station, self.incidents) for station
+                 in stations]
+
+        self.enforce_disk_quota()
+        return records
+
+    @contextmanager
+    def _read_ahead(self, plan, stations):
+        """ Reads and parses the station files of the query ahead of the 
+        processing, with read_ahead (option) files in flight (see ReadAhead).
+        The parsing of the next files overlaps with the processing of the 
+        current record, as far as the GIL allows. The read-ahead stalls, and
+        the time that is spent waiting for the files, are counted in the 
+        database I/O stats (see io_stats). """
+        depth = self.db_opt_params.get("read_ahead", 0)
+        if not depth:
+            yield None
+            return
+
+        items = []
+        for station in stations:
+            for incident_name in plan.nodes:
+                if incident_name not in station.inc_st_name:
+                    continue
+                metadata = self.incidents[incident_name].metadata
+                source = Record._source_file(metadata,
+                 station.inc_st_name[incident_name])
+                if source is not None:
+                    items.append((source[0], (station, metadata)))
+
+        with ReadAhead(self._read_source, depth,
+         stats=self.pr_db.stats) as read_ahead:
+            read_ahead.start(items)
+            Record.read_ahead = read_ahead
+            try:
+                yield read_ahead
+            finally:
+                Record.read_ahead = None
+
+    @staticmethod
+    def _read_source(item):
+        """ Returns the original record of the station file, read and parsed
+        (read-ahead thread), or None if it is already in the database. """
+        station, metadata = item
+        incident_name = metadata["incident_name"]
+        st_name = station.inc_st_name[incident_name]
+        original_hash = Record._original_hash(incident_name, st_name, station,
+         metadata)
+        if Record.pr_db.existing_keys([original_hash]):
+            return None
+        return Record._load_source(station, metadata, st_name,
+         read_ahead=False)
+
+    def explain(self, list_inc, list_process, list_filters):
+        """ Prints the query plan of the processing chains, without 
+        processing any record: the nodes (shared first labels of the 
+        chains) of each incident, and the number of stations. Returns the
+        QueryPlan object.
+
+        Inputs:
+            | list_inc: list of incidents
+            | list_process: list of processes, one list per incident
+            | list filters: list of filters defined for stations
+        """
+        if not self._is_incident_valid(list_inc):
+            return
+
+        if not self._is_processing_label_valid(list_process):
+            return
+
+        if len(list_inc) != len(list_process):
+            LOGGER.error("Number of incidents, and number of nested lists of"
+             " processing labels should be the same.")
+            return
+
+        plan = QueryPlan(list_inc, list_process)
+        stations = self._filter_stations(list_filters)
+        n_stations = {incident_name: sum(incident_name in st.inc_st_name
+         for st in stations) for incident_name in plan.nodes}
+        print(plan.explain(n_stations))
+        return plan
+
+    def _filter_stations(self, list_filters):
+        """ Returns the list of stations that pass all station filters. """
+        stations = []
         for station in Station.list_of_stations:
-           
-            ignore_this_station = False
-            for st_f in list_filters:
-                if not station._check_station_filter(st_f):
-                    # station could not pass at least one of the filters.
-                    ignore_this_station = True
-                    break
-            
-            if ignore_this_station:
-                continue
+            # station should pass all filters.
+            if all(station._check_station_filter(st_f) for st_f in
+             list_filters):
+                stations.append(station)
+        return stations
+
+    def prefetch(self, list_inc, list_process, list_filters, workers=2):
+        """ Loads (or processes) the records of a query in the background, 
+        and keeps them in the database cache and on the disk. A later query
+        with the same incidents, processing labels, and station filters 
+        (e.g., plot_velocity_records) does not wait for them.
+
+        Stations are selected as in the queries, and are loaded by a pool of
+        worker threads. The records that do not fit in the cache budget are
+        only stored on the disk. The disk quota is not enforced in the 
+        background; the next query (or enforce_disk_quota) does it.
+
+        Inputs:
+            | list_inc: list of incidents
+            | list_process: list of processes, one list per incident
+            | list filters: list of filters defined for stations
+            | workers: number of worker threads
 
-            st_records = []
-            for i,incident_item in enumerate(list_inc):
-                # choose the equivalent station for that incident.
-                incident_metadata = self.incidents[incident_item].metadata
+        Outputs:
+            | background thread (join() waits until the records are loaded),
+              or None if the query is not valid.
+        """
 
-                try:
-                    st_name_inc = None
-                    st_name_inc = station.inc_st_name[incident_item]
-                    list_process_cp = list_process[i].copy()
-                    tmp_record = Record.get_record(station, incident_metadata,
-                     list_process_cp)
-                except KeyError as e:
-                    LOGGER.debug(f' {str(e)} does not have any record at' 
-                    f' the location of station {st_name_inc}')
-                    tmp_record = None
+        if not self._is_incident_valid(list_inc):
+            return
 
-                st_records.append(tmp_record)
+        if not self._is_processing_label_valid(list_process):
+            return
 
-            records.append(st_records)
+        if len(list_inc) != len(list_process):
+            LOGGER.error("Number of incidents, and number of nested lists of"
+             " processing labels should be the same.")
+            return
 
-        return records
+        stations = self._filter_stations(list_filters)
+        plan = QueryPlan(list_inc, list_process)
+
+        def load_station(station):
+            plan.execute(station, self.incidents)
+
+        def run():
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                list(executor.map(load_station, stations))
+            LOGGER.info(f"Records of {len(stations)} stations are"
+             " prefetched.")
+
+        thread = threading.Thread(target=run, daemon=True)
+        thread.start()
+        return thread
+
+    def enforce_disk_quota(self, disk_quota=None):
+        """ Deletes the least recently used processed records until the 
+        database files are within the disk quota, and releases their space 
+        (see DataBase.reclaim_space). Processed records can be computed 
+        again; original records are never deleted. Array files of the mmap
+        storage are append-only, and only shrink when an incident is 
+        removed, so the quota is not enforced (with a warning) on it.
+
+        Inputs:
+            | disk_quota: maximum size in bytes (default: the disk_quota 
+              database parameter). Nothing is done without a quota.
+
+        Outputs:
+            | number of deleted records
+        """
+        disk_quota = disk_quota or self.db_opt_params.get("disk_quota")
+        if not disk_quota:
+            return 0
+
+        # the stored sizes of the queued writes are known once written.
+        self.pr_db.flush()
+        usage = self.pr_db.disk_usage()
+        if usage <= disk_quota:
+            return 0
+
+        if self.pr_db.storage == "mmap":
+            LOGGER.warning(f"Database files ({usage} bytes) are larger than"
+             f" the disk quota ({disk_quota} bytes). Array files of the mmap"
+             " storage do not shrink when records are deleted; no record is"
+             " deleted.")
+            return 0
+
+        candidates = self.pr_inc_tracker.lru_hashes(kind="processed")
+        n_deleted = 0
+        while usage > disk_quota and n_deleted < len(candidates):
+            # deletes (about) the exceeding size, least recently used first.
+            hashes, nbytes = [], 0
+            for hash_value, size in candidates[n_deleted:]:
+                hashes.append(hash_value)
+                nbytes += size
+                if nbytes >= usage - disk_quota:
+                    break
+            self.pr_inc_tracker.remove_hashes(hashes)
+            self.pr_db.delete_many(hashes)
+            self.pr_db.reclaim_space()
+            n_deleted += len(hashes)
+            previous_usage, usage = usage, self.pr_db.disk_usage()
+            if usage >= previous_usage:
+                break
+
+        LOGGER.info(f"{n_deleted} processed records are deleted to stay"
+         f" within the disk quota ({disk_quota} bytes).")
+        if usage > disk_quota:
+            LOGGER.warning(f"Database files ({usage} bytes) are larger than"
+             f" the disk quota ({disk_quota} bytes). Original records are"
+             " not deleted.")
+        return n_deleted
 
     def _is_incident_valid(self,list_incidents):
         """ Checks if the requested processing label is a valid label """
@@ -325,41 +588,58 @@ class Project:
         
         return True
 
-    def remove_incident(self, incident_name):
-        """Removes incident from the project."""
+    def remove_incident(self, incident_name, background=False):
+        """Removes incident from the project. 
+        
+        The incident records (listed by the tracker) are deleted together,
+        and the freed space is released to the file system in chunks (see 
+        DataBase.reclaim_space). With background, the records are deleted
+        on a background thread, which is returned.
+        """
         
         if incident_name not in self.incidents:
             LOGGER.warning(f"'{incident_name}' is not exist."
              f"List of available incidents: {self.incidents}")
             return
 
-        # first remove the incident related records from database.
-        tmp_list_hash = self.pr_db.get_nested_container(
-            self.tracker_name)[incident_name]
+        # first remove the incident related records from database. Records
+        # that are shared with other incidents (or projects) are kept.
+        tmp_list_hash = self.pr_inc_tracker.exclusive_hashes(incident_name)
+
+        # mmap storage keeps the incident records in one file, which can
+        # be dropped only if none of them is shared.
+        shared = (set(self.pr_inc_tracker.incident_hashes(incident_name))
+         - set(tmp_list_hash))
+        if not self.db_opt_params.get("shared_cache") and not shared:
+            self.pr_db.drop_segment(incident_name)
 
-        # it might be a good idea to assign this to another thread or processor.
-        try:
-            for item in tmp_list_hash:
-                self.pr_db.delete_value(item)
-            LOGGER.debug(f"All records related to incident {incident_name}"
-             ", has been removed from database.")
-        except:
-            pass
-        
         try:
             self.incidents.pop(incident_name)
             LOGGER.info(f"Incident {incident_name} is deleted.")
         except Exception:
             LOGGER.error(f"Could not delete incident '{incident_name}'")
-        
-        # Sqlite3 removes the data however, does nor release it.
-        # it keeps it for future use. We can manually clear the database.
-        conn=sqlite3.connect(self.name + '_db.sqlite')
-        conn.execute("VACUUM")
-        conn.close()
 
         # clean the hash values from tracker:
         self.pr_inc_tracker.remove_incident(incident_name)
+        self.pr_inc_tracker.remove_lineage(tmp_list_hash)
+
+        deleting = self.pr_db.delete_many(tmp_list_hash, background)
+
+        def reclaim():
+            if deleting is not None:
+                deleting.join()
+            # Sqlite3 removes the data however, does not release it.
+            self.pr_db.reclaim_space()
+            LOGGER.debug(f"All records related to incident {incident_name}"
+             ", has been removed from database.")
+
+        if not background:
+            reclaim()
+            return None
+
+        thread = threading.Thread(target=reclaim, daemon=True)
+        thread.start()
+        return thread
     
     # source
     def add_source_hypocenter(self,lat, lon, depth):
@@ -393,6 +673,37 @@ class Project:
         TimeSeries._add_processing_label(label_name, label_type,
          hyper_parameters)
 
+    def set_checkpoint(self, policy, label_name=None):
+        """ Sets which processed records of the processing chains are 
+        written to the database. The labels of a chain are applied in 
+        memory; the intermediate records that are not written are not 
+        kept, and are processed again if they are requested later.
+
+        Inputs:
+            | policy: "all" (every step), "final" (only the last step of a
+              chain), or "none" (nothing is written)
+            | label_name: if provided, the policy only applies to the 
+              results of this label, and takes precedence over the project
+              policy. Use None as policy to remove it.
+        """
+        if label_name is not None and policy is None:
+            Record.label_checkpoints.pop(label_name, None)
+            return
+
+        if policy not in Record.checkpoint_policies:
+            LOGGER.error(f"{policy} is not a valid checkpoint policy"
+             f" ({Record.checkpoint_policies}). Command ignored.")
+            return
+
+        if label_name is None:
+            Record.checkpoint = policy
+            self.db_opt_params["checkpoint"] = policy
+            return
+
+        if not self._is_processing_label_valid([[label_name]]):
+            return
+        Record.label_checkpoints[label_name] = policy
+
         
     def list_of_processing_labels(self):
         """ Returns a list of available processing labels"""
@@ -897,29 +1208,275 @@ class Project:
 
     #Database
     def database_summary(self):
-        """ Returns a summary of database """
+        """ Prints a summary of the database: the number of records, and 
+        their size per incident and processing label (from the tracker 
+        catalog, without loading the records), and the cache, compression,
+        and I/O statistics. """
 
+        self.pr_db.flush()
         try:
-            db_file = self.name+'_db.sqlite'
+            db_file = self.pr_db.name
             database_size = os.path.getsize(db_file)
         except OSError as e:
             LOGGER.warning(f"{db_file} is not found.")
             database_size = None
         
-        db_keys = self.pr_db.db.keys()
-        list_of_trackers = [key for key in db_keys if
-         '_dbtracker' in key.lower()]
+        catalog = self.pr_inc_tracker.catalog()
+        n_tracked = sum(row[2] for row in catalog)
 
         if database_size:
             print(f"Database name: {db_file}")
             print(f"Database size: {str(database_size/1000000)} MB.")
-            print(f"Number of items: {str(len(list(self.pr_db.db.keys())))}")
-            print(f"List of database trackers: {list_of_trackers}")
+            print(f"Number of items: {n_tracked}")
+            print(f"Database tracker: {self.tracker_name}")
+
+        incidents, labels = {}, {}
+        for incident_name, label, n_items, nbytes, _, last_created in catalog:
+            for group, name in [(incidents, incident_name), (labels, label)]:
+                n_0, nbytes_0, last_0 = group.get(name, (0, 0, 0))
+                group[name] = (n_0 + n_items, nbytes_0 + nbytes,
+                 max(last_0, last_created or 0))
+        for title, group in [("incident", incidents), ("label", labels)]:
+            print(f"Records by {title}:")
+            for name, (n_items, nbytes, last_created) in group.items():
+                created = datetime.fromtimestamp(last_created).strftime(
+                 "%Y-%m-%d %H:%M:%S")
+                print(f"  {name or '(original)'}: {n_items} records,"
+                 f" {nbytes/1000000:.2f} MB, last created: {created}")
+
+        cache_info = self.pr_db.cache_info()
+        print(f"Cache: {cache_info['items']} items,"
+         f" {cache_info['nbytes']/1000000:.2f} of"
+         f" {cache_info['cache_bytes']/1000000:.2f} MB,"
+         f" hits: {cache_info['hits']}, misses: {cache_info['misses']},"
+         f" evictions: {cache_info['evictions']}")
+
+        cmp_info = self.pr_db.compression_info()
+        ratio = (f"{cmp_info['ratio']:.2f}" if cmp_info['ratio'] else "n/a")
+        throughput = (f"{cmp_info['decode_throughput']/1000000:.1f} MB/s" if 
+         cmp_info['decode_throughput'] else "n/a")
+        print(f"Compression: {cmp_info['codec']}"
+         f" (level: {cmp_info['level']}, shuffle: {cmp_info['shuffle']}),"
+         f" ratio: {ratio}, decode throughput: {throughput}")
+
+        io_stats = self.io_stats()
+        counters = io_stats["counters"]
+        print(f"I/O: disk reads: {counters.get('disk_reads', 0)},"
+         f" disk writes: {counters.get('disk_writes', 0)},"
+         f" read: {counters.get('bytes_read', 0)/1000000:.2f} MB,"
+         f" written: {counters.get('bytes_written', 0)/1000000:.2f} MB,"
+         f" tracker rows: {counters.get('tracker_rows', 0)}")
+        for name, latency in io_stats["latencies"].items():
+            print(f"  {name}: {latency['count']} calls,"
+             f" total: {latency['total']:.3f} s,"
+             f" mean: {1000*latency['mean']:.3f} ms,"
+             f" max: {1000*latency['max']:.3f} ms")
+
+    def export_cache(self, path, compression="zlib", level=None,
+     chunk_size=64, workers=4):
+        """ Writes the records of the project (see the tracker), the tracker
+        tables, and the processing label and station filter definitions 
+        into one archive file, so another project (e.g., on a batch node)
+        can start with them (see import_cache). Records are pickled and
+        compressed in chunks of chunk_size records, by a pool of worker
+        threads.
+
+        Inputs:
+            | path: archive file path
+            | compression: "zlib", "lzma", or "bz2"
+            | level: compression level (default: codec's default)
+            | chunk_size: number of records in each compressed chunk
+            | workers: number of compression threads
+
+        Outputs:
+            | number of exported records
+        """
+        if compression not in ArrayCodec.compressors:
+            LOGGER.warning(f"Compression '{compression}' is not supported."
+             f" Valid compressions: {list(ArrayCodec.compressors)}. Command"
+             " ignored.")
+            return
+
+        compress, _, default_level = ArrayCodec.compressors[compression]
+        level = default_level if level is None else level
+        tracker_rows = self.pr_inc_tracker.export_rows()
+        segments = {}
+        for incident_name, hash_value, *_ in tracker_rows["records"]:
+            segments.setdefault(hash_value, incident_name)
+        keys = list(segments)
+
+        def pack(chunk):
+            values = self.pr_db.load_many(chunk)
+            return compress(pickle.dumps([(key, segments[key], values[key])
+             for key in chunk if key in values],
+             protocol=pickle.HIGHEST_PROTOCOL), level)
+
+        def add_file(tar, name, data):
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            info.mtime = time.time()
+            tar.addfile(info, io.BytesIO(data))
+
+        chunks = [keys[i:i+chunk_size] for i in range(0, len(keys),
+         chunk_size)]
+        with tarfile.open(path, "w") as tar:
+            add_file(tar, "manifest.json", json.dumps({"format": 1,
+             "project": self.name, "compression": compression,
+             "n_records": len(keys), "n_chunks": len(chunks),
+             "created_at": time.time()}).encode("utf-8"))
+            add_file(tar, "definitions.pkl", pickle.dumps({
+             "timeseries_labels": TimeSeries.processing_labels,
+             "record_labels": Record.processing_labels,
+             "station_filters": Station.station_filters}))
+            add_file(tar, "tracker.pkl", compress(pickle.dumps(tracker_rows),
+             level))
+
+            # at most 2*workers compressed chunks are kept in memory.
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                futures = deque()
+                for i, chunk in enumerate(chunks):
+                    futures.append((i, executor.submit(pack, chunk)))
+                    if len(futures) >= 2*workers:
+                        j, future = futures.popleft()
+                        add_file(tar, f"records/{j:06d}", future.result())
+                for j, future in futures:
+                    add_file(tar, f"records/{j:06d}", future.result())
+
+        LOGGER.info(f"{len(keys)} records are exported into {path}.")
+        return len(keys)
+
+    def import_cache(self, path, workers=4):
+        """ Adds the records, tracker tables, and definitions of an archive
+        of export_cache to the project database. Records that are already
+        in the database are skipped. Processing labels and station filters
+        that are not defined are added; the current definitions are kept.
+        Original records are keyed by the station files of this project 
+        (which can be in another folder), if their content is the same.
+        Archives are pickled data; only import archives from trusted 
+        sources.
+
+        Inputs:
+            | path: archive file path
+            | workers: number of decompression threads
+
+        Outputs:
+            | number of imported records
+        """
+        n_imported = 0
+        with tarfile.open(path, "r") as tar:
+            manifest = json.loads(tar.extractfile("manifest.json").read())
+            _, decompress, _ = ArrayCodec.compressors[manifest["compression"]]
+            self._import_definitions(pickle.loads(tar.extractfile(
+             "definitions.pkl").read()))
+
+            def unpack(data):
+                return pickle.loads(decompress(data))
+
+            tracker_rows = unpack(tar.extractfile("tracker.pkl").read())
+            originals = {row[1] for row in tracker_rows["records"] if
+             row[2] == "original"}
+            local_originals = self._local_originals(originals)
+            remapped = {}
+
+            def import_chunk(items):
+                items = [(remapped.setdefault(key, local_originals.get(
+                 value.unique_id_1, key)) if key in originals else key,
+                 segment, value) for key, segment, value in items]
+                existing = self.pr_db.existing_keys([item[0] for item in 
+                 items])
+                with self.pr_db.batch():
+                    for key, segment, value in items:
+                        if key not in existing:
+                            value.this_record_hash = key
+                            self.pr_db.set_value(key, value, segment)
+                return len(items) - len(existing)
+
+            names = sorted(name for name in tar.getnames() if
+             name.startswith("records/"))
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                futures = deque()
+                for name in names:
+                    futures.append(executor.submit(unpack,
+                     tar.extractfile(name).read()))
+                    if len(futures) >= 2*workers:
+                        n_imported += import_chunk(futures.popleft().result())
+                for future in futures:
+                    n_imported += import_chunk(future.result())
+
+            tracker_rows["records"] = [(row[0], remapped.get(row[1], row[1]))
+             + tuple(row[2:]) for row in tracker_rows["records"]]
+            tracker_rows["lineage"] = [(remapped.get(row[0], row[0]),) +
+             tuple(row[1:]) for row in tracker_rows["lineage"]]
+            self.pr_inc_tracker.import_rows(tracker_rows)
+
+        LOGGER.info(f"{n_imported} of {manifest['n_records']} records are"
+         f" imported from {path}.")
+        return n_imported
+
+    def _local_originals(self, original_hashes):
+        """ Returns a dictionary of the content ids (see Record._content_id)
+        of the original records of the project stations, and their hash 
+        values, for the ones that are not in original_hashes (e.g., the 
+        station files are in another folder, or have other modification 
+        times). """
+        local_originals = {}
+        for station in Station.list_of_stations:
+            for incident_name, st_name in station.inc_st_name.items():
+                if incident_name not in self.incidents:
+                    continue
+                metadata = self.incidents[incident_name].metadata
+                hash_value = Record._original_hash(incident_name, st_name,
+                 station, metadata)
+                if hash_value in original_hashes:
+                    continue
+                try:
+                    local_originals[Record._content_id(metadata, st_name,
+                     station)] = hash_value
+                except (TypeError, OSError):
+                    continue
+        return local_originals
+
+    @staticmethod
+    def _import_definitions(definitions):
+        """ Adds the processing labels and station filters that are not
+        defined. """
+        for current, imported in [
+         (TimeSeries.processing_labels, definitions["timeseries_labels"]),
+         (Record.processing_labels, definitions["record_labels"]),
+         (Station.station_filters, definitions["station_filters"])]:
+            for name, definition in imported.items():
+                if name not in current:
+                    current[name] = definition
+                elif current[name] != definition:
+                    LOGGER.warning(f"'{name}' is defined differently in the"
+                     " imported cache. The current definition is kept.")
+
+    def io_stats(self, reset=False):
+        """ Returns the database I/O counters and latency histograms (see
+        DataBase.io_stats).
+
+        Inputs:
+            | reset: sets the counters to zero, after they are returned.
+        """
+        return self.pr_db.io_stats(reset)
             
-    def database_content(self):
+    def database_content(self, values=False):
+        """ Prints the tracked records of the database (incident, hash 
+        value, kind, label, size, and creation time), without loading them.
+        With values, prints all keys and values of the database instead, 
+        which loads every value. """
+        self.pr_db.flush()
+        if values:
+            for key, item in self.pr_db.db.items():
+                print(key," : ", item)
+            return
 
-        for key, item in self.pr_db.db.items():
-            print(key," : ", item)
+        for (incident_name, hash_value, kind, label, nbytes,
+         created_at) in self.pr_inc_tracker.records():
+            created = (datetime.fromtimestamp(created_at).strftime(
+             "%Y-%m-%d %H:%M:%S") if created_at else "n/a")
+            print(f"{hash_value} : {incident_name}, {kind}, {label or '-'},"
+             f" {(nbytes or 0)/1000000:.2f} MB, {created}")
     
     def summary(self):
         """
@@ -0,0 +1,191 @@
+"""
+query_plan.py
+====================================
+The core module for the QueryPlan class.
+"""
+
+import threading
+
+from .log import LOGGER
+from .record import Record
+from .ts_utils import canonical_params
+
+
+class QueryPlan:
+    """ Plan of a query: the processing chains of each incident are merged
+    into a tree (a DAG rooted at the original record), where the chains
+    with the same first labels (by label type and hyper parameters, not
+    label name) share their nodes. For each station, a node is computed at
+    most once, from its parent, and only if it is requested, or needed by a
+    requested node that is not in the database.
+
+    Inputs:
+        | list_inc: list of incidents
+        | list_process: list of processes, one list per incident
+
+    Example:
+
+    >>> from tsprocess.timeseries import TimeSeries
+    >>> TimeSeries.processing_labels['doc_lp'] = ['lowpass_filter',
+    ...  {'fc': 1, 'N': 4}]
+    >>> TimeSeries.processing_labels['doc_sc'] = ['scale', {'factor': 2}]
+    >>> plan = QueryPlan(['inc', 'inc', 'inc'], [['doc_lp', 'doc_sc'],
+    ...  ['doc_lp'], []])
+    >>> plan.n_steps, plan.n_planned_steps
+    (3, 2)
+    >>> plan.nodes['inc'][plan.targets[1][1]]['queries']
+    [1]
+    >>> for label_name in ['doc_lp', 'doc_sc']:
+    ...     _ = TimeSeries.processing_labels.pop(label_name)
+    """
+
+    def __init__(self, list_inc, list_process):
+        self.list_inc = list(list_inc)
+        self.list_process = [list(labels) for labels in list_process]
+        # incident -> {node key: node}; the key of a node is the tuple of
+        # the label definitions of its chain (() is the original record).
+        self.nodes = {}
+        # (incident, node key) of each query.
+        self.targets = []
+        self.lock = threading.Lock()
+        self.counts = {"original": 0, "cached": 0, "processed": 0}
+
+        for i, (incident_name, labels) in enumerate(zip(self.list_inc,
+         self.list_process)):
+            nodes = self.nodes.setdefault(incident_name, {(): {"label": None,
+             "labels": [], "parent": None, "queries": []}})
+            key = ()
+            for n, label_name in enumerate(labels):
+                parent = key
+                key = key + (self.label_key(label_name),)
+                if key not in nodes:
+                    nodes[key] = {"label": label_name,
+                     "labels": labels[:n + 1], "parent": parent,
+                     "queries": []}
+            nodes[key]["queries"].append(i)
+            self.targets.append((incident_name, key))
+
+    def __str__(self):
+        return self.explain()
+
+    def __repr__(self):
+        return f"QueryPlan({self.list_inc}, {self.list_process})"
+
+    @staticmethod
+    def label_key(label_name):
+        """ Returns the definition of the label (type and canonical hyper
+        parameters), which identifies its processing. """
+        label_type, hyper_parameters = Record.label_definition(label_name)
+        return f"{label_type}:{canonical_params(hyper_parameters)}"
+
+    @property
+    def n_steps(self):
+        """ Number of label applications for each station, if each chain is
+        processed on its own. """
+        return sum(len(labels) for labels in self.list_process)
+
+    @property
+    def n_planned_steps(self):
+        """ Number of label applications for each station in the plan. """
+        return sum(len(nodes) - 1 for nodes in self.nodes.values())
+
+    def explain(self, n_stations=None):
+        """ Returns a description of the plan: the nodes of each incident,
+        their parents, and the queries that they answer. After execution,
+        it also shows the number of records that are loaded or computed.
+
+        Inputs:
+            | n_stations: number of stations of each incident (optional)
+        """
+        lines = [f"Query plan: {len(self.targets)} queries, "
+         f"{len(self.nodes)} incident(s), {self.n_planned_steps} processing"
+         f" step(s) per station ({self.n_steps} without shared prefixes)."]
+        for incident_name, nodes in self.nodes.items():
+            header = f"{incident_name}"
+            if n_stations is not None:
+                header += f" ({n_stations.get(incident_name, 0)} stations)"
+            lines.append(header)
+            ids = {key: i for i, key in enumerate(nodes)}
+            for key, node in nodes.items():
+                name = " > ".join(node["labels"]) or "original"
+                parent = ("" if node["parent"] is None else
+                 f" <- [{ids[node['parent']]}]")
+                queries = (f"  queries: {node['queries']}" if node["queries"]
+                 else "")
+                lines.append(f"  [{ids[key]}] {name}{parent}{queries}")
+        if any(self.counts.values()):
+            lines.append("Executed: {original} original, {cached} cached"
+             " chain, and {processed} processed record(s).".format(
+             **self.counts))
+        return "\n".join(lines)
+
+    def _count(self, name):
+        with self.lock:
+            self.counts[name] += 1
+
+    def execute(self, station, incidents):
+        """ Returns the records of the queries for the station: one record
+        per query, or None if the station does not have a record for that
+        incident, or it could not be processed.
+
+        Inputs:
+            | station: a station object
+            | incidents: dictionary of the incidents (name: incident object)
+        """
+        records = {}
+        for incident_name in self.nodes:
+            if incident_name not in station.inc_st_name:
+                LOGGER.debug(f"{incident_name} does not have any record at"
+                 " the location of the station.")
+                continue
+            try:
+                records[incident_name] = self._execute_incident(station,
+                 incidents[incident_name].metadata)
+            except Exception as e:
+                LOGGER.warning(f"Could not process the records of"
+                 f" {incident_name} at station"
+                 f" {station.inc_st_name[incident_name]}. {str(e)}")
+
+        return [records[incident_name].get(key) if incident_name in records
+         else None for incident_name, key in self.targets]
+
+    def _execute_incident(self, station, incident_metadata):
+        """ Returns a dictionary of the requested node keys and their
+        records for the station. """
+        incident_name = incident_metadata["incident_name"]
+        nodes = self.nodes[incident_name]
+        original_hash = Record._original_hash(incident_name,
+         station.inc_st_name[incident_name], station, incident_metadata)
+
+        # the processed records of the chains, found in one lookup.
+        chain_keys = {key: Record.chain_hash(original_hash, node["labels"])
+         for key, node in nodes.items() if key}
+        chain_records = Record.pr_inc_tracker.chain_records(
+         list(chain_keys.values()))
+        results = {}
+
+        def resolve(key):
+            if key in results:
+                return results[key]
+            node = nodes[key]
+            record = None
+            if not key:
+                record = Record.get_record(station, incident_metadata, [])
+                self._count("original")
+            elif chain_keys[key] in chain_records:
+                record = Record.pr_db.get_value(chain_records[chain_keys[key]])
+                if record:
+                    self._count("cached")
+            if not record and key:
+                parent = resolve(node["parent"])
+                if parent:
+                    record = Record._get_processed_record(incident_name,
+                     parent, [node["label"]], (original_hash,
+                     nodes[node["parent"]]["labels"]),
+                     final=bool(node["queries"]))
+                    self._count("processed")
+            results[key] = record
+            return record
+
+        return {key: resolve(key) for key, node in nodes.items()
+         if node["queries"]}
@@ -0,0 +1,146 @@
+"""
+read_ahead.py
+====================================
+The core module for the ReadAhead class.
+"""
+
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from .log import LOGGER
+from .io_stats import IOStats
+
+
+class ReadAhead:
+    """ Bounded read-ahead of the items of a query (e.g., station files).
+    The items are loaded in their order by a pool of threads, at most depth
+    items ahead of the last requested one, so reading the next files
+    overlaps with processing the current record.
+
+    Items are requested with get(key) in the same order. The items before a
+    requested one are not used anymore, and are dropped.
+
+    The stats (see io_stats.IOStats) count the items that are ready when
+    they are requested (read_ahead_hits), that are still loading
+    (read_ahead_stalls), that are not scheduled or beyond the read-ahead
+    (read_ahead_misses), and that are loaded but not used
+    (read_ahead_unused). The time that get waits for an item is observed in
+    read_ahead_stall, and the loading time in read_ahead_load.
+
+    Inputs:
+        | loader: function that returns the content of an item (it runs in
+          the threads; it can return None, e.g., if the item is not needed)
+        | depth: maximum number of items that are loaded, or loading, ahead
+        | workers: number of threads (default: depth)
+        | stats: an IOStats object (default: a new one)
+
+    Example:
+
+    >>> with ReadAhead(str.upper, depth=2) as read_ahead:
+    ...     read_ahead.start([('a', 'x'), ('b', 'y'), ('c', 'z')])
+    ...     read_ahead.get('a'), read_ahead.get('c'), read_ahead.get('d')
+    ('X', 'Z', None)
+    """
+
+    def __init__(self, loader, depth=4, workers=None, stats=None):
+        self.loader = loader
+        self.depth = max(1, depth)
+        self.workers = workers or self.depth
+        self.stats = stats if stats is not None else IOStats()
+        self.lock = threading.Lock()
+        self.executor = None
+        self.items = []
+        self.index = {}
+        self.next = 0
+        self.futures = OrderedDict()
+
+    def __str__(self):
+        return (f"ReadAhead: depth {self.depth}, {len(self.futures)} items"
+         " ahead")
+
+    def __repr__(self):
+        return f"ReadAhead({self.loader}, {self.depth}, {self.workers})"
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def start(self, items):
+        """ Starts loading the items.
+
+        Inputs:
+            | items: list of (key, item) in the order they will be requested
+        """
+        with self.lock:
+            self.items = []
+            self.index = {}
+            for key, item in items:
+                if key not in self.index:
+                    self.index[key] = len(self.items)
+                    self.items.append((key, item))
+            self.next = 0
+            if self.executor is None:
+                self.executor = ThreadPoolExecutor(max_workers=self.workers,
+                 thread_name_prefix="read-ahead")
+            self._fill()
+
+    def _fill(self):
+        """ Submits the next items, up to depth items ahead. """
+        while len(self.futures) < self.depth and self.next < len(self.items):
+            key, item = self.items[self.next]
+            self.next += 1
+            self.futures[key] = self.executor.submit(self._load, item)
+
+    def _load(self, item):
+        with self.stats.timer("read_ahead_load"):
+            return self.loader(item)
+
+    def get(self, key):
+        """ Returns the content of the item, or None if it is not loaded by
+        the read-ahead (the caller loads it then). """
+        with self.lock:
+            position = self.index.get(key)
+            if position is None or self.executor is None:
+                self.stats.count("read_ahead_misses")
+                return None
+
+            # the items before the requested one are not used anymore.
+            for earlier in list(self.futures):
+                if self.index[earlier] >= position:
+                    break
+                if not self.futures.pop(earlier).cancel():
+                    self.stats.count("read_ahead_unused")
+            future = self.futures.pop(key, None)
+            self.next = max(self.next, position + 1)
+            self._fill()
+
+        if future is None:
+            # the item is beyond the read-ahead.
+            self.stats.count("read_ahead_misses")
+            return None
+
+        try:
+            if future.done():
+                self.stats.count("read_ahead_hits")
+                return future.result()
+            self.stats.count("read_ahead_stalls")
+            with self.stats.timer("read_ahead_stall"):
+                return future.result()
+        except Exception as e:
+            LOGGER.debug(f"Read-ahead of {key} failed. {str(e)}")
+            return None
+
+    def close(self):
+        """ Cancels the items that are not loaded, and stops the threads. """
+        with self.lock:
+            for future in self.futures.values():
+                future.cancel()
+            self.futures.clear()
+            self.items = []
+            self.index = {}
+            executor, self.executor = self.executor, None
+        if executor is not None:
+            executor.shutdown(wait=True)
@@ -3,7 +3,9 @@ record.py
 ====================================
 The core module for the Record class.
 """
+import io
 import os
+import copy
 import random
 import string
 import hashlib
@@ -14,15 +16,37 @@ import numpy as np
 from .log import LOGGER
 from .station import Station
 from .database import DataBase
-from .timeseries import  Disp, Vel, Acc, Raw, Unitless
-from .ts_utils import (haversine, compute_azimuth, rotate_record, read_smc_v2,
-                       unit_convention_factor, compute_rotation_angle)
+from .timeseries import  TimeSeries, Disp, Vel, Acc, Raw, Unitless
+from .ts_utils import (haversine, compute_azimuth, rotate_channels, read_smc_v2,
+                       unit_convention_factor, compute_rotation_angle,
+                       canonical_params, file_digest, read_text_file)
 
 
 class Record:
-    """ Record Class """
+    """ Record Class 
+
+    The values of the nine timeseries are kept in one contiguous array 
+    (channels) of 3 quantities (disp, vel, acc) x 3 components (h1, h2, 
+    ver) x N samples; the value of each timeseries (e.g., disp_h1) is a 
+    view on it. The record is serialized as this one array, and record 
+    level processing (e.g., rotation) acts on all channels at once. The 
+    time and frequency vectors are derived from dt, the initial time, and
+    the number of samples.
+
+    The labels of a processing chain are applied in memory. The checkpoint
+    policy ("all", "final", or "none") decides which processed records of
+    the chain are written to the database: every step, the last one, or
+    none. label_checkpoints keeps the policies of single labels.
+    """
 
     pr_db = None
+    read_ahead = None
+    checkpoint = "all"
+    checkpoint_policies = ["all", "final", "none"]
+    label_checkpoints = {}
+    channel_names = [["disp_h1", "disp_h2", "disp_ver"],
+                     ["vel_h1", "vel_h2", "vel_ver"],
+                     ["acc_h1", "acc_h2", "acc_ver"]]
     ver_orientation_conv = None
     unit_convention = None
     processing_labels = {}
@@ -37,11 +61,11 @@ class Record:
                 vel_h1, vel_h2, vel_ver,
                 acc_h1, acc_h2, acc_ver,
                 station, source_params,
-                hc_or1, hc_or2, ver_or, unit):
+                hc_or1, hc_or2, ver_or, unit, channels=None):
+        # time_vec is derived from the timeseries (see time_vec); the 
+        # argument is kept for the callers.
 
         self.station = station
-        self.time_vec = time_vec
-        self.freq_vec = None
         self.disp_h1 = disp_h1
         self.disp_h2 = disp_h2
         self.disp_ver = disp_ver
@@ -51,6 +75,7 @@ class Record:
         self.acc_h1 = acc_h1
         self.acc_h2 = acc_h2
         self.acc_ver = acc_ver
+        self._pack_channels(channels)
         self.source_params = source_params
         self.hc_or1 = hc_or1
         self.hc_or2 = hc_or2
@@ -65,7 +90,6 @@ class Record:
         self.azimuth = None
         self._compute_source_dependent_params()
         self._compute_record_unique_ids()
-        self._compute_freq_vector()
         self.processed = []
 
     def __str__(self):
@@ -144,17 +168,151 @@ class Record:
         return
  
     
+    @staticmethod
+    def _source_file(incident_metadata, st_name):
+        """ Returns the path to the station file of the incident, and the
+        parameters that are used to load it. Returns None for the incident 
+        types that are not supported. """
+        incident_type = incident_metadata["incident_type"]
+        if incident_type == "hercules":
+            return (os.path.join(incident_metadata["incident_folder"],
+             incident_metadata["output_stations_directory"], st_name), {
+             "hr_or1": incident_metadata["hr_comp_orientation_1"],
+             "hr_or2": incident_metadata["hr_comp_orientation_2"],
+             "ver_or": incident_metadata["ver_comp_orientation"],
+             "unit": incident_metadata["incident_unit"]})
+        if incident_type == "cesmdv2":
+            return (os.path.join(incident_metadata["incident_folder"],
+             'seismic_records', st_name), {})
+        return None, {}
+
+    @staticmethod
+    def _source_key(station_file, station_obj, load_params, file_id):
+        """ Returns a hash value of the record source: file id, the loading
+        parameters, the station location, and the source hypocenter. """
+        content = "|".join([file_id, canonical_params({
+            "load": load_params,
+            "station": [station_obj.lat, station_obj.lon, station_obj.depth],
+            "source": Station.pr_source_loc})])
+        return hashlib.sha256(content.encode('utf-8')).hexdigest()
+
+    @staticmethod
+    def _original_hash(incident_name, st_name, station_obj, incident_metadata):
+        """ Returns the hash value of the original record. It is derived 
+        from the station file identity (path, size, modification time), so 
+        the same file gives the same hash in every session and incident. """
+        station_file, load_params = Record._source_file(incident_metadata,
+         st_name)
+        try:
+            stat = os.stat(station_file)
+            file_id = (f"{os.path.realpath(station_file)}:{stat.st_size}:"
+             f"{stat.st_mtime_ns}")
+        except (TypeError, OSError):
+            return hashlib.sha256((incident_name + st_name).encode('utf-8')
+             ).hexdigest()
+        return Record._source_key(station_file, station_obj, load_params,
+         file_id)
+
+    @staticmethod
+    def _content_id(incident_metadata, st_name, station_obj):
+        """ Returns the content id of a loaded original record. It is 
+        derived from the station file content, so copies of the file give the
+        same id. Processed records hash values are based on it. """
+        station_file, load_params = Record._source_file(incident_metadata,
+         st_name)
+        return Record._source_key(station_file, station_obj, load_params,
+         file_digest(station_file))
+
+    @staticmethod
+    def label_definition(label_name):
+        """ Returns the label type and the hyper parameters of the 
+        processing label. """
+        if label_name in Record.processing_labels:
+            return Record.processing_labels[label_name]
+        return TimeSeries.processing_labels[label_name]
+
+    @staticmethod
+    def processing_hash(parent_id, label_name):
+        """ Returns the hash value of the record that is processed with the
+        label. It is derived from the parent record content id, the label 
+        type, and the canonical hyper parameters (not the label name), so 
+        labels with the same parameters share the processed records.
+
+        Inputs:
+            | parent_id: content id of the parent record (unique_id_1)
+            | label_name: processing label name
+
+        Outputs:
+            | hash value
+        """
+        label_type, hyper_parameters = Record.label_definition(label_name)
+        content = "|".join([parent_id, label_type,
+         canonical_params(hyper_parameters)])
+        return hashlib.sha256(content.encode('utf-8')).hexdigest()
+
     def _compute_time_vec(self):
         # all records should have the most common length and dt
         pass
 
-    def _compute_freq_vector(self):
-        # all records should have same length, and df
-        # choosing value from one of signals
-        # however, make sure that all are the same. 
-        df = self.acc_h1.delta_f
-        s_size = len(self.acc_h1.fft_value)
-        self.freq_vec = np.array(range(s_size))*df + self.acc_h1.f_init_point
+    def _pack_channels(self, channels=None):
+        """ Puts the values of the timeseries into one contiguous channels 
+        array, and replaces them with views on it. If channels is provided,
+        the values are already views on it. Components of different lengths
+        are cut to the shortest one. """
+        components = [[getattr(self, name) for name in names] for names in
+         self.channel_names]
+        if channels is None:
+            n_points = min(len(ts.value) for row in components for ts in row)
+            if any(len(ts.value) != n_points for row in components
+             for ts in row):
+                LOGGER.warning("Timeseries of the record have different"
+                 f" lengths. They are cut to {n_points} samples.")
+            channels = np.empty((3, 3, n_points), dtype=np.result_type(
+             *[ts.value for row in components for ts in row]))
+            for i, row in enumerate(components):
+                for j, ts in enumerate(row):
+                    channels[i, j] = ts.value[:n_points]
+
+        self.channels = channels
+        for i, row in enumerate(components):
+            for j, ts in enumerate(row):
+                ts.value = channels[i, j]
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        # values of the timeseries are views on channels, which is stored
+        # once.
+        for names in self.channel_names:
+            for name in names:
+                state[name] = copy.copy(state[name])
+                state[name].value = None
+        return state
+
+    def __setstate__(self, state):
+        # records of older databases keep the time and frequency vectors,
+        # and the values of the timeseries in separate arrays.
+        state.pop("time_vec", None)
+        state.pop("freq_vec", None)
+        state.pop("_freq_vec", None)
+        self.__dict__.update(state)
+        if state.get("channels") is None:
+            self._pack_channels()
+            return
+        for i, names in enumerate(self.channel_names):
+            for j, name in enumerate(names):
+                getattr(self, name).value = self.channels[i, j]
+
+    @property
+    def time_vec(self):
+        """ Time vector of the timeseries. """
+        return (np.arange(self.channels.shape[-1])*self.acc_h1.delta_t +
+         self.acc_h1.t_init_point)
+
+    @property
+    def freq_vec(self):
+        """ Frequency vector of the FFT values (see TimeSeries.fft_axis). """
+        s_size, df = self.acc_h1.fft_axis()
+        return np.arange(s_size)*df + self.acc_h1.f_init_point
 
     def export_to_hercules(self, filename):
         pass
@@ -199,9 +357,17 @@ class Record:
             return
 
         # generate original record hash value.
-        hash_val = hashlib.sha256(
-            (incident_name + st_name).\
-            encode('utf-8')).hexdigest()
+        hash_val = Record._original_hash(incident_name, st_name, station_obj,
+         incident_metadata)
+
+        # a warm query only needs the final processed record. Otherwise,
+        # processing resumes from the longest processed part of the chain.
+        if list_process:
+            tmp_rec, n_done = Record._longest_cached_prefix(hash_val,
+             list_process)
+            if tmp_rec is not None:
+                return Record._get_processed_record(incident_name, tmp_rec,
+                 list_process[n_done:], (hash_val, list_process[:n_done]))
 
         # retrieve the record from database.
         record_org = Record.pr_db.get_value(hash_val)
@@ -211,60 +377,23 @@ class Record:
              f" type: {incident_type} at station: {st_name} has not been loaded"
               " to the database. Loading ... " )
             # we need to load the data 
-            if incident_type == "hercules":
+            if incident_type in ["hercules", "cesmdv2"]:
+                try:
+                    record_org = Record._load_source(station_obj,
+                     incident_metadata, st_name)
 
-                station_folder = incident_metadata["output_stations_directory"]
-                hr_or1 = float(incident_metadata["hr_comp_orientation_1"])
-                hr_or2 = float(incident_metadata["hr_comp_orientation_2"])
-                ver_or = incident_metadata["ver_comp_orientation"]
-                inc_unit = incident_metadata["incident_unit"]
+                    if record_org is not None:
+                        record_org.this_record_hash = hash_val
+                        record_org.unique_id_1 = Record._content_id(
+                            incident_metadata, st_name, station_obj)
 
-                station_file = os.path.join(incident_metadata[
-                    "incident_folder"],station_folder,st_name)
-                try:
-                    record_org = Record._from_hercules(station_file,
-                        station_obj, Station.pr_source_loc, hr_or1, hr_or2,
-                         ver_or, inc_unit)
-                    record_org.this_record_hash = hash_val
-    
-                    # put the record in the database.
-                    Record.pr_db.set_value(hash_val,record_org)
-                    Record.pr_inc_tracker.track_incident_hash(incident_name,
-                     hash_val)
-                
-                except Exception as e:
-                    record_org = None
-                    LOGGER.warning(f"{st_name} from {incident_name} could not"
-                     " load. " + str(e))
-               
-            if incident_type == "cesmdv2":
-                station_file = os.path.join(incident_metadata[
-                    "incident_folder"],'seismic_records',st_name)
+                        # put the record in the database.
+                        nbytes = Record.pr_db.set_value(hash_val,
+                         record_org, segment=incident_name)
+                        Record.pr_inc_tracker.track_incident_hash(
+                            incident_name, hash_val, kind="original",
+                            nbytes=nbytes)
 
-                try:
-                    
-                    # load cesmdv2 file
-                    
-                    tmp_loaded_data, tmp_meta_data = read_smc_v2(station_file)
-                    
-                    if tmp_loaded_data is None:
-                        record_org = None
-                    else:
-                        # create a record object
-                        record_org = Record._from_cesmdv2(tmp_loaded_data, 
-                         tmp_meta_data, station_obj, Station.pr_source_loc, st_name)
-    
-                        if record_org is None:
-                            pass
-                        else:
-                            record_org.this_record_hash = hash_val
-            
-                            # put the record in the database.
-                            Record.pr_db.set_value(hash_val,record_org)
-                            Record.pr_inc_tracker.track_incident_hash(
-                                incident_name, hash_val
-                                )
-                
                 except Exception as e:
                     record_org = None
                     LOGGER.warning(f"{st_name} from {incident_name} could not"
@@ -289,72 +418,179 @@ class Record:
 
         
         processed_record = Record._get_processed_record(incident_name, 
-         record_org, list_process)
+         record_org, list_process, (hash_val, []))
 
         return processed_record
 
     @staticmethod
-    def _get_processed_record(incident_name, record, list_process):
+    def _load_source(station_obj, incident_metadata, st_name,
+     read_ahead=True):
+        """ Reads and parses the station file of the incident, and returns 
+        its original record (without hash values), or None if it could not
+        be parsed. Records that are parsed by the read-ahead of the query 
+        (see read_ahead.ReadAhead) are taken from it. The digest of the 
+        file is kept (see ts_utils.read_text_file), so the content id of the
+        record does not read the file again.
+
+        Inputs:
+            | station_obj: a station object
+            | incident_metadata: a dictionary of incident metadata
+            | st_name: station file name
+            | read_ahead: uses the read-ahead of the query (False in the 
+              read-ahead threads)
+        """
+        station_file, _ = Record._source_file(incident_metadata, st_name)
+        if read_ahead and Record.read_ahead is not None:
+            record = Record.read_ahead.get(station_file)
+            if record is not None:
+                return record
+
+        content = read_text_file(station_file)
+        incident_type = incident_metadata["incident_type"]
+        if incident_type == "hercules":
+            return Record._from_hercules(station_file, station_obj,
+             Station.pr_source_loc,
+             float(incident_metadata["hr_comp_orientation_1"]),
+             float(incident_metadata["hr_comp_orientation_2"]),
+             incident_metadata["ver_comp_orientation"],
+             incident_metadata["incident_unit"], content=content)
+        if incident_type == "cesmdv2":
+            signal, file_metadata = read_smc_v2(station_file, content)
+            if signal is None:
+                return None
+            return Record._from_cesmdv2(signal, file_metadata, station_obj,
+             Station.pr_source_loc, st_name)
+        return None
+
+    @staticmethod
+    def chain_hash(original_hash, list_process):
+        """ Returns the hash value of a processing chain: the original 
+        record and the ordered list of processing labels (by their type and
+        hyper parameters).
+
+        Inputs:
+            | original_hash: hash value of the original record
+            | list_process: ordered list of processing labels
+
+        Outputs:
+            | hash value
+        """
+        content = original_hash
+        for label_name in list_process:
+            label_type, hyper_parameters = Record.label_definition(label_name)
+            content += f"|{label_type}:{canonical_params(hyper_parameters)}"
+        return hashlib.sha256(content.encode('utf-8')).hexdigest()
+
+    @staticmethod
+    def _longest_cached_prefix(original_hash, list_process):
+        """ Returns the processed record of the longest part of the chain
+        (from the start) that is in the database, and the number of its 
+        labels. Returns (None, 0) if no part is found. """
+        chain_keys = [Record.chain_hash(original_hash, list_process[:n])
+         for n in range(len(list_process), 0, -1)]
+        chain_records = Record.pr_inc_tracker.chain_records(chain_keys)
+
+        for n, chain_key in zip(range(len(list_process), 0, -1), chain_keys):
+            if chain_key not in chain_records:
+                continue
+            tmp_rec = Record.pr_db.get_value(chain_records[chain_key])
+            if tmp_rec:
+                return tmp_rec, n
+
+        return None, 0
+
+    @staticmethod
+    def _get_processed_record(incident_name, record, list_process, chain=None,
+     final=True):
         """ Returns the processed records based on hash value of the 
         record and the processing label. Developers should call this
-        function only by original record.
-        """
+        function only by original record, or a record of a processing chain.
 
-        # by this point the list of process has been controled for valid items. 
-        
-        try:
-            pl = list_process.pop(0)
-        except IndexError:
-            return record
+        chain is the original record hash and the list of labels that are 
+        applied to the record so far. If it is provided, each processed 
+        record is also indexed by its chain hash (see chain_hash).
 
-        hash_content = record.unique_id_1 + record.unique_id_1 + pl
-        proc_hash_val = hashlib.sha256((hash_content).encode('utf-8')).\
-            hexdigest()
+        The labels are applied one after the other in memory; the result of
+        a step is written to the database according to the checkpoint 
+        policy of its label (see checkpoint). If final is False, the last
+        step is an intermediate record (e.g., of a query plan).
+        """
 
-        if proc_hash_val in record.processed:
-            # this process has been done before, get it from database.
+        # by this point the list of process has been controled for valid items. 
+        n_steps = len(list_process)
+        for step, pl in enumerate(list_process):
+            proc_hash_val = Record.processing_hash(record.unique_id_1, pl)
+            if chain is not None:
+                chain = (chain[0], chain[1] + [pl])
+
+            # this process might have been done before (also by another
+            # label with the same parameters, or another incident with the
+            # same record).
             tmp_rec = Record.pr_db.get_value(proc_hash_val)
             if tmp_rec:
-                return Record._get_processed_record(incident_name, tmp_rec,
-                 list_process)
-            
-               
-        # if the code flow gets here, it means the requested label is not
-        # computed, or it is computed, however, some how could not retireve
-        # from db. As a result, we need to apply that label to the record, 
-        # add the hash value to the processed attribute, and put the hash and
-        # value into the database.
-        proc_record = Record._apply(record, pl)
-
-        if not proc_record:
-            # if cannot process the record, return None. By this point
-            # other loggers reported the problem. 
-            return None
+                Record._add_chain_key(chain, proc_hash_val)
+                record = tmp_rec
+                continue
 
+            # if the code flow gets here, it means the requested label is 
+            # not computed, or it is computed, however, some how could not
+            # retireve from db. As a result, we need to apply that label to
+            # the record, and, if it is checkpointed, put the hash and value
+            # into the database, and add the lineage.
+            proc_record = Record._apply(record, pl)
 
-        proc_record.this_record_hash = proc_hash_val
-        
-        # put data in the database
-        Record.pr_db.set_value(proc_hash_val,proc_record)
-        Record.pr_inc_tracker.track_incident_hash(incident_name,
-                    proc_hash_val)
-
-        # add hash value into processed values
-        # and update it on the data base.
-        Record._add_proc_key(record, proc_hash_val)
-        
-        return Record._get_processed_record(incident_name, proc_record,
-         list_process)
+            if not proc_record:
+                # if cannot process the record, return None. By this point
+                # other loggers reported the problem. 
+                return None
+
+            if proc_record is record:
+                # labels that do not change the record (e.g., the same 
+                # vertical orientation) return it; the parent keeps its ids.
+                proc_record = copy.copy(record)
+            proc_record.this_record_hash = proc_hash_val
+            proc_record.unique_id_1 = proc_hash_val
+
+            if Record._is_checkpoint(pl, final and step == n_steps - 1):
+                # put data in the database
+                nbytes = Record.pr_db.set_value(proc_hash_val, proc_record,
+                 segment=incident_name)
+                Record.pr_inc_tracker.track_incident_hash(incident_name,
+                 proc_hash_val, label=pl, nbytes=nbytes)
+
+                # add the lineage; the parent record is not changed.
+                Record._add_proc_key(record, proc_hash_val, pl)
+                Record._add_chain_key(chain, proc_hash_val)
+
+            record = proc_record
+
+        return record
+
+    @staticmethod
+    def _is_checkpoint(label_name, is_final):
+        """ Returns True if the result of the label should be written to the
+        database: always with the "all" policy, only at the end of the chain 
+        with "final", and never with "none". The policy of the label (see 
+        label_checkpoints) takes precedence over the checkpoint policy. """
+        policy = Record.label_checkpoints.get(label_name, Record.checkpoint)
+        return policy == "all" or (policy == "final" and is_final)
+
+    @staticmethod
+    def _add_chain_key(chain, hash_val):
+        """ Indexes the processed record by the hash value of its chain. """
+        if chain is not None:
+            Record.pr_inc_tracker.track_chain(Record.chain_hash(*chain),
+             hash_val)
  
     @staticmethod
-    def _add_proc_key(record, hash_val):
-        """ Includes the hash value of the new processed record of this record
-         into record's processed attribute. It also updates the record on the
-         database.
+    def _add_proc_key(record, hash_val, label_name):
+        """ Adds the lineage of the new processed record (parent hash, 
+         label, child hash) to the tracker's lineage table. The record itself
+         is not changed or written again; its processed attribute is only 
+         kept for the records of older databases.
         """ 
-        record.processed.append(hash_val)
-        this_record_hash = record.this_record_hash
-        Record.pr_db.set_value(this_record_hash,record)
+        Record.pr_inc_tracker.track_lineage(record.this_record_hash,
+         label_name, hash_val)
         # this hash value is already in the tracker. No need to add agian. 
 
     @staticmethod    
@@ -363,87 +599,40 @@ class Record:
         new Record object representing the processed record. """
         
         if label_name in Record.processing_labels:
-            if  Record.processing_labels[label_name][0] == "rotate":
+            label_type = Record.processing_labels[label_name][0]
+            label_kwargs = Record.processing_labels[label_name][1]
+
+            if label_type == "rotate":
                 def extract_params(angle):
                     return angle
     
-                if label_name not in Record.processing_labels.keys():
-                    # this should never be invoked. 
-                    # I have checked the labels before. 
-                    LOGGER.warning("Label is not supported, ignored.")
-                    return
-    
-                
-                label_kwargs = Record.processing_labels[label_name][1]
-    
                 p = extract_params(**label_kwargs)
-                proc_record = rotate_record(record, p)
-                tmp_time_vector = proc_record[0]
-                tmp_disp_h1 = Disp(proc_record[1],record.disp_h1.delta_t,
-                 record.disp_h1.t_init_point)
-                tmp_disp_h2 = Disp(proc_record[2],record.disp_h2.delta_t,
-                 record.disp_h2.t_init_point)
-                tmp_disp_ver = Disp(proc_record[3],record.disp_ver.delta_t,
-                 record.disp_ver.t_init_point)
-                tmp_vel_h1 = Vel(proc_record[4],record.vel_h1.delta_t,
-                 record.vel_h1.t_init_point)
-                tmp_vel_h2 = Vel(proc_record[5],record.vel_h2.delta_t,
-                 record.vel_h2.t_init_point)
-                tmp_vel_ver = Vel(proc_record[6],record.vel_ver.delta_t,
-                 record.vel_ver.t_init_point)
-                tmp_acc_h1 = Acc(proc_record[7],record.acc_h1.delta_t,
-                 record.acc_h1.t_init_point)
-                tmp_acc_h2 = Acc(proc_record[8],record.acc_h2.delta_t,
-                 record.acc_h2.t_init_point)
-                tmp_acc_ver = Acc(proc_record[9],record.acc_ver.delta_t,
-                 record.acc_ver.t_init_point)
-                n_hc_or1 = proc_record[12]
-                n_hc_or2 = proc_record[13]
+                rotated = rotate_channels(record.channels, record.hc_or1,
+                 record.hc_or2, p)
+                if rotated is None:
+                    return None
+                channels, n_hc_or1, n_hc_or2 = rotated
                 n_ver_or = record.ver_or
                 n_unit = record.unit
             
-            elif Record.processing_labels[label_name][0] == "set_unit":
+            elif label_type == "set_unit":
                 def extract_params(unit):
                     return unit
 
-                label_kwargs = Record.processing_labels[label_name][1]
                 # requested unit
                 r_unit = extract_params(**label_kwargs)
                 ucf = unit_convention_factor(r_unit, record.unit)
                 
-                tmp_time_vector = record.time_vec
-                tmp_disp_h1 = Disp(record.disp_h1.value*ucf,
-                 record.disp_h1.delta_t, record.disp_h1.t_init_point)
-                tmp_disp_h2 = Disp(record.disp_h2.value*ucf,
-                 record.disp_h2.delta_t, record.disp_h2.t_init_point)
-                tmp_disp_ver = Disp(record.disp_ver.value*ucf,
-                 record.disp_ver.delta_t, record.disp_ver.t_init_point)
-
-                tmp_vel_h1 = Vel(record.vel_h1.value*ucf,
-                 record.vel_h1.delta_t, record.vel_h1.t_init_point)
-                tmp_vel_h2 = Vel(record.vel_h2.value*ucf,
-                 record.vel_h2.delta_t, record.vel_h2.t_init_point)
-                tmp_vel_ver = Vel(record.vel_ver.value*ucf,
-                 record.vel_ver.delta_t, record.vel_ver.t_init_point)
-
-                tmp_acc_h1 = Acc(record.acc_h1.value*ucf,
-                 record.acc_h1.delta_t, record.acc_h1.t_init_point)
-                tmp_acc_h2 = Acc(record.acc_h2.value*ucf,
-                 record.acc_h2.delta_t, record.acc_h2.t_init_point)
-                tmp_acc_ver = Acc(record.acc_ver.value*ucf,
-                 record.acc_ver.delta_t, record.acc_ver.t_init_point)
-
+                channels = record.channels*ucf
                 n_hc_or1 = record.hc_or1
                 n_hc_or2 = record.hc_or2
                 n_ver_or = record.ver_or
-
                 n_unit = r_unit
                 
-            elif Record.processing_labels[label_name][0] == "set_vertical_or":
+            elif label_type == "set_vertical_or":
                 def extract_params(ver_or):
                     return ver_or
 
-                label_kwargs = Record.processing_labels[label_name][1]
                 # requested unit
                 rver_or = extract_params(**label_kwargs)
 
@@ -454,41 +643,17 @@ class Record:
                 if record.ver_or == rver_or:
                     return record
 
-                tmp_time_vector = record.time_vec 
-                tmp_disp_h1 = Disp(record.disp_h1.value, record.disp_h1.delta_t,
-                 record.disp_h1.t_init_point)
-                tmp_disp_h2 = Disp(record.disp_h2.value, record.disp_h2.delta_t,
-                 record.disp_h2.t_init_point)
-                tmp_disp_ver = Disp(record.disp_ver.value*-1,
-                 record.disp_ver.delta_t, record.disp_ver.t_init_point)
-
-                tmp_vel_h1 = Vel(record.vel_h1.value,  record.vel_h1.delta_t,
-                 record.vel_h1.t_init_point)
-                tmp_vel_h2 = Vel(record.vel_h2.value,  record.vel_h2.delta_t,
-                 record.vel_h2.t_init_point)
-                tmp_vel_ver = Vel(record.vel_ver.value*-1,
-                 record.vel_ver.delta_t, record.vel_ver.t_init_point)
-
-                tmp_acc_h1 = Acc(record.acc_h1.value, record.acc_h1.delta_t,
-                 record.acc_h1.t_init_point)
-                tmp_acc_h2 = Acc(record.acc_h2.value, record.acc_h2.delta_t,
-                 record.acc_h2.t_init_point)
-                tmp_acc_ver = Acc(record.acc_ver.value*-1,
-                 record.acc_ver.delta_t, record.acc_ver.t_init_point)
-
+                channels = record.channels.copy()
+                channels[:, 2] *= -1
                 n_hc_or1 = record.hc_or1
                 n_hc_or2 = record.hc_or2
                 n_ver_or = rver_or
-
                 n_unit = record.unit
-               
 
-            elif Record.processing_labels[label_name][0] == "align_record":
+            elif label_type == "align_record":
                 def extract_params(hc_or1, hc_or2, ver_or):
                     return hc_or1, hc_or2, ver_or
                 
-                label_kwargs = Record.processing_labels[label_name][1]
-        
                 rhc_or1, rhc_or2, rver_or = extract_params(**label_kwargs)
 
                 current_h_or1 = record.hc_or1
@@ -505,41 +670,16 @@ class Record:
                 if rotation_angle == 0 and rver_or == current_ver_or:
                     return record
 
-                vertical_coeff = 1
-                if rver_or != current_ver_or:
-                    vertical_coeff = -1
-                    n_vertical_or = rver_or
-                                
-                #TODO: following piece of code are repeated in both rotation
-                # and here. 
-
-                proc_record = rotate_record(record, rotation_angle)
+                rotated = rotate_channels(record.channels, current_h_or1,
+                 current_h_or2, rotation_angle)
 
-                if not proc_record:
+                if not rotated:
                     LOGGER.error("A problem is happened with record rotation.")
                     return None
                 
-                tmp_time_vector = proc_record[0]
-                tmp_disp_h1 = Disp(proc_record[1],record.disp_h1.delta_t,
-                 record.disp_h1.t_init_point)
-                tmp_disp_h2 = Disp(proc_record[2],record.disp_h2.delta_t,
-                 record.disp_h2.t_init_point)
-                tmp_disp_ver = Disp(proc_record[3]*vertical_coeff,
-                 record.disp_ver.delta_t, record.disp_ver.t_init_point)
-                tmp_vel_h1 = Vel(proc_record[4],record.vel_h1.delta_t,
-                 record.vel_h1.t_init_point)
-                tmp_vel_h2 = Vel(proc_record[5],record.vel_h2.delta_t,
-                 record.vel_h2.t_init_point)
-                tmp_vel_ver = Vel(proc_record[6]*vertical_coeff,
-                 record.vel_ver.delta_t, record.vel_ver.t_init_point)
-                tmp_acc_h1 = Acc(proc_record[7],record.acc_h1.delta_t,
-                 record.acc_h1.t_init_point)
-                tmp_acc_h2 = Acc(proc_record[8],record.acc_h2.delta_t,
-                 record.acc_h2.t_init_point)
-                tmp_acc_ver = Acc(proc_record[9]*vertical_coeff,
-                 record.acc_ver.delta_t, record.acc_ver.t_init_point)
-                n_hc_or1 = proc_record[12]
-                n_hc_or2 = proc_record[13]
+                channels, n_hc_or1, n_hc_or2 = rotated
+                if rver_or != current_ver_or:
+                    channels[:, 2] *= -1
                 n_ver_or = rver_or
                 n_unit = record.unit
             
@@ -547,10 +687,16 @@ class Record:
                 LOGGER.warning("The processing lable is not defined.")
                 return None
 
+            return Record._from_channels(record, channels, n_hc_or1,
+             n_hc_or2, n_ver_or, n_unit)
+
         else: 
-        
-        # you are repeating yourself. Refactor it at the earliest
-        # convenient.
+            channels = Record._apply_on_channels(record, label_name)
+            if channels is not None:
+                return Record._from_channels(record, channels, record.hc_or1,
+                 record.hc_or2, record.ver_or, record.unit)
+
+            # timeseries of different delta_t are processed one by one.
             tmp_disp_h1 = record.disp_h1._apply(label_name)
             tmp_disp_h2 = record.disp_h2._apply(label_name)
             tmp_disp_ver = record.disp_ver._apply(label_name)
@@ -564,22 +710,56 @@ class Record:
             n_hc_or2 = record.hc_or2
             n_ver_or = record.ver_or
             n_unit = record.unit
-            
-                        
-            # TODO: check time vector
-            tmp_time_vector = np.array(range(len(tmp_disp_h1.value)))*\
-                    record.acc_h1.delta_t + record.acc_h1.t_init_point   
-    
 
-        return Record(tmp_time_vector, tmp_disp_h1, tmp_disp_h2, tmp_disp_ver,
-                                       tmp_vel_h1, tmp_vel_h2, tmp_vel_ver,
-                                       tmp_acc_h1, tmp_acc_h2, tmp_acc_ver,
-                                       record.station, record.source_params,
-                                       n_hc_or1, n_hc_or2, n_ver_or, n_unit)
+        # the time vector is derived from the timeseries.
+        return Record(None, tmp_disp_h1, tmp_disp_h2, tmp_disp_ver,
+                            tmp_vel_h1, tmp_vel_h2, tmp_vel_ver,
+                            tmp_acc_h1, tmp_acc_h2, tmp_acc_ver,
+                            record.station, record.source_params,
+                            n_hc_or1, n_hc_or2, n_ver_or, n_unit)
+
+    @staticmethod
+    def _apply_on_channels(record, label_name):
+        """ Applies a timeseries processing label on all nine timeseries in
+        one vectorized call over the channels, seen as a (9 x N) stack.
+        Returns the processed (3 x 3 x N') channels, or None if the label
+        is not a timeseries label or the timeseries do not have the same
+        delta_t (they are processed one by one, then). """
+        if label_name not in TimeSeries.processing_labels:
+            return None
+        delta_t = record.acc_h1.delta_t
+        if any(getattr(record, name).delta_t != delta_t for names in
+         Record.channel_names for name in names):
+            return None
+
+        label_type, label_kwargs = TimeSeries.processing_labels[label_name]
+        stack = record.channels.reshape(9, record.channels.shape[-1])
+        processed = TimeSeries.process_values(label_type, label_kwargs,
+         stack, delta_t)
+        if processed is None:
+            return None
+        return np.ascontiguousarray(processed).reshape(3, 3,
+         processed.shape[-1])
+
+    @staticmethod
+    def _from_channels(record, channels, hc_or1, hc_or2, ver_or, unit):
+        """ Returns a new Record of the same station and timing as the 
+        record, with the values of the (3 x 3 x N) channels array. The 
+        timeseries values are views on channels (no copies). """
+        timeseries = []
+        for i, (names, ts_class) in enumerate(zip(Record.channel_names,
+         [Disp, Vel, Acc])):
+            for j, name in enumerate(names):
+                ts = getattr(record, name)
+                timeseries.append(ts_class(channels[i, j], ts.delta_t,
+                 ts.t_init_point))
+
+        return Record(None, *timeseries, record.station, record.source_params,
+         hc_or1, hc_or2, ver_or, unit, channels=channels)
 
     @staticmethod
     def _from_hercules(filename,station_obj,source_hypocenter, hr_or1, hr_or2,
-     ver_or, inc_unit):
+     ver_or, inc_unit, content=None):
         """ Loads an instance of Hercules simulation results at one station.
         Returns a Record object.
         
@@ -591,6 +771,8 @@ class Record:
             | hr_or2: second horizontal component's orientation
             | ver_or: vertical component's orientation
             | inc_unit: Incident unit
+            | content: text content of the file, if it is already read (e.g.,
+              by a read-ahead)
 
         Outputs:
             | Record object 
@@ -610,7 +792,8 @@ class Record:
         acc_header = []
 
         try:
-            input_fp = open(filename, 'r')
+            input_fp = (open(filename, 'r') if content is None else
+             io.StringIO(content))
         
             for line in input_fp:
                 line = line.strip()
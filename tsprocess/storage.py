@@ -0,0 +1,706 @@
+"""
+storage.py
+====================================
+The core module for the on-disk storage backends of the database.
+"""
+
+import io
+import os
+import re
+import bz2
+import lzma
+import mmap
+import time
+import zlib
+import pickle
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:
+    # not available on Windows; only threads are coordinated.
+    fcntl = None
+
+import numpy as np
+
+from .log import LOGGER
+
+
+def pragma_statements(pragmas):
+    """ Returns a list of SQLite PRAGMA statements. Invalid pragmas are 
+    ignored.
+
+    Inputs:
+        | pragmas: dictionary of pragma names and values (e.g., 
+          {"journal_mode": "WAL", "synchronous": "NORMAL"})
+
+    Outputs:
+        | list of PRAGMA statements
+
+    Example:
+
+    >>> pragma_statements({"synchronous": "NORMAL", "page_size": 8192})
+    ['PRAGMA synchronous = NORMAL', 'PRAGMA page_size = 8192']
+    """
+    statements = []
+    for name, value in (pragmas or {}).items():
+        if not (re.fullmatch(r"[A-Za-z_]+", str(name)) and
+         re.fullmatch(r"[A-Za-z0-9_-]+", str(value))):
+            LOGGER.warning(f"Pragma '{name} = {value}' is not valid. Ignored.")
+            continue
+        statements.append(f"PRAGMA {name} = {value}")
+    return statements
+
+
+def create_database(filename, pragmas=None):
+    """ Creates an empty SQLite database file with the pragmas that set the 
+    file format (page_size, auto_vacuum). These pragmas only apply before
+    the first table is created. Existing files are not changed.
+
+    Inputs:
+        | filename: database file name
+        | pragmas: dictionary of pragma names and values
+    """
+    if os.path.exists(filename):
+        return
+
+    conn = sqlite3.connect(filename)
+    for statement in pragma_statements({name: value for name, value in
+     (pragmas or {}).items() if name in ["page_size", "auto_vacuum"]}):
+        conn.execute(statement)
+    # writes the database header with the file format.
+    conn.execute("VACUUM")
+    conn.close()
+
+
+class SqliteConnection:
+    """ A thread-safe wrapper around a sqlite3 connection. It follows the
+    interface of SqliteDict's connection (execute, executemany, select,
+    select_one, commit, close), so the DataBase class can talk to both
+    storage backends in the same way.
+    """
+
+    def __init__(self, filename, pragmas=None):
+        self.filename = filename
+        self.lock = threading.RLock()
+        self.conn = sqlite3.connect(filename, check_same_thread=False)
+        for statement in pragma_statements(pragmas):
+            self.conn.execute(statement)
+
+    def __str__(self):
+        return f"SqliteConnection: {self.filename}"
+
+    def __repr__(self):
+        return f"SqliteConnection({self.filename})"
+
+    def execute(self, req, arg=None):
+        with self.lock:
+            self.conn.execute(req, arg or ())
+
+    def executemany(self, req, items):
+        with self.lock:
+            self.conn.executemany(req, items)
+
+    def select(self, req, arg=None):
+        with self.lock:
+            return self.conn.execute(req, arg or ()).fetchall()
+
+    def select_one(self, req, arg=None):
+        with self.lock:
+            return self.conn.execute(req, arg or ()).fetchone()
+
+    def commit(self, blocking=True):
+        with self.lock:
+            self.conn.commit()
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+
+class ProcessLock:
+    """ A reentrant lock that is shared by the threads of one process and, 
+    through an exclusive lock on the lock file, by all processes that use the
+    same lock file. Without a lock file (or without fcntl), only the threads
+    are coordinated.
+
+    The file is opened on each outermost acquire, so that a forked process 
+    does not share the lock of its parent.
+    """
+
+    def __init__(self, filename=None):
+        self.filename = filename
+        self.lock = threading.RLock()
+        self.depth = 0
+        self.fp = None
+
+    def __str__(self):
+        return f"ProcessLock: {self.filename}"
+
+    def __repr__(self):
+        return f"ProcessLock({self.filename})"
+
+    def acquire(self):
+        self.lock.acquire()
+        if self.depth == 0 and self.filename and fcntl:
+            self.fp = open(self.filename, 'ab')
+            fcntl.flock(self.fp.fileno(), fcntl.LOCK_EX)
+        self.depth += 1
+
+    def release(self):
+        self.depth -= 1
+        if self.depth == 0 and self.fp is not None:
+            fcntl.flock(self.fp.fileno(), fcntl.LOCK_UN)
+            self.fp.close()
+            self.fp = None
+        self.lock.release()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *args):
+        self.release()
+
+
+class ConnectionPool:
+    """ A pool of sqlite3 connections to one database file for reading. 
+    Connections are opened when they are needed, up to size connections;
+    further readers wait for a free connection. In WAL journal mode, readers
+    do not block the writer (or each other) and see the last committed
+    data.
+    """
+
+    def __init__(self, filename, size=4, pragmas=None):
+        self.filename = filename
+        self.size = size
+        self.pragmas = pragmas
+        self.idle = []
+        self.opened = 0
+        self.condition = threading.Condition()
+
+    def __str__(self):
+        return f"ConnectionPool: {self.filename} ({self.opened}/{self.size})"
+
+    def __repr__(self):
+        return f"ConnectionPool({self.filename},{self.size})"
+
+    @contextmanager
+    def connection(self):
+        """ Yields a connection of the pool. """
+        with self.condition:
+            while not self.idle and self.opened >= self.size:
+                self.condition.wait()
+            if self.idle:
+                conn = self.idle.pop()
+            else:
+                conn = sqlite3.connect(self.filename, check_same_thread=False)
+                for statement in pragma_statements(self.pragmas):
+                    conn.execute(statement)
+                self.opened += 1
+        try:
+            yield conn
+        finally:
+            # ends the read transaction, so the next read sees new data.
+            conn.rollback()
+            with self.condition:
+                self.idle.append(conn)
+                self.condition.notify()
+
+    def close(self):
+        with self.condition:
+            for conn in self.idle:
+                conn.close()
+            self.opened -= len(self.idle)
+            self.idle = []
+
+
+class _ArrayPickler(pickle.Pickler):
+    """ Pickler that keeps numeric numpy arrays out of the pickle stream. """
+
+    def __init__(self, file, arrays):
+        super().__init__(file, protocol=pickle.HIGHEST_PROTOCOL)
+        self.arrays = arrays
+
+    def persistent_id(self, obj):
+        if type(obj) is np.ndarray and obj.dtype.kind in "biufc":
+            self.arrays.append(np.ascontiguousarray(obj))
+            return len(self.arrays) - 1
+        return None
+
+
+class _ArrayUnpickler(pickle.Unpickler):
+    """ Unpickler that resolves the arrays kept out of the pickle stream. """
+
+    def __init__(self, file, arrays):
+        super().__init__(file)
+        self.arrays = arrays
+
+    def persistent_load(self, pid):
+        return self.arrays[pid]
+
+
+def split_arrays(value):
+    """ Splits a value (e.g., Record object) into a small metadata pickle and
+    a list of numpy arrays that are referenced by the metadata.
+
+    Inputs:
+        | value: any picklable object
+
+    Outputs:
+        | meta: pickled value without the numeric arrays (bytes)
+        | arrays: list of C-contiguous numpy arrays
+
+    Example:
+
+    >>> meta, arrays = split_arrays({'a': np.arange(3), 'b': 'text'})
+    >>> len(arrays)
+    1
+    """
+    arrays = []
+    buffer = io.BytesIO()
+    _ArrayPickler(buffer, arrays).dump(value)
+    return buffer.getvalue(), arrays
+
+
+def join_arrays(meta, arrays):
+    """ Rebuilds the value from the metadata pickle and its arrays. Inverse
+    of the split_arrays function.
+
+    Example:
+
+    >>> meta, arrays = split_arrays({'a': np.arange(3), 'b': 'text'})
+    >>> join_arrays(meta, arrays)['a'].tolist()
+    [0, 1, 2]
+    """
+    return _ArrayUnpickler(io.BytesIO(meta), arrays).load()
+
+
+def shape_to_text(shape):
+    """ Returns the text form of an array shape (e.g., '3,1000'). """
+    return ",".join(str(i) for i in shape)
+
+
+def text_to_shape(text):
+    """ Returns the array shape of its text form. """
+    return tuple(int(i) for i in text.split(",")) if text else ()
+
+
+class ArrayCodec:
+    """ Compresses numpy arrays with a standard library codec (zlib, lzma, 
+    or bz2). The optional byte-shuffle step groups the n-th bytes of all 
+    items together before compression, which usually improves the
+    compression ratio of floating point time series. 
+    
+    Each encoded array is tagged (e.g., 'zlib+shuffle'), so decoding does not
+    depend on the current codec settings. Arrays that are not compressed 
+    ('none') are read back without copying.
+
+    Example:
+
+    >>> codec = ArrayCodec("zlib", 6, shuffle=True)
+    >>> tag, data = codec.encode(np.zeros(1000))
+    >>> tag, len(data) < 8000
+    ('zlib+shuffle', True)
+    >>> codec.decode(tag, data, '<f8', (1000,)).sum()
+    0.0
+    """
+
+    compressors = {
+        "zlib": (lambda data, level: zlib.compress(data, level), 
+         zlib.decompress, 6),
+        "lzma": (lambda data, level: lzma.compress(data, preset=level),
+         lzma.decompress, 6),
+        "bz2": (lambda data, level: bz2.compress(data, level),
+         bz2.decompress, 9)
+    }
+    valid_codecs = ["none"] + list(compressors)
+    VALUE_TAG = "tsprocess-arrays"
+
+    def __init__(self, name="none", level=None, shuffle=False):
+        if name not in self.valid_codecs:
+            LOGGER.warning(f"Codec '{name}' is not supported. Valid codecs:"
+             f" {self.valid_codecs}. Arrays are not compressed.")
+            name = "none"
+        self.name = name
+        self.level = (self.compressors[name][2] if level is None and 
+         name != "none" else level)
+        self.shuffle = shuffle and name != "none"
+        self.tag = name + ("+shuffle" if self.shuffle else "")
+        self.raw_bytes_encoded = 0
+        self.stored_bytes_encoded = 0
+        self.raw_bytes_decoded = 0
+        self.decode_time = 0
+
+    def __str__(self):
+        return f"ArrayCodec: {self.tag} (level: {self.level})"
+
+    def __repr__(self):
+        return f"ArrayCodec({self.name},{self.level},{self.shuffle})"
+
+    def encode(self, array):
+        """ Returns the codec tag and the encoded bytes of the array. """
+        data = np.ascontiguousarray(array).tobytes()
+        if self.name == "none":
+            encoded = data
+        else:
+            if self.shuffle and array.itemsize > 1:
+                data = np.frombuffer(data, dtype=np.uint8).reshape(
+                    -1, array.itemsize).T.tobytes()
+            encoded = self.compressors[self.name][0](data, self.level)
+        self.raw_bytes_encoded += len(data)
+        self.stored_bytes_encoded += len(encoded)
+        return self.tag, encoded
+
+    def decode(self, tag, data, dtype, shape):
+        """ Returns a read-only numpy array of the encoded bytes. """
+        dtype = np.dtype(dtype)
+        name = tag.split("+")[0]
+        if name == "none":
+            # zero-copy
+            return np.frombuffer(data, dtype=dtype).reshape(shape)
+        
+        t_0 = time.perf_counter()
+        data = self.compressors[name][1](data)
+        if tag.endswith("+shuffle") and dtype.itemsize > 1:
+            data = np.frombuffer(data, dtype=np.uint8).reshape(
+                dtype.itemsize, -1).T.tobytes()
+        array = np.frombuffer(data, dtype=dtype).reshape(shape)
+        self.decode_time += time.perf_counter() - t_0
+        self.raw_bytes_decoded += len(data)
+        return array
+
+    def encode_value(self, value):
+        """ Returns a blob of the value, where all arrays are encoded one by
+        one. This is the encoder of the pickle storage backend. """
+        meta, arrays = split_arrays(value)
+        encoded = [(array.dtype.str, shape_to_text(array.shape)) +
+         self.encode(array) for array in arrays]
+        return sqlite3.Binary(pickle.dumps((self.VALUE_TAG, meta, encoded),
+         protocol=pickle.HIGHEST_PROTOCOL))
+
+    def decode_value(self, blob):
+        """ Returns the value of a blob. Blobs of plain pickled values (e.g.,
+        written without compression) are also accepted. """
+        value = pickle.loads(bytes(blob))
+        if (isinstance(value, tuple) and len(value) == 3 and
+         value[0] == self.VALUE_TAG):
+            _, meta, encoded = value
+            return join_arrays(meta, [self.decode(tag, data, dtype,
+             text_to_shape(shape)) for dtype, shape, tag, data in encoded])
+        return value
+
+    def info(self):
+        """ Returns a dictionary of codec settings and statistics of this 
+        session. """
+        return {
+            "codec": self.name,
+            "level": self.level,
+            "shuffle": self.shuffle,
+            "raw_bytes_encoded": self.raw_bytes_encoded,
+            "stored_bytes_encoded": self.stored_bytes_encoded,
+            "raw_bytes_decoded": self.raw_bytes_decoded,
+            "decode_time": self.decode_time
+        }
+
+
+class ColumnarStore:
+    """ Dictionary-like storage backend that keeps the numpy arrays of each
+    value (e.g., a Record and its TimeSeries) as raw typed blobs next to a
+    small metadata row, instead of pickling the whole object. Arrays are read
+    back with np.frombuffer, without copying; they are read-only. 
+    Serialization time and bytes are counted in stats (see 
+    io_stats.IOStats), if it is provided.
+    """
+
+    RECORDS_TABLE = "records"
+    ARRAYS_TABLE = "arrays"
+
+    def __init__(self, filename, autocommit=True, pragmas=None, codec=None,
+     stats=None):
+        self.filename = filename
+        self.autocommit = autocommit
+        self.codec = codec or ArrayCodec()
+        self.stats = stats
+        self.conn = SqliteConnection(filename, pragmas)
+        self._create_tables()
+
+    def __str__(self):
+        return f"ColumnarStore: {self.filename}"
+
+    def __repr__(self):
+        return (f"ColumnarStore({self.filename},{self.autocommit},"
+         f"{self.codec!r})")
+
+    def _create_tables(self):
+        self.conn.execute(f'CREATE TABLE IF NOT EXISTS "{self.RECORDS_TABLE}"'
+         ' (key TEXT PRIMARY KEY, meta BLOB)')
+        self.conn.execute(f'CREATE TABLE IF NOT EXISTS "{self.ARRAYS_TABLE}"'
+         ' (key TEXT, idx INTEGER, dtype TEXT, shape TEXT, codec TEXT,'
+         ' raw_nbytes INTEGER, data BLOB, PRIMARY KEY (key, idx))')
+        self.conn.commit()
+
+    def _write_arrays(self, key, arrays, segment=None):
+        """ Writes the arrays of the key, and returns their stored size. """
+        rows = [(key, i, array.dtype.str, shape_to_text(array.shape)) +
+         (self.codec.tag, array.nbytes, self.codec.encode(array)[1])
+         for i, array in enumerate(arrays)]
+        self.conn.execute(f'DELETE FROM "{self.ARRAYS_TABLE}"'
+         ' WHERE key = ?', (key,))
+        self.conn.executemany(f'INSERT INTO "{self.ARRAYS_TABLE}"'
+         ' (key, idx, dtype, shape, codec, raw_nbytes, data) VALUES'
+         ' (?,?,?,?,?,?,?)', rows)
+        return sum(len(row[-1]) for row in rows)
+
+    def _read_arrays(self, key):
+        rows = self.conn.select(f'SELECT dtype, shape, codec, data FROM'
+         f' "{self.ARRAYS_TABLE}" WHERE key = ? ORDER BY idx', (key,))
+        return [self.codec.decode(tag, data, dtype, text_to_shape(shape))
+         for dtype, shape, tag, data in rows]
+
+    def compression_stats(self):
+        """ Returns the total raw and stored bytes of the arrays. """
+        raw, stored = self.conn.select_one(f'SELECT SUM(raw_nbytes),'
+         f' SUM(LENGTH(data)) FROM "{self.ARRAYS_TABLE}"')
+        return raw or 0, stored or 0
+
+    def set(self, key, value, segment=None):
+        """ Sets the value of the key, and returns its stored size in bytes
+        (metadata and encoded arrays). segment is not used by this backend.
+        """
+        t_0 = time.perf_counter()
+        meta, arrays = split_arrays(value)
+        if self.stats is not None:
+            self.stats.observe("serialize", time.perf_counter() - t_0)
+            self.stats.count("bytes_written", len(meta) +
+             sum(array.nbytes for array in arrays))
+        with self.conn.lock:
+            self.conn.execute(f'REPLACE INTO "{self.RECORDS_TABLE}"'
+             ' (key, meta) VALUES (?,?)', (key, meta))
+            nbytes = len(meta) + self._write_arrays(key, arrays, segment)
+            if self.autocommit:
+                self.conn.commit()
+        return nbytes
+
+    def __setitem__(self, key, value):
+        self.set(key, value)
+
+    def __getitem__(self, key):
+        with self.conn.lock:
+            item = self.conn.select_one(f'SELECT meta FROM'
+             f' "{self.RECORDS_TABLE}" WHERE key = ?', (key,))
+            if item is None:
+                raise KeyError(key)
+            arrays = self._read_arrays(key)
+        if self.stats is None:
+            return join_arrays(item[0], arrays)
+        self.stats.count("bytes_read", len(item[0]) +
+         sum(array.nbytes for array in arrays))
+        with self.stats.timer("deserialize"):
+            return join_arrays(item[0], arrays)
+
+    def get_many(self, keys):
+        """ Returns a dictionary of the found keys and their values. """
+        values = {}
+        with self.conn.lock:
+            for key in keys:
+                try:
+                    values[key] = self[key]
+                except KeyError:
+                    pass
+        return values
+
+    def __delitem__(self, key):
+        if key not in self:
+            raise KeyError(key)
+        with self.conn.lock:
+            self.conn.execute(f'DELETE FROM "{self.ARRAYS_TABLE}"'
+             ' WHERE key = ?', (key,))
+            self.conn.execute(f'DELETE FROM "{self.RECORDS_TABLE}"'
+             ' WHERE key = ?', (key,))
+            if self.autocommit:
+                self.conn.commit()
+
+    def delete_many(self, keys):
+        """ Deletes the keys with one statement per chunk of keys. Keys that
+        are not found are ignored. """
+        keys = list(keys)
+        with self.conn.lock:
+            for i in range(0, len(keys), 500):
+                chunk = tuple(keys[i:i+500])
+                marks = ",".join("?"*len(chunk))
+                self.conn.execute(f'DELETE FROM "{self.ARRAYS_TABLE}"'
+                 f' WHERE key IN ({marks})', chunk)
+                self.conn.execute(f'DELETE FROM "{self.RECORDS_TABLE}"'
+                 f' WHERE key IN ({marks})', chunk)
+            if self.autocommit:
+                self.conn.commit()
+
+    def __contains__(self, key):
+        return self.conn.select_one(f'SELECT 1 FROM "{self.RECORDS_TABLE}"'
+         ' WHERE key = ?', (key,)) is not None
+
+    def __len__(self):
+        return self.conn.select_one(f'SELECT COUNT(*) FROM'
+         f' "{self.RECORDS_TABLE}"')[0]
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def keys(self):
+        return [row[0] for row in self.conn.select(f'SELECT key FROM'
+         f' "{self.RECORDS_TABLE}" ORDER BY rowid')]
+
+    def values(self):
+        for key in self.keys():
+            yield self[key]
+
+    def items(self):
+        for key in self.keys():
+            yield key, self[key]
+
+    def commit(self, blocking=True):
+        self.conn.commit()
+
+    def close(self):
+        self.conn.commit()
+        self.conn.close()
+        LOGGER.debug(f"{self} is closed.")
+
+
+class MemmapStore(ColumnarStore):
+    """ Dictionary-like storage backend that appends the numpy arrays of each
+    value to one binary file per segment (e.g., per incident), and keeps an
+    index of (key, offset, dtype, shape) in SQLite. Arrays are read back as
+    read-only views on a memory-mapped file, so reading one station only
+    touches the pages it needs, and several processes share the OS page 
+    cache. The binary files are append-only; overwritten or deleted values
+    leave unused bytes behind until the segment is dropped.
+    """
+
+    ARRAYS_TABLE = "array_index"
+    ALIGNMENT = 64
+
+    def __init__(self, filename, autocommit=True, pragmas=None, codec=None,
+     stats=None):
+        self.segments_dir = os.path.splitext(filename)[0] + "_arrays"
+        self.segments = {}
+        os.makedirs(self.segments_dir, exist_ok=True)
+        super().__init__(filename, autocommit, pragmas, codec, stats)
+
+    def __str__(self):
+        return f"MemmapStore: {self.filename}"
+
+    def __repr__(self):
+        return (f"MemmapStore({self.filename},{self.autocommit},"
+         f"{self.codec!r})")
+
+    def _create_tables(self):
+        self.conn.execute(f'CREATE TABLE IF NOT EXISTS "{self.RECORDS_TABLE}"'
+         ' (key TEXT PRIMARY KEY, meta BLOB)')
+        self.conn.execute(f'CREATE TABLE IF NOT EXISTS "{self.ARRAYS_TABLE}"'
+         ' (key TEXT, idx INTEGER, segment TEXT, offset INTEGER,'
+         ' nbytes INTEGER, dtype TEXT, shape TEXT, codec TEXT,'
+         ' raw_nbytes INTEGER, PRIMARY KEY (key, idx))')
+        self.conn.execute(f'CREATE INDEX IF NOT EXISTS "{self.ARRAYS_TABLE}'
+         f'_segment" ON "{self.ARRAYS_TABLE}" (segment)')
+        self.conn.commit()
+
+    def _segment_path(self, segment):
+        return os.path.join(self.segments_dir,
+         re.sub(r'[^A-Za-z0-9_.-]', '_', segment) + ".bin")
+
+    def _segment_map(self, segment, end):
+        """ Returns a memory map of the segment file that covers the first
+        end bytes. The file is mapped again if it has grown. Old maps are 
+        not closed, since arrays might still be viewing them.
+        """
+        seg_map = self.segments.get(segment)
+        if seg_map is None or len(seg_map) < end:
+            with open(self._segment_path(segment), 'rb') as fp:
+                seg_map = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+            self.segments[segment] = seg_map
+        return seg_map
+
+    def _read_index(self, key):
+        return self.conn.select(f'SELECT segment, offset, nbytes, dtype,'
+         f' shape, codec FROM "{self.ARRAYS_TABLE}" WHERE key = ?'
+         ' ORDER BY idx', (key,))
+
+    def _view(self, segment, offset, nbytes, dtype, shape, tag):
+        """ Returns the array; uncompressed arrays are views on the memory
+        map. """
+        seg_map = self._segment_map(segment, offset + nbytes)
+        return self.codec.decode(tag, memoryview(seg_map)[offset:
+         offset + nbytes], dtype, text_to_shape(shape))
+
+    def _write_arrays(self, key, arrays, segment=None):
+        index = self._read_index(key)
+
+        if segment is None:
+            # keep the values of a key in its original segment.
+            segment = index[0][0] if index else "default"
+
+        if (len(index) == len(arrays) and all(row[0] == segment and
+         row[3] == array.dtype.str and
+         shape_to_text(array.shape) == row[4] and
+         np.array_equal(self._view(*row), array)
+         for row, array in zip(index, arrays))):
+            # arrays are already on the disk, only metadata is changed.
+            return sum(row[2] for row in index)
+
+        rows = []
+        with open(self._segment_path(segment), 'ab') as fp:
+            for i, array in enumerate(arrays):
+                offset = fp.tell()
+                padding = -offset % self.ALIGNMENT
+                fp.write(b'\0' * padding)
+                tag, data = self.codec.encode(array)
+                rows.append((key, i, segment, offset + padding, len(data),
+                 array.dtype.str, shape_to_text(array.shape), tag,
+                 array.nbytes))
+                fp.write(data)
+
+        self.conn.execute(f'DELETE FROM "{self.ARRAYS_TABLE}"'
+         ' WHERE key = ?', (key,))
+        self.conn.executemany(f'INSERT INTO "{self.ARRAYS_TABLE}"'
+         ' (key, idx, segment, offset, nbytes, dtype, shape, codec,'
+         ' raw_nbytes) VALUES (?,?,?,?,?,?,?,?,?)', rows)
+        return sum(row[4] for row in rows)
+
+    def _read_arrays(self, key):
+        return [self._view(*row) for row in self._read_index(key)]
+
+    def compression_stats(self):
+        """ Returns the total raw and stored bytes of the indexed arrays. """
+        raw, stored = self.conn.select_one(f'SELECT SUM(raw_nbytes),'
+         f' SUM(nbytes) FROM "{self.ARRAYS_TABLE}"')
+        return raw or 0, stored or 0
+
+    def segment_keys(self, segment):
+        """ Returns the list of keys that are stored in the segment. """
+        return [row[0] for row in self.conn.select(f'SELECT DISTINCT key FROM'
+         f' "{self.ARRAYS_TABLE}" WHERE segment = ?', (segment,))]
+
+    def drop_segment(self, segment):
+        """ Deletes all values of the segment, and removes its binary file.
+        """
+        with self.conn.lock:
+            self.conn.execute(f'DELETE FROM "{self.RECORDS_TABLE}" WHERE key'
+             f' IN (SELECT key FROM "{self.ARRAYS_TABLE}" WHERE segment = ?)',
+             (segment,))
+            self.conn.execute(f'DELETE FROM "{self.ARRAYS_TABLE}"'
+             ' WHERE segment = ?', (segment,))
+            self.conn.commit()
+            self.segments.pop(segment, None)
+            try:
+                os.remove(self._segment_path(segment))
+            except OSError:
+                pass
+        LOGGER.debug(f"Segment '{segment}' is dropped from {self}.")
+
+    def close(self):
+        self.segments = {}
+        super().close()
@@ -4,6 +4,9 @@ timeseries.py
 The core module for the TimeSeries class.
 """
 
+import threading
+from collections import OrderedDict
+
 import numpy as np
 from scipy.signal import (sosfiltfilt, filtfilt, ellip, butter, zpk2sos,
                           decimate, kaiser)
@@ -14,8 +17,23 @@ from .ts_utils import (cal_acc_response, get_period, get_points, FAS, taper,
                        seism_appendzeros, seism_cutting, unit_convention_factor)
 
 class TimeSeries:
-    """ TimeSeries Abstract Class """
+    """ TimeSeries Abstract Class 
+    
+    The FFT (fft_value, delta_f), the peak value (peak_vv, peak_vt), and
+    the response spectra of Acc are computed on first access and kept, so
+    creating a (processed) timeseries only costs the processing. The
+    Butterworth filters are designed once for each set of parameters (see
+    sos_cache_info).
+    """
     processing_labels = {}
+    lazy_attributes = ["fft_value", "delta_f", "peak_vv", "peak_vt",
+     "response_spectra"]
+    fft_fmin = 0.1
+    fft_s_factor = 3
+    sos_cache = OrderedDict()
+    sos_cache_capacity = 256
+    sos_cache_stats = {"hits": 0, "misses": 0}
+    sos_cache_lock = threading.Lock()
 
     label_types = {
         'lowpass_filter': {'fc': 'corner freq (Hz)','N': 'order (default:4)'},
@@ -38,16 +56,68 @@ class TimeSeries:
         self.t_init_point = None
         self.type = None
         self.unit = None
-        self.fft_value = None
-        self.delta_f = None
+        self._fft_value = None
+        self._delta_f = None
         self.f_init_point = 0
         self.notes = None
-        self.peak_vv = None
-        self.peak_vt = None
+        self._peak_vv = None
+        self._peak_vt = None
 
     def __str__(self):
         return "Timeseries abstract class"        
 
+    def __setstate__(self, state):
+        # timeseries of older databases keep the computed values as 
+        # attributes.
+        for name in self.lazy_attributes:
+            if name in state:
+                state["_" + name] = state.pop(name)
+        self.__dict__.update(state)
+
+    @property
+    def fft_value(self):
+        """ Smoothed Fourier amplitude spectrum (see ts_utils.FAS). """
+        if self._fft_value is None and self.value is not None:
+            self._compute_fft_value()
+        return self._fft_value
+
+    @fft_value.setter
+    def fft_value(self, fft_value):
+        self._fft_value = fft_value
+
+    @property
+    def delta_f(self):
+        """ Frequency step of fft_value. """
+        if self._delta_f is None and self.value is not None:
+            self._compute_fft_value()
+        return self._delta_f
+
+    @delta_f.setter
+    def delta_f(self, delta_f):
+        self._delta_f = delta_f
+
+    @property
+    def peak_vv(self):
+        """ Peak absolute value. """
+        if self._peak_vv is None and self.value is not None:
+            self._compute_peak()
+        return self._peak_vv
+
+    @peak_vv.setter
+    def peak_vv(self, peak_vv):
+        self._peak_vv = peak_vv
+
+    @property
+    def peak_vt(self):
+        """ Index of the peak absolute value. """
+        if self._peak_vt is None and self.value is not None:
+            self._compute_peak()
+        return self._peak_vt
+
+    @peak_vt.setter
+    def peak_vt(self, peak_vt):
+        self._peak_vt = peak_vt
+
     def add_note(self):
         pass
 
@@ -89,6 +159,81 @@ class TimeSeries:
 
         cls.processing_labels[label_name] = [label_type, argument_dict]
 
+    @staticmethod
+    def _butterworth(value, delta_t, btype, fc, N = 4):
+        """ Returns the value filtered by a zero-phase Butterworth filter
+        along its last axis, so a stack of timeseries of the same delta_t is
+        filtered in one call.
+
+        Inputs:
+            | value: signal value (N-D array, samples along the last axis)
+            | delta_t: time step (s)
+            | btype: 'lowpass', 'highpass', or 'bandpass'
+            | fc: corner frequency (Hz), or frequencies for bandpass
+            | N: filter order (default value = 4)
+        """
+        butter_sos = TimeSeries._butter_sos(btype, N, fc, delta_t)
+        # some scipy versions need a writable array of sections.
+        data = sosfiltfilt(butter_sos.copy(), value, axis=-1)
+        return data
+
+    @classmethod
+    def _butter_sos(cls, btype, N, fc, delta_t):
+        """ Returns the second-order sections of a Butterworth filter. The
+        sections are designed once for each (btype, order, normalized
+        corners, delta_t) and kept in a bounded process-wide cache, as the
+        same filter is applied to all timeseries of the same delta_t. The
+        returned array is shared, and read-only. """
+        Fs = 1/delta_t
+        Wn = fc/(Fs/2)
+        key = (btype, N, tuple(np.atleast_1d(Wn).tolist()), delta_t)
+        with cls.sos_cache_lock:
+            butter_sos = cls.sos_cache.get(key)
+            if butter_sos is not None:
+                cls.sos_cache.move_to_end(key)
+                cls.sos_cache_stats["hits"] += 1
+                return butter_sos
+            cls.sos_cache_stats["misses"] += 1
+
+        z, p, k = butter(N=N, Wn=Wn, btype=btype, analog=False,
+         output='zpk')
+        butter_sos = zpk2sos(z, p, k)
+        butter_sos.flags.writeable = False
+
+        with cls.sos_cache_lock:
+            cls.sos_cache[key] = butter_sos
+            while len(cls.sos_cache) > cls.sos_cache_capacity:
+                cls.sos_cache.popitem(last=False)
+        return butter_sos
+
+    @classmethod
+    def sos_cache_info(cls, reset=False):
+        """ Returns the hits, misses, size and capacity of the filter
+        design cache. If reset, the hit and miss counters are set to zero.
+
+        Example:
+
+        >>> TimeSeries.clear_sos_cache()
+        >>> acc = Acc(np.ones(100), 0.01, 0)
+        >>> _ = acc._lowpass_filter(5)
+        >>> _ = acc._lowpass_filter(5)
+        >>> TimeSeries.sos_cache_info()["hits"]
+        1
+        """
+        with cls.sos_cache_lock:
+            info = dict(cls.sos_cache_stats, size=len(cls.sos_cache),
+             capacity=cls.sos_cache_capacity)
+            if reset:
+                cls.sos_cache_stats.update(hits=0, misses=0)
+        return info
+
+    @classmethod
+    def clear_sos_cache(cls):
+        """ Removes the designed filters and resets the counters. """
+        with cls.sos_cache_lock:
+            cls.sos_cache.clear()
+            cls.sos_cache_stats.update(hits=0, misses=0)
+
     def _lowpass_filter(self, fc, N = 4):
         """ Returns a lowpass filtered (the Butterworth filter) signal value.
         
@@ -97,13 +242,7 @@ class TimeSeries:
             | N: filter order (default value = 4)
         
         """
-        Fs = 1/self.delta_t
-        Wn = fc/(Fs/2)
-        z, p, k = butter(N=N, Wn=Wn, btype='lowpass', analog=False,
-         output='zpk')
-        butter_sos = zpk2sos(z, p, k)
-        data = sosfiltfilt(butter_sos, self.value)
-        return data
+        return self._butterworth(self.value, self.delta_t, 'lowpass', fc, N)
 
     def _highpass_filter(self, fc, N = 4):
         """ Returns a highpass filtered (the Butterworth filter) signal value.
@@ -112,13 +251,7 @@ class TimeSeries:
             | fc: corner frequency (Hz)
             | N: filter order (default value = 4)
         """
-        Fs = 1/self.delta_t
-        Wn = fc/(Fs/2)
-        z, p, k = butter(N=N, Wn=Wn, btype='highpass', analog=False,
-         output='zpk')
-        butter_sos = zpk2sos(z, p, k)
-        data = sosfiltfilt(butter_sos, self.value)
-        return data    
+        return self._butterworth(self.value, self.delta_t, 'highpass', fc, N)
 
     def _bandpass_filter(self, fcs, N = 4 ):
         """ Returns a bandpass filtered (the Butterworth filter) signal value.
@@ -128,13 +261,7 @@ class TimeSeries:
             | N: filter order (default value = 4)
         
         """
-        Fs = 1/self.delta_t
-        Wn = fcs/(Fs/2)
-        z, p, k = butter(N=N, Wn=Wn, btype='bandpass', analog=False,
-         output='zpk')
-        butter_sos = zpk2sos(z, p, k)
-        data = sosfiltfilt(butter_sos, self.value)
-        return data    
+        return self._butterworth(self.value, self.delta_t, 'bandpass', fcs, N)
 
 
     def _scale(self, factor):
@@ -146,6 +273,62 @@ class TimeSeries:
         """
         return self.value * factor    
 
+    @staticmethod
+    def process_values(label_type, label_kwargs, value, delta_t):
+        """ Returns the processed value along its last axis. The value can
+        be one timeseries or a stack of timeseries of the same delta_t
+        (e.g., the (9 x N) channels of a record); each one is processed as
+        if it were alone.
+
+        Inputs:
+            | label_type: one of the label_types
+            | label_kwargs: arguments of the label type
+            | value: signal value (N-D array, samples along the last axis)
+            | delta_t: time step (s)
+
+        Outputs:
+            | processed value
+        """
+        if label_type in ['lowpass_filter', 'highpass_filter']:
+            def extract_params(fc, N=4):
+                return fc, N
+            fc, N = extract_params(**label_kwargs)
+            return TimeSeries._butterworth(value, delta_t,
+             label_type.split('_')[0], fc, N)
+
+        if label_type == 'bandpass_filter':
+            def extract_params(fcs, N=4):
+                return fcs, N
+            fcs, N = extract_params(**label_kwargs)
+            return TimeSeries._butterworth(value, delta_t, 'bandpass', fcs, N)
+
+        if label_type == 'scale':
+            def extract_params(factor):
+                return factor
+            return value * extract_params(**label_kwargs)
+
+        if label_type == 'taper':
+            def extract_params(flag, m):
+                return flag, m
+            p = extract_params(**label_kwargs)
+            taper_window = taper(p[0], p[1], value)
+            return value * taper_window
+
+        if label_type == 'cut':
+            def extract_params(flag, t_diff, m):
+                return flag, t_diff, m
+            p = extract_params(**label_kwargs)
+            return seism_cutting(p[0], p[1], p[2], value, delta_t)
+
+        if label_type == 'zero_pad':
+            def extract_params(flag, t_diff, m):
+                return flag, t_diff, m
+            p = extract_params(**label_kwargs)
+            return seism_appendzeros(p[0], p[1], p[2], value, delta_t)
+
+        LOGGER.warning(f"Label type {label_type} is not supported.")
+        return None
+
     def _apply(self, label_name):
         """ Applies the requested label_name on the timeseries
 
@@ -168,38 +351,8 @@ class TimeSeries:
         label_type = self.processing_labels[label_name][0]
         label_kwargs = self.processing_labels[label_name][1]
 
-        if label_type == 'lowpass_filter':
-            proc_data = self._lowpass_filter(**label_kwargs)
- 
-        if label_type == 'highpass_filter':
-            proc_data = self._highpass_filter(**label_kwargs)
- 
-        if label_type == 'bandpass_filter':
-            proc_data = self._bandpass_filter(**label_kwargs)
- 
-        if label_type == 'scale':
-            proc_data =  self._scale(**label_kwargs)
-
-        if label_type == 'taper':
-            def extract_params(flag, m):
-                return flag, m
-            p = extract_params(**label_kwargs)
-            taper_window = taper(p[0], p[1], self.value)
-            proc_data = self.value * taper_window            
-
-        if label_type == 'cut':
-            def extract_params(flag, t_diff, m):
-                return flag, t_diff, m
-            p = extract_params(**label_kwargs)
-            proc_data = seism_cutting(p[0], p[1], p[2],self.value,
-             self.delta_t)
-                       
-        if label_type == 'zero_pad':
-            def extract_params(flag, t_diff, m):
-                return flag, t_diff, m
-            p = extract_params(**label_kwargs)
-            proc_data = seism_appendzeros(p[0], p[1], p[2],self.value,
-             self.delta_t)
+        proc_data = self.process_values(label_type, label_kwargs, self.value,
+         self.delta_t)
 
         if ts_type == "Disp":
             return Disp(proc_data, self.delta_t, self.t_init_point)
@@ -222,17 +375,34 @@ class TimeSeries:
         self.value = value
         self.delta_t = dt
         self.t_init_point = t_init_point
-        self.peak_vv = np.max(abs(self.value))
-        self.peak_vt = np.argmax(abs(self.value))
+        # computed values of the former values are not valid.
+        self._peak_vv = None
+        self._peak_vt = None
+        self._fft_value = None
+        self._delta_f = None
+
+    def _compute_peak(self):
+        """ Computes the peak absolute value and its index. """
+        abs_value = abs(self.value)
+        self._peak_vv = np.max(abs_value)
+        self._peak_vt = np.argmax(abs_value)
+
+    def fft_axis(self):
+        """ Returns the number of FFT values and their frequency step, 
+        without computing the FFT (see _compute_fft_value). """
+        n_points = len(self.value)
+        deltaf = (1/self.delta_t)/n_points
+        return (len(range(n_points)[int(self.fft_fmin/deltaf):
+         int((1/self.delta_t)/deltaf) + 1]), deltaf)
 
     def _compute_fft_value(self):
         """ Computes FFT value by calling FAS function. """
-        fmin = 0.1
+        fmin = self.fft_fmin
         fmax = 1/self.delta_t
-        s_factor = 3
+        s_factor = self.fft_s_factor
         freq, afs = FAS(self.value, self.delta_t, len(self.value), fmin, fmax, s_factor)
-        self.delta_f = freq[1] - freq[0]
-        self.fft_value = afs
+        self._delta_f = freq[1] - freq[0]
+        self._fft_value = afs
 
 
 class Disp(TimeSeries):
@@ -243,7 +413,6 @@ class Disp(TimeSeries):
         self.t_init_point = t_init_point
         self.type = "Disp"
         self._add_values(value, dt, t_init_point)
-        self._compute_fft_value()
     
     def __str__(self):
         return (f"Disp signal, #points: {len(self.value)}, dt:{self.dt},"
@@ -264,7 +433,6 @@ class Vel(TimeSeries):
         self.t_init_point = t_init_point
         self.type = "Vel"
         self._add_values(value, dt, t_init_point)
-        self._compute_fft_value()
 
     def __str__(self):
         return (f"Vel signal, #points: {len(self.value)}, dt:{self.dt},"
@@ -288,9 +456,8 @@ class Acc(TimeSeries):
         self.dt = dt
         self.t_init_point = t_init_point
         self.type = "Acc"
+        self._response_spectra = None
         self._add_values(value, dt, t_init_point)
-        self._compute_fft_value()
-        self._compute_response_spectra()
         
     def __str__(self):
         return (f"Acc signal, #points: {len(self.value)}, dt:{self.dt},"
@@ -303,6 +470,22 @@ class Acc(TimeSeries):
         """ Returns Vel instance """
         pass
 
+    def _add_values(self, value, dt, t_init_point):
+        super()._add_values(value, dt, t_init_point)
+        self._response_spectra = None
+
+    @property
+    def response_spectra(self):
+        """ [periods, acceleration response] (see ts_utils.cal_acc_response).
+        """
+        if self._response_spectra is None and self.value is not None:
+            self._compute_response_spectra()
+        return self._response_spectra
+
+    @response_spectra.setter
+    def response_spectra(self, response_spectra):
+        self._response_spectra = response_spectra
+
     def _compute_response_spectra(self):
         """ Computes response spectra """
         tmin = 0.1
@@ -310,7 +493,7 @@ class Acc(TimeSeries):
         
         period = get_period(tmin, tmax)
         rsp = cal_acc_response(period, self.value, self.delta_t)
-        self.response_spectra = [period, rsp]
+        self._response_spectra = [period, rsp]
 
 class Raw(TimeSeries):
     """ Raw Class """
@@ -4,7 +4,11 @@ ts_utils.py
 The core module for timeseries helper functions.
 """
 
+import io
+import os
+import json
 import math
+import hashlib
 import inspect
 from math import radians, cos, sin, asin, sqrt, atan2
 
@@ -196,9 +200,12 @@ def taper(flag, m, ts_vec):
             | flag - set to 'front', 'end', or 'all' to taper at the beginning,
                    at the end, or at both ends of the timeseries
             | m - number of samples for tapering
+            | ts_vec - timeseries (samples along the last axis)
+
+        Outputs:
             | window - Taper window
         """
-        samples = len(ts_vec)
+        samples = ts_vec.shape[-1]
     
         window = kaiser(2*m+1, beta=14)
     
@@ -238,14 +245,14 @@ def seism_appendzeros(flag, t_diff, m, timeseries, delta_t):
         | flag - 'front' or 'end' - tapering flag passed to the taper function
         | t_diff - how much time to add (in seconds)
         | m - number of samples for tapering
-        | ts_vec - Input timeseries
+        | timeseries - Input timeseries (samples along the last axis)
     
     Outputs:
         | timeseries - zero-padded timeseries.    
     """
     ts_vec = timeseries.copy()
     num = int(t_diff / delta_t)
-    zeros = np.zeros(num)
+    zeros = np.zeros(ts_vec.shape[:-1] + (num,))
 
     if flag == 'front':
         # applying taper in the front
@@ -254,7 +261,7 @@ def seism_appendzeros(flag, t_diff, m, timeseries, delta_t):
             ts_vec = ts_vec * window
 
         # adding zeros in front of data
-        ts_vec = np.append(zeros, ts_vec)
+        ts_vec = np.concatenate([zeros, ts_vec], axis=-1)
 
     elif flag == 'end':
         if m != 0:
@@ -262,7 +269,7 @@ def seism_appendzeros(flag, t_diff, m, timeseries, delta_t):
             window = taper('end', m, ts_vec)
             ts_vec = ts_vec * window
 
-        ts_vec = np.append(ts_vec, zeros)
+        ts_vec = np.concatenate([ts_vec, zeros], axis=-1)
 
     return ts_vec
 
@@ -275,7 +282,7 @@ def seism_cutting(flag, t_diff, m, timeseries, delta_t):
         | flag - 'front' or 'end' - flag to indicate from where to cut samples
         | t_diff - how much time to cut (in seconds)
         | m - number of samples for tapering
-        | timeseries - Input timeseries
+        | timeseries - Input timeseries (samples along the last axis)
 
     Outputs:
         | timeseries - Output timeseries after cutting
@@ -284,13 +291,13 @@ def seism_cutting(flag, t_diff, m, timeseries, delta_t):
     ts_vec = timeseries.copy()
     num = int(t_diff / delta_t)
 
-    if num >= len(ts_vec):
+    if num >= ts_vec.shape[-1]:
         LOGGER.error("[ERROR]: fail to cut timeseries.")
         return timeseries
 
     if flag == 'front' and num != 0:
         # cutting timeseries
-        ts_vec = ts_vec[num:]
+        ts_vec = ts_vec[..., num:]
 
         # applying taper at the front
         window = taper('front', m, ts_vec)
@@ -299,7 +306,7 @@ def seism_cutting(flag, t_diff, m, timeseries, delta_t):
     elif flag == 'end' and num != 0:
         num *= -1
         # cutting timeseries
-        ts_vec = ts_vec[:num]
+        ts_vec = ts_vec[..., :num]
 
         # applying taper at the end
         window = taper('front', m, ts_vec)
@@ -387,6 +394,84 @@ def query_opt_params(opt_params, key):
     return opt_params.get(key, None)
 
 
+def canonical_params(params):
+    """ Returns a canonical text of the parameters (e.g., hyper parameters
+    of a processing label), to be used in hash values. Dictionary keys are 
+    sorted and numbers are written as floats, so equal parameters give the 
+    same text, regardless of their order or number type.
+
+    Inputs:
+        | params: dictionary, list, number, or string
+
+    Outputs:
+        | canonical text
+
+    Example:
+
+    >>> canonical_params({'fc': 1, 'N': 4}) == canonical_params({'N': 4.0,
+    ...  'fc': 1.0})
+    True
+    >>> canonical_params({'fcs': (0.1, 5), 'N': 4})
+    '{"N": 4.0, "fcs": [0.1, 5.0]}'
+    """
+    def normalize(value):
+        if value is None or isinstance(value, (bool, np.bool_)):
+            return value
+        if isinstance(value, (int, float, np.integer, np.floating)):
+            return float(value)
+        if isinstance(value, dict):
+            return {str(k): normalize(v) for k, v in value.items()}
+        if isinstance(value, (list, tuple, np.ndarray)):
+            return [normalize(item) for item in value]
+        return str(value)
+
+    return json.dumps(normalize(params), sort_keys=True)
+
+
+_file_digests = {}
+
+def file_digest(filename):
+    """ Returns the sha256 digest of the file content. Digests are 
+    memoized by the file path, size, and modification time.
+
+    Inputs:
+        | filename: path to the file
+
+    Outputs:
+        | hex digest
+    """
+    stat = os.stat(filename)
+    identity = (os.path.realpath(filename), stat.st_size, stat.st_mtime_ns)
+    digest = _file_digests.get(identity)
+    if digest is None:
+        sha = hashlib.sha256()
+        with open(filename, 'rb') as fp:
+            for chunk in iter(lambda: fp.read(1 << 20), b''):
+                sha.update(chunk)
+        digest = _file_digests[identity] = sha.hexdigest()
+    return digest
+
+
+def read_text_file(filename):
+    """ Returns the text content of the file (as open(filename, 'r') reads
+    it), and memoizes its digest (see file_digest), so the file is read 
+    once.
+
+    Inputs:
+        | filename: path to the file
+
+    Outputs:
+        | text content
+    """
+    stat = os.stat(filename)
+    with open(filename, 'rb') as fp:
+        data = fp.read()
+    identity = (os.path.realpath(filename), stat.st_size, stat.st_mtime_ns)
+    if len(data) == stat.st_size:
+        _file_digests[identity] = hashlib.sha256(data).hexdigest()
+    return io.TextIOWrapper(io.BytesIO(data)).read()
+
+
 def write_into_file(filepath, message):
 
     with open(filepath, 'a') as file1:
@@ -473,17 +558,29 @@ def compute_azimuth(lat1, lon1, lat2, lon2):
     return deg
 
 
-def rotate_record(record, rotation_angle):
-    """ Rotates a given record instance by rotation angle
-    
-    Input:
-        record: instance of Record class
-        rotation_angle: rotation angle in degrees
-    Output:
-        rotated record instane        
-    """
+def rotate_channels(channels, hc_or1, hc_or2, rotation_angle):
+    """ Rotates the horizontal components of a channels array (3 quantities
+    x 3 components x N samples, see Record) by rotation angle, with one 
+    matrix product for all quantities.
 
-    #TODO: channels of the record should be ordered during creating the record.
+    Inputs:
+        | channels: array of (disp, vel, acc) x (h1, h2, ver) x samples
+        | hc_or1: first horizontal component's orientation
+        | hc_or2: second horizontal component's orientation
+        | rotation_angle: rotation angle in degrees
+
+    Outputs:
+        | new rotated channels array, and the new orientations of the 
+          horizontal components, or None if the rotation is not valid.
+
+    Example:
+
+    >>> channels = np.zeros((3, 3, 2))
+    >>> channels[:, 0] = 1
+    >>> rotated, hc_or1, hc_or2 = rotate_channels(channels, 0, 90, 90)
+    >>> np.round(rotated[0, :, 0], 6).tolist(), hc_or1, hc_or2
+    ([0.0, 1.0, 0.0], 270, 0)
+    """
 
     # Check rotation angle
     if rotation_angle is None:
@@ -496,58 +593,27 @@ def rotate_record(record, rotation_angle):
          " Command ignored.")
         return None
 
-    # these info should be read from records:
-    x = record.hc_or1
-    y = record.hc_or2
-
-    n_hc_or1 = x
-    n_hc_or2 = y
-
-    rc_dis_1 = record.disp_h1.value.copy()
-    rc_dis_2 = record.disp_h2.value.copy()
-    rc_dis_v = record.disp_ver.value.copy()
-    
-    rc_vel_1 = record.vel_h1.value.copy()
-    rc_vel_2 = record.vel_h2.value.copy()
-    rc_vel_v = record.vel_ver.value.copy()
-    
-    rc_acc_1 = record.acc_h1.value.copy()
-    rc_acc_2 = record.acc_h2.value.copy()
-    rc_acc_v = record.acc_ver.value.copy()
-      
     # Calculate angle between two components
-    angle = round(y - x,2)
+    angle = round(hc_or2 - hc_or1,2)
     # We need two orthogonal channels
     if abs(angle) != 90 and abs(angle) != 270:
         LOGGER.error("Rotation needs two orthogonal channels!"
          "Command ignored.")
         return None
-    
 
     matrix = np.array([(math.cos(math.radians(rotation_angle)),
                     -math.sin(math.radians(rotation_angle))),
                    (math.sin(math.radians(rotation_angle)),
                     math.cos(math.radians(rotation_angle)))])
 
-    n_points = min(len(rc_dis_1), len(rc_dis_2), len(rc_dis_v),
-                   len(rc_vel_1), len(rc_vel_2), len(rc_vel_v),
-                   len(rc_acc_1), len(rc_acc_2), len(rc_acc_v),
-                   len(record.time_vec))
-
-    rcs_tmp = np.array([rc_dis_1,rc_dis_2,rc_dis_v,
-                   rc_vel_1,rc_vel_2,rc_vel_v,
-                   rc_acc_1,rc_acc_2,rc_acc_v, record.time_vec])
-    
-    rcs = rcs_tmp[:,0:n_points]
-   
     # Rotate
-    [rcs_dis_1, rcs_dis_2] = matrix.dot([rcs[0], rcs[1]])
-    [rcs_vel_1, rcs_vel_2] = matrix.dot([rcs[3], rcs[4]])
-    [rcs_acc_1, rcs_acc_2] = matrix.dot([rcs[6], rcs[7]])
+    rotated = np.empty_like(channels)
+    np.matmul(matrix, channels[:, :2], out=rotated[:, :2])
+    rotated[:, 2] = channels[:, 2]
 
     # Compute the record orientation        
-    n_hc_or1 = n_hc_or1 - rotation_angle
-    n_hc_or2 = n_hc_or2 - rotation_angle
+    n_hc_or1 = hc_or1 - rotation_angle
+    n_hc_or2 = hc_or2 - rotation_angle
     
     if n_hc_or1 < 0:
         n_hc_or1 = 360 + n_hc_or1
@@ -555,9 +621,27 @@ def rotate_record(record, rotation_angle):
     if n_hc_or2 < 0:
         n_hc_or2 = 360 + n_hc_or2
 
-    return  (rcs[9],  rcs_dis_1, rcs_dis_2, rcs[2],
-                        rcs_vel_1, rcs_vel_2, rcs[5],
-                        rcs_acc_1, rcs_acc_2, rcs[8],
+    return rotated, n_hc_or1, n_hc_or2
+
+
+def rotate_record(record, rotation_angle):
+    """ Rotates a given record instance by rotation angle
+    
+    Input:
+        record: instance of Record class
+        rotation_angle: rotation angle in degrees
+    Output:
+        rotated record instane        
+    """
+    rotated = rotate_channels(record.channels, record.hc_or1, record.hc_or2,
+     rotation_angle)
+    if rotated is None:
+        return None
+
+    rcs, n_hc_or1, n_hc_or2 = rotated
+    return  (record.time_vec, rcs[0, 0], rcs[0, 1], rcs[0, 2],
+                              rcs[1, 0], rcs[1, 1], rcs[1, 2],
+                              rcs[2, 0], rcs[2, 1], rcs[2, 2],
                         record.station, record.source_params,
                         n_hc_or1, n_hc_or2)
 
@@ -585,12 +669,14 @@ def read_data(signal):
     return data
 
 
-def read_smc_v2(input_file):
+def read_smc_v2(input_file, content=None):
     """
     Reads and processes a COSMOS V2 file
 
     Inputes:
         | input_file: Input file path
+        | content: text content of the file, if it is already read (e.g.,
+          by a read-ahead, see read_text_file)
 
     Outputs:
 
@@ -602,18 +688,21 @@ def read_smc_v2(input_file):
     record_list = []
 
     # Loads station into a string
-    try:
-        fp = open(input_file, 'r')
-    except IOError as e:
-        LOGGER.warning(f"{input_file} file not found.")
-        return None, None
+    if content is None:
+        try:
+            fp = open(input_file, 'r')
+        except IOError as e:
+            LOGGER.warning(f"{input_file} file not found.")
+            return None, None
 
-    # Print status message
-    LOGGER.debug(f"Reading {input_file} file.")
+        # Print status message
+        LOGGER.debug(f"Reading {input_file} file.")
 
-    # Read data
-    channels = fp.read()
-    fp.close()
+        # Read data
+        channels = fp.read()
+        fp.close()
+    else:
+        channels = content
 
     # Splits the string by channels
     channels = channels.split('/&')